@@ -12,7 +12,9 @@ const trainedModelSchema = new mongoose.Schema({
     batchSize: { type: Number, default: 16 },
     learningRate: { type: Number, default: 0.0001 },
     validationSplit: { type: Number, default: 0.2 },
-    enableSegmentation: { type: Boolean, default: false }
+    enableSegmentation: { type: Boolean, default: false },
+    warmStartFrom: { type: String, default: null },
+    timeBudgetMinutes: { type: Number, default: null }
   },
   metrics: {
     accuracy: { type: Number, default: 0 },
@@ -51,6 +51,9 @@ const DATA_DIR = path.join(__dirname, 'data');
 const UPLOADS_DIR = path.join(DATA_DIR, 'uploads');
 const TEMP_DIR = path.join(DATA_DIR, 'temp');
 const MODELS_DIR = path.join(DATA_DIR, 'models');
+const EMBEDDINGS_DIR = path.join(DATA_DIR, 'embeddings');
+const DATASET_CACHE_DIR = path.join(DATA_DIR, 'dataset_cache');
+const CLASSIFIERS = ['softmax', 'prototype', 'knn'];
 
 [UPLOADS_DIR, TEMP_DIR, MODELS_DIR].forEach(dir => {
   if (!fs.existsSync(dir)) fs.mkdirSync(dir, { recursive: true });
@@ -314,6 +317,7 @@ app.post('/api/classes/:classId/upload', upload.array('images', 100), async (req
     }
     
     broadcast({ type: 'images_uploaded', classId, count: savedImages.length });
+    refreshEmbeddings();
     res.json(savedImages);
   } catch (error) {
     console.error('Error uploading images:', error);
@@ -325,6 +329,7 @@ app.delete('/api/classes/:classId/samples/:sampleId', async (req, res) => {
   try {
     const { sampleId } = req.params;
     await MaterialImage.findByIdAndDelete(sampleId);
+    refreshEmbeddings();
     res.json({ success: true });
   } catch (error) {
     res.status(500).json({ error: 'Failed to delete sample' });
@@ -342,6 +347,7 @@ app.delete('/api/classes/:classId/samples', async (req, res) => {
       _id: { $in: sampleIds.map(id => new mongoose.Types.ObjectId(id)) } 
     });
     
+    refreshEmbeddings();
     res.json({ success: true, deleted: result.deletedCount });
   } catch (error) {
     res.status(500).json({ error: 'Failed to delete samples' });
@@ -563,6 +569,134 @@ function resolvePythonExecutable() {
 
 const pythonExecutable = resolvePythonExecutable();
 console.log(`Resolved python executable: ${pythonExecutable}`);
+
+// Embed new training images with the active model's backbone, so the
+// prototype/knn classifiers in predict.py recognise a class seconds after
+// its images are uploaded. Only new images are embedded; requests made
+// while a refresh runs are coalesced into one follow-up run, and requests
+// made during training wait for it to end, since both sync the same
+// dataset cache and compete for the CPU.
+let embeddingRefresh = null;
+let embeddingRefreshDeferred = false;
+
+async function refreshEmbeddings() {
+  if (currentTraining) {
+    embeddingRefreshDeferred = true;
+    return;
+  }
+  if (embeddingRefresh) {
+    embeddingRefresh.pending = true;
+    return;
+  }
+  embeddingRefresh = { pending: false };
+  const model = await TrainedModel.findOne({ isActive: true, status: 'completed' }).catch(() => null);
+  const modelPath = model && path.join(MODELS_DIR, model.modelId, 'model.keras');
+  if (!modelPath || !fs.existsSync(modelPath)) {
+    embeddingRefresh = null;
+    return;
+  }
+
+  const proc = spawn(pythonExecutable, [
+    path.join(__dirname, '..', 'worker', 'embedding_store.py'),
+    '--mongo-uri', MONGO_URI,
+    '--model', modelPath,
+    '--store-dir', path.join(EMBEDDINGS_DIR, model.modelId),
+    '--dataset-cache-dir', DATASET_CACHE_DIR
+  ]);
+  let output = '';
+  proc.stdout.on('data', (data) => { output += data.toString(); });
+  proc.stderr.on('data', (data) => console.error('Embedding refresh:', data.toString()));
+  proc.on('error', (err) => {
+    console.error('Failed to start embedding refresh:', err.message);
+    embeddingRefresh = null;
+  });
+  proc.on('close', (code) => {
+    if (!embeddingRefresh) return;
+    const { pending } = embeddingRefresh;
+    embeddingRefresh = null;
+    if (code === 0) {
+      const jsonLine = output.split('\n').find(l => l.startsWith('{'));
+      broadcast({ type: 'embeddings_updated', modelId: model.modelId, ...(jsonLine ? JSON.parse(jsonLine) : {}) });
+    } else {
+      console.error(`Embedding refresh exited with code ${code}`);
+    }
+    if (pending) refreshEmbeddings();
+  });
+}
+
+function endTraining() {
+  currentTraining = null;
+  if (embeddingRefreshDeferred) {
+    embeddingRefreshDeferred = false;
+    refreshEmbeddings();
+  }
+}
+
+function attachTrainListeners(proc, runId, modelId) {
+  currentTraining.process = proc;
+
+  // Events are handled one at a time, in order; a chunk may end mid-line
+  let partialLine = '';
+  let handled = Promise.resolve();
+
+  proc.stdout.on('data', (data) => {
+    const lines = (partialLine + data.toString()).split('\n');
+    partialLine = lines.pop();
+    const events = [];
+    for (const line of lines.filter(l => l.trim())) {
+      try {
+        events.push(JSON.parse(line));
+      } catch (e) {
+        broadcast({ type: 'training_log', runId, message: line });
+      }
+    }
+    // Only the latest batch progress of a chunk is worth sending on
+    const lastBatch = events.map(e => e.type).lastIndexOf('batch_end');
+    events.forEach((event, i) => {
+      if (event.type === 'batch_end' && i !== lastBatch) return;
+      handled = handled
+        .then(() => handleTrainingEvent(modelId, event))
+        .catch(err => console.error('Failed to handle training event:', err.message));
+    });
+  });
+
+  proc.stderr.on('data', (data) => {
+    const message = data.toString();
+    console.error('Training stderr:', message);
+    broadcast({ type: 'training_log', runId, message, level: 'error' });
+  });
+
+  proc.on('close', async (code) => {
+    // /api/training/stop has already recorded a stopped run, and a resumed
+    // run may have started since
+    if (!currentTraining || currentTraining.process !== proc) return;
+    const status = code === 0 ? 'completed' : 'failed';
+
+    await TrainedModel.findOneAndUpdate(
+      { modelId },
+      { 
+        status, 
+        completedAt: new Date(),
+        isActive: code === 0 
+      }
+    );
+
+    if (code === 0) {
+      await TrainedModel.updateMany({ modelId: { $ne: modelId } }, { isActive: false });
+    }
+
+    broadcast({ 
+      type: 'training_completed', 
+      runId, 
+      modelId, 
+      exitCode: code, 
+      status 
+    });
+
+    endTraining();
+  });
+}
+
 app.post('/api/training/start', async (req, res) => {
   if (currentTraining) {
     return res.status(400).json({ error: 'Training already in progress' });
@@ -574,9 +708,24 @@ app.post('/api/training/start', async (req, res) => {
       batchSize = 16, 
       learningRate = 0.0001, 
       validationSplit = 0.2,
-      enableSegmentation = false 
+      enableSegmentation = false,
+      warmStartFrom = null,
+      timeBudgetMinutes = null
     } = req.body;
 
+    if (timeBudgetMinutes !== null && !(Number(timeBudgetMinutes) > 0)) {
+      return res.status(400).json({ error: 'timeBudgetMinutes must be a positive number' });
+    }
+
+    // Fine-tune a previous model on the images added since, instead of
+    // training from ImageNet weights
+    if (warmStartFrom) {
+      const previous = await TrainedModel.findOne({ modelId: warmStartFrom, status: 'completed' });
+      if (!previous || !fs.existsSync(path.join(MODELS_DIR, warmStartFrom, 'model.keras'))) {
+        return res.status(400).json({ error: `No completed model ${warmStartFrom} to warm-start from` });
+      }
+    }
+
     const stats = await MaterialImage.aggregate([
       { $group: { _id: '$material_key', count: { $sum: 1 } } }
     ]);
@@ -606,7 +755,7 @@ app.post('/api/training/start', async (req, res) => {
       status: 'training',
       classes,
       classLabels,
-      config: { epochs, batchSize, learningRate, validationSplit, enableSegmentation },
+      config: { epochs, batchSize, learningRate, validationSplit, enableSegmentation, warmStartFrom, timeBudgetMinutes },
       samplesUsed: totalSamples
     });
 
@@ -634,54 +783,15 @@ app.post('/api/training/start', async (req, res) => {
       '--validation-split', validationSplit.toString(),
       '--enable-segmentation', enableSegmentation.toString()
     ];
-
-    function attachTrainListeners(proc) {
-      currentTraining.process = proc;
-
-      proc.stdout.on('data', (data) => {
-        const lines = data.toString().split('\n').filter(l => l.trim());
-        lines.forEach(async (line) => {
-          try {
-            const event = JSON.parse(line);
-            await handleTrainingEvent(modelId, event);
-          } catch (e) {
-            broadcast({ type: 'training_log', runId, message: line });
-          }
-        });
-      });
-
-      proc.stderr.on('data', (data) => {
-        const message = data.toString();
-        console.error('Training stderr:', message);
-        broadcast({ type: 'training_log', runId, message, level: 'error' });
-      });
-
-      proc.on('close', async (code) => {
-        const status = code === 0 ? 'completed' : 'failed';
-
-        await TrainedModel.findOneAndUpdate(
-          { modelId },
-          { 
-            status, 
-            completedAt: new Date(),
-            isActive: code === 0 
-          }
-        );
-
-        if (code === 0) {
-          await TrainedModel.updateMany({ modelId: { $ne: modelId } }, { isActive: false });
-        }
-
-        broadcast({ 
-          type: 'training_completed', 
-          runId, 
-          modelId, 
-          exitCode: code, 
-          status 
-        });
-
-        currentTraining = null;
-      });
+    if (warmStartFrom) {
+      args.push('--warm-start', warmStartFrom);
+    }
+    if (timeBudgetMinutes !== null) {
+      args.push('--time-budget', Number(timeBudgetMinutes).toString());
+    }
+    // Seconds between batch progress events (train.py default: 1)
+    if (process.env.TRAINING_EVENT_INTERVAL) {
+      args.push('--event-interval', process.env.TRAINING_EVENT_INTERVAL);
     }
 
     console.log(`Training: Using Python executable: ${pythonExecutable}`);
@@ -689,12 +799,12 @@ app.post('/api/training/start', async (req, res) => {
 
     try {
       const trainProcess = spawn(pythonExecutable, args);
-      attachTrainListeners(trainProcess);
+      attachTrainListeners(trainProcess, runId, modelId);
     } catch (err) {
       console.error(`Failed to spawn Python training process:`, err.message);
       await TrainedModel.findOneAndUpdate({ modelId }, { status: 'failed', completedAt: new Date() });
       broadcast({ type: 'training_log', runId, message: `Failed to start training: ${err.message}`, level: 'error' });
-      currentTraining = null;
+      endTraining();
     }
 
     res.json({ runId, modelId, status: 'started' });
@@ -704,6 +814,49 @@ app.post('/api/training/start', async (req, res) => {
   }
 });
 
+// Continue a stopped or crashed run from its last epoch checkpoint
+app.post('/api/training/resume/:modelId', async (req, res) => {
+  if (currentTraining) {
+    return res.status(400).json({ error: 'Training already in progress' });
+  }
+
+  try {
+    const { modelId } = req.params;
+    const model = await TrainedModel.findOne({ modelId });
+    if (!model || model.status === 'completed') {
+      return res.status(400).json({ error: `No interrupted run of ${modelId} to resume` });
+    }
+    if (!fs.existsSync(path.join(MODELS_DIR, modelId, 'checkpoint', 'state.json'))) {
+      return res.status(400).json({ error: `Model ${modelId} has no checkpoint to resume from` });
+    }
+
+    const runId = uuidv4();
+    await TrainedModel.findOneAndUpdate({ modelId }, { status: 'training', completedAt: null });
+    currentTraining = { runId, modelId, process: null };
+    broadcast({ type: 'training_started', runId, modelId, resumed: true });
+
+    const args = [
+      path.join(__dirname, '..', 'worker', 'train.py'),
+      '--resume', modelId,
+      '--mongo-uri', MONGO_URI
+    ];
+
+    try {
+      attachTrainListeners(spawn(pythonExecutable, args), runId, modelId);
+    } catch (err) {
+      console.error(`Failed to spawn Python training process:`, err.message);
+      await TrainedModel.findOneAndUpdate({ modelId }, { status: 'failed', completedAt: new Date() });
+      broadcast({ type: 'training_log', runId, message: `Failed to resume training: ${err.message}`, level: 'error' });
+      endTraining();
+    }
+
+    res.json({ runId, modelId, status: 'resumed' });
+  } catch (error) {
+    console.error('Error resuming training:', error);
+    res.status(500).json({ error: 'Failed to resume training' });
+  }
+});
+
 // 🔥 CLEAN + FIXED EVENT HANDLER — matches frontend naming perfectly
 async function handleTrainingEvent(modelId, event) {
   const runId =
@@ -782,6 +935,15 @@ async function handleTrainingEvent(modelId, event) {
       });
       break;
 
+    case "step_telemetry":
+      broadcast({
+        type: "training_telemetry",
+        runId,
+        modelId,
+        ...event
+      });
+      break;
+
     case "confusion_matrix":
       await TrainedModel.findOneAndUpdate(
         { modelId },
@@ -826,7 +988,7 @@ app.post('/api/training/stop', async (req, res) => {
   );
   
   broadcast({ type: 'training_stopped', runId: currentTraining.runId });
-  currentTraining = null;
+  endTraining();
   
   res.json({ success: true });
 });
@@ -870,7 +1032,11 @@ app.get('/api/training/history', async (req, res) => {
 
 app.post('/api/predict', upload.single('image'), async (req, res) => {
   try {
-    const { modelId, threshold = '0.15', maxMaterials = '5' } = req.body;
+    const { modelId, threshold = '0.15', maxMaterials = '5', classifier = 'softmax' } = req.body;
+    
+    if (!CLASSIFIERS.includes(classifier)) {
+      return res.status(400).json({ error: `classifier must be one of ${CLASSIFIERS.join(', ')}` });
+    }
     let model;
     
     if (modelId) {
@@ -921,7 +1087,10 @@ app.post('/api/predict', upload.single('image'), async (req, res) => {
           '--model', modelPath,
           '--labels', labelsPath,
           '--threshold', threshold.toString(),
-          '--max-materials', maxMaterials.toString()
+          '--max-materials', maxMaterials.toString(),
+          '--classifier', classifier,
+          '--embedding-store-dir', path.join(EMBEDDINGS_DIR, model.modelId),
+          '--dataset-cache-dir', DATASET_CACHE_DIR
         ], { timeout: 60000 });
         
         if (result.stdout) {
@@ -12,9 +12,10 @@ import requests
 from pathlib import Path
 from PIL import Image
 from pymongo import MongoClient
-import hashlib
 import time
 
+from image_preprocessing import get_image_hash
+
 MATERIAL_CATEGORIES = {
     'bricks': {
         'keywords': ['red brick wall', 'clay brick texture', 'brick masonry', 'brick pattern'],
@@ -72,11 +73,6 @@ SAMPLE_IMAGES = {
 }
 
 
-def get_image_hash(img_data):
-    """Generate hash for image data to avoid duplicates"""
-    return hashlib.md5(img_data).hexdigest()
-
-
 def download_image(url, timeout=10):
     """Download image from URL"""
     try:
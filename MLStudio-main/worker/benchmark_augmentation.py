@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark the training augmentation modes in train.py.
+
+For each --augmentation mode, measures how many batches per second the
+training tf.data pipeline delivers, and compares that with the time one
+training step of the Phase 1 model takes. A pipeline slower than the step
+starves training: the model waits on input instead of computing.
+"""
+
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from image_preprocessing import decode_image
+from predict import collect_image_paths
+from train import (AUGMENTATIONS, PRECISION_POLICIES, create_improved_model,
+                   create_tf_dataset, optimizers, select_precision_policy, tf)
+
+
+def load_images(sources, count, image_size):
+    """Decoded uint8 images from sources, or random pixels if none are given"""
+    if not sources:
+        rng = np.random.default_rng(0)
+        return rng.integers(0, 256, (count, image_size, image_size, 3),
+                            dtype=np.uint8)
+    paths = collect_image_paths(sources)[:count]
+    if not paths:
+        print('No images found')
+        sys.exit(1)
+    return np.stack([
+        decode_image(path, (image_size, image_size)) for path in paths
+    ])
+
+
+def time_pipeline(X, y, batch_size, augmentation, batches):
+    """Seconds per batch delivered by the training pipeline"""
+    dataset = create_tf_dataset(X,
+                                y,
+                                batch_size,
+                                augment=augmentation != 'none',
+                                augmentation=augmentation).repeat()
+    iterator = iter(dataset)
+    # The first batches include tracing and autotuning
+    for _ in range(3):
+        next(iterator)
+    start = time.perf_counter()
+    for _ in range(batches):
+        next(iterator)
+    return (time.perf_counter() - start) / batches
+
+
+def time_train_step(X, y, batch_size, steps):
+    """Seconds per Phase 1 training step on an in-memory batch"""
+    model, _ = create_improved_model(y.shape[1])
+    model.compile(optimizer=optimizers.AdamW(learning_rate=1e-3),
+                  loss='categorical_crossentropy')
+    images = X[:batch_size].astype(np.float32) / 255.0
+    labels = y[:batch_size]
+    for _ in range(2):
+        model.train_on_batch(images, labels)
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.train_on_batch(images, labels)
+    return (time.perf_counter() - start) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark training augmentation throughput')
+    parser.add_argument('--images', nargs='+', metavar='SOURCE',
+                        help='Directories, glob patterns or manifest files of images '
+                             '(default: random pixels)')
+    parser.add_argument('--count', type=int, default=512,
+                        help='Images to load (default: 512)')
+    parser.add_argument('--image-size', type=int, default=224,
+                        help='Target square size (default: 224)')
+    parser.add_argument('--batch-size', type=int, default=16,
+                        help='Training batch size (default: 16)')
+    parser.add_argument('--batches', type=int, default=50,
+                        help='Batches timed per mode (default: 50)')
+    parser.add_argument('--modes', nargs='+', choices=AUGMENTATIONS,
+                        default=list(AUGMENTATIONS),
+                        help='Augmentation modes to compare')
+    parser.add_argument('--skip-train-step', action='store_true',
+                        help='Only time the input pipelines')
+    parser.add_argument('--precision', choices=PRECISION_POLICIES,
+                        default='auto',
+                        help='Dtype policy of the timed training step, as in train.py '
+                             '(default: auto)')
+    args = parser.parse_args()
+
+    X = load_images(args.images, args.count, args.image_size)
+    y = tf.keras.utils.to_categorical(np.arange(len(X)) % 5, 5)
+
+    step_seconds = None
+    if not args.skip_train_step:
+        select_precision_policy(args.precision)
+        step_seconds = time_train_step(X, y, args.batch_size, 10)
+
+    results = []
+    for mode in args.modes:
+        seconds = time_pipeline(X, y, args.batch_size, mode, args.batches)
+        result = {
+            'augmentation': mode,
+            'batch_ms': seconds * 1000,
+            'images_per_second': args.batch_size / seconds
+        }
+        if step_seconds is not None:
+            result['train_step_ms'] = step_seconds * 1000
+            result['starves_training'] = seconds > step_seconds
+        results.append(result)
+
+    print(f"{'augmentation':<14} {'batch ms':>9} {'images/s':>9} "
+          f"{'step ms':>8} {'starves':>8}")
+    for r in results:
+        step = (f"{r['train_step_ms']:.1f}"
+                if 'train_step_ms' in r else 'n/a')
+        starves = (('yes' if r['starves_training'] else 'no')
+                   if 'starves_training' in r else 'n/a')
+        print(f"{r['augmentation']:<14} {r['batch_ms']:>9.1f} "
+              f"{r['images_per_second']:>9.0f} {step:>8} {starves:>8}")
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark the image decoders in image_preprocessing.py.
+
+Reports per-image decode time for each decoder and how closely its pixels
+match the reference 'pil' path. With --model/--labels it also reports how
+often the model's top-1 prediction agrees with the reference decode.
+"""
+
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from image_preprocessing import DECODERS, decode_image, normalize
+from predict import MODEL_CACHE, collect_image_paths, predict_each
+
+
+def time_decoder(image_bytes, decoder, image_size, repeats):
+    """Decode every image `repeats` times; returns (arrays, per-image seconds)"""
+    arrays = []
+    timings = []
+    for data in image_bytes:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            array = decode_image(data, image_size, decoder)
+        timings.append((time.perf_counter() - start) / repeats)
+        arrays.append(array)
+    return arrays, np.array(timings)
+
+
+def top1(model, preprocessing, arrays):
+    inputs = [normalize(array, preprocessing) for array in arrays]
+    return [int(np.argmax(row)) if row is not None else -1
+            for row, _ in predict_each(model, inputs)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark image decoders')
+    parser.add_argument('--images', nargs='+', required=True, metavar='SOURCE',
+                        help='Directories, glob patterns or manifest files of images')
+    parser.add_argument('--decoders', nargs='+', choices=DECODERS,
+                        default=list(DECODERS), help='Decoders to compare')
+    parser.add_argument('--image-size', type=int, default=224,
+                        help='Target square size (default: 224)')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Decodes per image per decoder (default: 3)')
+    parser.add_argument('--model', help='Model file for top-1 parity')
+    parser.add_argument('--labels', help='Labels JSON for --model')
+    args = parser.parse_args()
+
+    image_paths = collect_image_paths(args.images)
+    if not image_paths:
+        print('No images found')
+        sys.exit(1)
+
+    image_bytes = []
+    for path in image_paths:
+        with open(path, 'rb') as f:
+            image_bytes.append(f.read())
+
+    image_size = (args.image_size, args.image_size)
+    decoders = ['pil'] + [d for d in args.decoders if d != 'pil']
+
+    model = preprocessing = None
+    if args.model and args.labels:
+        model, _, preprocessing = MODEL_CACHE.get(args.model, args.labels)
+
+    reference = None
+    reference_top1 = None
+    results = []
+    for decoder in decoders:
+        try:
+            arrays, timings = time_decoder(image_bytes, decoder, image_size,
+                                           args.repeats)
+        except RuntimeError as e:
+            print(f'Skipping {decoder}: {e}')
+            continue
+
+        result = {
+            'decoder': decoder,
+            'images': len(arrays),
+            'mean_ms': float(timings.mean() * 1000),
+            'p95_ms': float(np.percentile(timings, 95) * 1000)
+        }
+        if reference is None:
+            reference = arrays
+            reference_time = timings.mean()
+        diffs = [np.abs(a.astype(np.float32) - r.astype(np.float32))
+                 for a, r in zip(arrays, reference)]
+        result['speedup'] = float(reference_time / timings.mean())
+        result['mean_abs_pixel_diff'] = float(np.mean([d.mean() for d in diffs]))
+        result['max_abs_pixel_diff'] = float(max(d.max() for d in diffs))
+
+        if model is not None:
+            predicted = top1(model, preprocessing, arrays)
+            if reference_top1 is None:
+                reference_top1 = predicted
+            result['top1_agreement'] = float(np.mean(
+                [p == r for p, r in zip(predicted, reference_top1)]))
+
+        results.append(result)
+
+    print(f"{'decoder':<10} {'mean ms':>9} {'p95 ms':>9} {'speedup':>8} "
+          f"{'mean |dpx|':>11} {'max |dpx|':>10} {'top-1 agree':>12}")
+    for r in results:
+        agreement = (f"{r['top1_agreement']:.1%}"
+                     if 'top1_agreement' in r else 'n/a')
+        print(f"{r['decoder']:<10} {r['mean_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+              f"{r['speedup']:>7.1f}x {r['mean_abs_pixel_diff']:>11.2f} "
+              f"{r['max_abs_pixel_diff']:>10.0f} {agreement:>12}")
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Local cache of decoded training images.
+
+Decoded pixels are stored as uint8 arrays in .npy shards that are opened
+memory-mapped, so the training set can be read without holding it in RAM.
+index.json maps every cached materialimages document (by _id) to its shard
+row, content hash, label and filename.
+
+sync() compares the index with a listing of _id/hash/label fields and only
+downloads and decodes documents that are new or whose content changed;
+deleted documents are dropped and relabelled ones are updated in place.
+Shards are immutable once written; compact() rewrites them when deletions
+or many small syncs have left them fragmented.
+
+Several processes (training, embedding refreshes) may share a cache
+directory. sync() and compact() hold an exclusive lock on its .lock file
+and start from the index on disk; readers take a shared lock to load the
+index and map every shard it lists, so shards deleted afterwards by
+another process's compaction stay readable.
+"""
+
+import io
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from image_preprocessing import decode_image, get_image_hash
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_CACHE_ROOT = Path('./data/dataset_cache')
+
+# Fields needed to detect changes, without any image bytes
+LISTING_PROJECTION = {
+    '_id': 1,
+    'hash': 1,
+    'material_key': 1,
+    'material_official': 1,
+    'filename': 1
+}
+
+FETCH_PROJECTION = {
+    '_id': 1,
+    'data': 1,
+    'hash': 1,
+    'material_key': 1,
+    'material_official': 1,
+    'filename': 1
+}
+
+
+def doc_label(doc):
+    return doc.get('material_key', doc.get('material_official', 'unknown'))
+
+
+class DatasetCache:
+    """Decoded materialimages pixels in memory-mapped uint8 shards.
+
+    One cache directory holds one decode configuration (decoder and image
+    size), since both change the stored pixels.
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, cache_dir, image_size=(224, 224), decoder='pil',
+                 shard_size=1024):
+        self.cache_dir = Path(cache_dir)
+        self.image_size = tuple(image_size)
+        self.decoder = decoder
+        self.shard_size = shard_size
+        self._shards = {}
+        self._lock_file = None
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with self._locked(exclusive=False):
+            self._load_index()
+
+    @classmethod
+    def for_config(cls, root=DEFAULT_CACHE_ROOT, image_size=(224, 224),
+                   decoder='pil', **kwargs):
+        width, height = image_size
+        return cls(Path(root) / f'{decoder}-{width}x{height}', image_size,
+                   decoder, **kwargs)
+
+    @property
+    def index_path(self):
+        return self.cache_dir / 'index.json'
+
+    @contextmanager
+    def _locked(self, exclusive=True):
+        """Hold the cache directory's lock against other processes
+
+        Nested uses within one instance share the outer lock. Without fcntl
+        (e.g. on Windows) the cache is not safe to share between processes.
+        """
+        if fcntl is None or self._lock_file is not None:
+            yield
+            return
+        with open(self.cache_dir / '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._lock_file = f
+            try:
+                yield
+            finally:
+                self._lock_file = None
+
+    def _load_index(self):
+        index = None
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if (not index or index.get('version') != self.INDEX_VERSION
+                or tuple(index.get('image_size', ())) != self.image_size
+                or index.get('decoder') != self.decoder):
+            index = {'entries': {}, 'skipped': {}, 'shards': {}}
+        # entries: _id -> {hash, label, filename, shard, row}
+        # skipped: _id -> hash of documents that failed to decode
+        # shards: name -> row count
+        self.entries = index['entries']
+        self.skipped = index['skipped']
+        self.shards = index['shards']
+        self._open_shards()
+
+    def _open_shards(self):
+        """Map every indexed shard while the index is known to be current
+
+        Entries of shards that cannot be opened are dropped, so the next
+        sync fetches them again.
+        """
+        self._shards = {}
+        for name in list(self.shards):
+            try:
+                self.shard(name)
+            except (OSError, ValueError):
+                del self.shards[name]
+                self.entries = {key: entry for key, entry in self.entries.items()
+                                if entry['shard'] != name}
+
+    def _save_index(self):
+        index = {
+            'version': self.INDEX_VERSION,
+            'image_size': list(self.image_size),
+            'decoder': self.decoder,
+            'entries': self.entries,
+            'skipped': self.skipped,
+            'shards': self.shards
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def shard(self, name):
+        """Memory-mapped, read-only view of one shard"""
+        if name not in self._shards:
+            self._shards[name] = np.load(self.cache_dir / name, mmap_mode='r')
+        return self._shards[name]
+
+    def _next_shard_name(self):
+        existing = [int(name[len('shard_'):-len('.npy')])
+                    for name in self.shards]
+        return f'shard_{max(existing, default=-1) + 1:05d}.npy'
+
+    def _write_shard(self, pixels):
+        """Write rows to a new shard file; returns its name"""
+        name = self._next_shard_name()
+        tmp_path = self.cache_dir / (name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, pixels)
+        os.replace(tmp_path, self.cache_dir / name)
+        self.shards[name] = len(pixels)
+        return name
+
+    def _decode(self, doc):
+        img_data = doc.get('data')
+        if img_data is None:
+            raise ValueError('document has no image data')
+        # Opening only parses the header; pixels are decoded below
+        with Image.open(io.BytesIO(img_data)) as img:
+            width, height = img.size
+        if width < 50 or height < 50:
+            raise ValueError(f'image too small ({width}x{height})')
+        return decode_image(img_data, self.image_size, self.decoder)
+
+    def sync(self, collection, batch_size=256, log=print):
+        """Bring the cache up to date with a materialimages collection
+
+        Returns counts of added, removed, relabelled, skipped and unchanged
+        documents. Image bytes are only fetched for documents not already
+        cached under the same content hash.
+        """
+        with self._locked():
+            # Another process may have synced since this one loaded
+            self._load_index()
+            return self._sync(collection, batch_size, log)
+
+    def _sync(self, collection, batch_size, log):
+        stats = {'added': 0, 'removed': 0, 'relabelled': 0, 'skipped': 0,
+                 'unchanged': 0}
+        listed = set()
+        to_fetch = []
+        for doc in collection.find({}, LISTING_PROJECTION,
+                                   batch_size=batch_size * 16):
+            key = str(doc['_id'])
+            listed.add(key)
+            entry = self.entries.get(key)
+            content_hash = doc.get('hash')
+            if entry is not None and (content_hash is None
+                                      or content_hash == entry['hash']):
+                label = doc_label(doc)
+                filename = doc.get('filename', 'unknown')
+                if entry['label'] != label or entry['filename'] != filename:
+                    entry['label'] = label
+                    entry['filename'] = filename
+                    stats['relabelled'] += 1
+                else:
+                    stats['unchanged'] += 1
+            elif key in self.skipped and (content_hash is None or
+                                          content_hash == self.skipped[key]):
+                stats['skipped'] += 1
+            else:
+                to_fetch.append(doc['_id'])
+
+        for key in list(self.entries):
+            if key not in listed:
+                del self.entries[key]
+                stats['removed'] += 1
+        for key in list(self.skipped):
+            if key not in listed:
+                del self.skipped[key]
+
+        for start in range(0, len(to_fetch), self.shard_size):
+            ids = to_fetch[start:start + self.shard_size]
+            pixels = np.empty((len(ids), self.image_size[1],
+                               self.image_size[0], 3), dtype=np.uint8)
+            added = []
+            for doc in collection.find({'_id': {'$in': ids}},
+                                       FETCH_PROJECTION,
+                                       batch_size=batch_size):
+                key = str(doc['_id'])
+                content_hash = doc.get('hash')
+                if content_hash is None and doc.get('data') is not None:
+                    content_hash = get_image_hash(doc['data'])
+                try:
+                    pixels[len(added)] = self._decode(doc)
+                except Exception as e:
+                    log(f"Skipping image {doc.get('filename', 'unknown')}: {e}")
+                    self.entries.pop(key, None)
+                    self.skipped[key] = content_hash
+                    stats['skipped'] += 1
+                    continue
+                self.skipped.pop(key, None)
+                added.append((key, {
+                    'hash': content_hash,
+                    'label': doc_label(doc),
+                    'filename': doc.get('filename', 'unknown')
+                }))
+
+            if added:
+                name = self._write_shard(pixels[:len(added)])
+                for row, (key, entry) in enumerate(added):
+                    self.entries[key] = {**entry, 'shard': name, 'row': row}
+                stats['added'] += len(added)
+            # Persist after every shard so an interrupted sync resumes here
+            self._save_index()
+
+        if self._needs_compaction():
+            self._compact()
+        self._save_index()
+        self._remove_unreferenced_shards()
+        self._open_shards()
+        return stats
+
+    def _needs_compaction(self):
+        total_rows = sum(self.shards.values())
+        live_rows = len(self.entries)
+        ideal_shards = max(1, -(-live_rows // self.shard_size))
+        return (total_rows - live_rows > total_rows // 4
+                or len(self.shards) > 2 * ideal_shards)
+
+    def compact(self):
+        """Rewrite live rows into full shards and drop dead ones"""
+        with self._locked():
+            self._load_index()
+            self._compact()
+            self._save_index()
+            self._remove_unreferenced_shards()
+            self._open_shards()
+
+    def _compact(self):
+        keys = self.keys()
+        old_shards = dict(self.shards)
+        new_entries = {}
+        for start in range(0, len(keys), self.shard_size):
+            chunk = keys[start:start + self.shard_size]
+            name = self._write_shard(self.read(chunk))
+            for row, key in enumerate(chunk):
+                new_entries[key] = {**self.entries[key], 'shard': name,
+                                    'row': row}
+        self.entries = new_entries
+        for name in old_shards:
+            del self.shards[name]
+        self._shards = {}
+
+    def _remove_unreferenced_shards(self):
+        for path in self.cache_dir.glob('shard_*.npy*'):
+            if path.name not in self.shards:
+                path.unlink()
+
+    def keys(self):
+        """Cached document ids in a stable order"""
+        return sorted(self.entries)
+
+    def labels(self, keys=None):
+        keys = self.keys() if keys is None else keys
+        return np.array([self.entries[key]['label'] for key in keys])
+
+    def filenames(self, keys=None):
+        keys = self.keys() if keys is None else keys
+        return [self.entries[key]['filename'] for key in keys]
+
+    def images(self, keys):
+        """Array-like view of the pixels of keys that reads from the shards"""
+        return CachedImages(self, keys)
+
+    def read(self, keys, out=None):
+        """Gather the uint8 pixels of keys, reading each shard once"""
+        if out is None:
+            out = np.empty((len(keys), self.image_size[1], self.image_size[0],
+                            3), dtype=np.uint8)
+        by_shard = {}
+        for position, key in enumerate(keys):
+            entry = self.entries[key]
+            by_shard.setdefault(entry['shard'], []).append(
+                (entry['row'], position))
+        for name, rows in by_shard.items():
+            shard_rows, positions = zip(*sorted(rows))
+            out[list(positions)] = self.shard(name)[list(shard_rows)]
+        return out
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CachedImages:
+    """Read-only uint8 image array backed by a DatasetCache's shards
+
+    Indexing with row numbers gathers just those rows from the memory-mapped
+    shards, so training holds no more than a batch of pixels in RAM.
+    """
+
+    def __init__(self, cache, keys):
+        entries = [cache.entries[key] for key in keys]
+        names = sorted({entry['shard'] for entry in entries})
+        shard_ids = {name: i for i, name in enumerate(names)}
+        # Opened up front so reads from parallel tf.data maps share handles
+        self._shards = [cache.shard(name) for name in names]
+        self._shard = np.array([shard_ids[entry['shard']] for entry in entries],
+                               dtype=np.int64)
+        self._row = np.array([entry['row'] for entry in entries],
+                             dtype=np.int64)
+        self.shape = (len(entries), cache.image_size[1], cache.image_size[0], 3)
+        self.dtype = np.dtype(np.uint8)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.ndim == 0:
+            return self[rows[None]][0]
+        out = np.empty((len(rows), ) + self.shape[1:], dtype=self.dtype)
+        shards = self._shard[rows]
+        shard_rows = self._row[rows]
+        for shard in np.unique(shards):
+            selected = shards == shard
+            out[selected] = self._shards[shard][shard_rows[selected]]
+        return out
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Classifiers over backbone embeddings, for classes the model was not trained on.
+
+PrototypeClassifier scores an image by its cosine similarity to each class's
+mean embedding (its prototype); KNNClassifier by a similarity-weighted vote
+of the nearest stored images. Both are built from the embedding store and
+the dataset cache, so a material added through /api/classes becomes
+predictable as soon as embedding_store.py has embedded its uploaded images,
+and full retraining can wait for an off-hours run.
+
+predict.py selects them with --classifier prototype or knn; 'softmax' keeps
+the trained head.
+"""
+
+import os
+import json
+import threading
+import weakref
+from pathlib import Path
+
+import numpy as np
+
+from dataset_cache import DEFAULT_CACHE_ROOT, DatasetCache
+from embedding_store import DEFAULT_STORE_ROOT, EmbeddingStore, file_digest
+from similarity_index import build_index, normalize_rows
+
+CLASSIFIERS = ('softmax', 'prototype', 'knn')
+
+
+def _softmax(logits):
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class PrototypeClassifier:
+    """Nearest class mean in cosine similarity, softmaxed with temperature"""
+
+    def __init__(self, embeddings, labels, temperature=0.05):
+        self.classes, label_ids = np.unique(labels, return_inverse=True)
+        sums = np.zeros((len(self.classes), embeddings.shape[1]),
+                        dtype=np.float32)
+        np.add.at(sums, label_ids, normalize_rows(embeddings))
+        self.prototypes = normalize_rows(sums)
+        self.counts = np.bincount(label_ids, minlength=len(self.classes))
+        self.temperature = temperature
+
+    def predict_proba(self, embeddings):
+        similarity = normalize_rows(embeddings) @ self.prototypes.T
+        return _softmax(similarity / self.temperature)
+
+
+class KNNClassifier:
+    """Vote of the k most similar stored images, weighted by similarity"""
+
+    def __init__(self, embeddings, labels, k=10, temperature=0.05):
+        self.classes, self.label_ids = np.unique(labels, return_inverse=True)
+        self.counts = np.bincount(self.label_ids, minlength=len(self.classes))
+        self.index = build_index(embeddings, np.arange(len(labels)))
+        self.k = k
+        self.temperature = temperature
+
+    def predict_proba(self, embeddings):
+        scores, rows = self.index.search(embeddings, self.k)
+        # Relative to the best match, so exp() cannot overflow; -inf
+        # padding gets zero weight
+        weights = np.exp((scores - scores[:, :1]) / self.temperature)
+        probabilities = np.zeros((len(scores), len(self.classes)),
+                                 dtype=np.float32)
+        np.add.at(probabilities,
+                  (np.arange(len(scores))[:, None], self.label_ids[rows]),
+                  weights)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+def model_store_dir(model_path):
+    """Store embedding_store.py --model writes for this model"""
+    return DEFAULT_STORE_ROOT / Path(model_path).parent.name
+
+
+def load_embedding_classifier(kind, store_dir, cache_root=DEFAULT_CACHE_ROOT,
+                              **kwargs):
+    """Build a classifier from every cached image with a stored embedding"""
+    store = EmbeddingStore.open(store_dir)
+    version = json.loads(store.backbone_version)
+    cache = DatasetCache.for_config(cache_root,
+                                    version['preprocessing']['image_size'],
+                                    version['decoder'])
+    keys = [key for key in cache.keys() if cache.entries[key]['hash'] in store]
+    if not keys:
+        raise RuntimeError(f'No embedded images in {store_dir}; '
+                           'run embedding_store.py first')
+    embeddings = store.get([cache.entries[key]['hash'] for key in keys])
+    labels = cache.labels(keys)
+    if kind == 'prototype':
+        return PrototypeClassifier(embeddings, labels, **kwargs)
+    if kind == 'knn':
+        return KNNClassifier(embeddings, labels, **kwargs)
+    raise ValueError(f'Unknown classifier: {kind}')
+
+
+def backbone_extractor(model):
+    """Sub-model mapping a train.py model's input to its pooled features"""
+    from tensorflow import keras
+    return keras.Model(model.inputs, model.get_layer('backbone_pool').output)
+
+
+class EmbeddingClassifierCache:
+    """Loaded embedding classifiers and backbone extractors, per process.
+
+    A classifier is keyed by the store's and the dataset cache's index
+    files, so it is rebuilt as soon as embedding_store.py records new
+    images. Stores built from a different model file are rejected, since
+    their embeddings would not match the query's.
+    """
+
+    def __init__(self):
+        self._classifiers = {}
+        self._digests = {}
+        self._extractors = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_key(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def _model_digest(self, model_path):
+        key = self._file_key(model_path)
+        if key not in self._digests:
+            self._digests = {key: file_digest(model_path)}
+        return self._digests[key]
+
+    def extractor(self, model):
+        with self._lock:
+            if model not in self._extractors:
+                self._extractors[model] = backbone_extractor(model)
+            return self._extractors[model]
+
+    def get(self, kind, model_path, store_dir=None,
+            cache_root=DEFAULT_CACHE_ROOT):
+        """Return (classifier, labels_map) for a model's embedding store"""
+        store_dir = Path(store_dir or model_store_dir(model_path))
+        with self._lock:
+            with open(store_dir / 'meta.json', 'r') as f:
+                version = json.loads(json.load(f)['backbone_version'])
+            if version['weights'] != self._model_digest(model_path):
+                raise RuntimeError(
+                    f'Embedding store {store_dir} was not built from '
+                    f'{model_path}; run embedding_store.py --model')
+            width, height = version['preprocessing']['image_size']
+            index_path = (Path(cache_root) /
+                          f"{version['decoder']}-{width}x{height}" /
+                          'index.json')
+            key = (kind, os.path.abspath(store_dir), os.path.abspath(index_path))
+            stamp = (self._file_key(store_dir / 'meta.json'),
+                     self._file_key(index_path))
+            entry = self._classifiers.get(key)
+            if entry is None or entry[0] != stamp:
+                classifier = load_embedding_classifier(kind, store_dir,
+                                                       cache_root)
+                labels_map = {
+                    i: str(label) for i, label in enumerate(classifier.classes)
+                }
+                entry = (stamp, classifier, labels_map)
+                self._classifiers[key] = entry
+            return entry[1], entry[2]
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Persistent store of per-image backbone embeddings.
+
+Embeddings are keyed by image content hash (the MD5 add_training_images.py
+stores as 'hash'), so an image is only ever embedded once per backbone, no
+matter how often it is re-uploaded or the collection is re-synced. The store
+records the backbone version it was built with and starts over when that
+changes.
+
+On disk a store is embeddings.npy (float16, one row per image), hashes.npy
+(the matching hashes) and meta.json. matrix() returns both arrays, memory
+mapped, for training and analysis jobs.
+
+Run as a script to sync the dataset cache with MongoDB and embed the images
+that are new since the last run.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from dataset_cache import DEFAULT_CACHE_ROOT, DatasetCache
+from image_preprocessing import (DECODERS, TRAINING_PREPROCESSING,
+                                 load_preprocessing, normalize)
+
+DEFAULT_STORE_ROOT = Path('./data/embeddings')
+
+
+def backbone_version(backbone, weights, preprocessing, decoder,
+                     precision='float32'):
+    """Describe everything that changes an image's embedding
+
+    precision is the Keras dtype policy the backbone computes in. Embeddings
+    from stores with different versions are not comparable.
+    """
+    return json.dumps(
+        {
+            'backbone': backbone,
+            'weights': weights,
+            'preprocessing': preprocessing,
+            'decoder': decoder,
+            'precision': precision
+        },
+        sort_keys=True)
+
+
+def file_digest(path):
+    """MD5 of a file's contents, read in blocks"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class EmbeddingStore:
+    """float16 embeddings keyed by image content hash.
+
+    add() and retain() stage changes in memory; save() rewrites the arrays
+    atomically. A store opened with a different backbone_version than it was
+    saved with is empty.
+    """
+
+    def __init__(self, store_dir, backbone_version):
+        self.store_dir = Path(store_dir)
+        self.backbone_version = backbone_version
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @classmethod
+    def open(cls, store_dir):
+        """Open an existing store with whatever backbone it was saved with"""
+        with open(Path(store_dir) / 'meta.json', 'r') as f:
+            return cls(store_dir, json.load(f)['backbone_version'])
+
+    def _load(self):
+        self.embeddings = None
+        self.hashes = np.array([], dtype='<U32')
+        try:
+            with open(self.store_dir / 'meta.json', 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+        if meta and meta.get('backbone_version') == self.backbone_version:
+            try:
+                embeddings = np.load(self.store_dir / 'embeddings.npy',
+                                     mmap_mode='r')
+                hashes = np.load(self.store_dir / 'hashes.npy')
+            except (OSError, ValueError):
+                embeddings = hashes = None
+            # A save interrupted between files leaves them inconsistent
+            if (hashes is not None and len(hashes) == len(embeddings) ==
+                    meta.get('count')):
+                self.embeddings, self.hashes = embeddings, hashes
+        self._rows = {h: i for i, h in enumerate(self.hashes)}
+        self._pending = {}
+        self._keep = None
+
+    @property
+    def dim(self):
+        if self.embeddings is not None:
+            return self.embeddings.shape[1]
+        for embedding in self._pending.values():
+            return len(embedding)
+        return None
+
+    def __len__(self):
+        return len(self._rows) + len(self._pending)
+
+    def __contains__(self, image_hash):
+        return image_hash in self._rows or image_hash in self._pending
+
+    def missing(self, hashes):
+        """Hashes without a stored embedding, deduplicated, in input order"""
+        return list(dict.fromkeys(h for h in hashes if h not in self))
+
+    def add(self, hashes, embeddings):
+        for image_hash, embedding in zip(hashes, embeddings):
+            self._pending[image_hash] = np.asarray(embedding, dtype=np.float16)
+
+    def retain(self, hashes):
+        """Drop every embedding whose hash is not in hashes on the next save"""
+        self._keep = set(hashes)
+
+    def get(self, hashes):
+        """Stored embeddings for hashes, in order; KeyError if any is missing"""
+        out = np.empty((len(hashes), self.dim), dtype=np.float16)
+        for i, image_hash in enumerate(hashes):
+            row = self._rows.get(image_hash)
+            out[i] = (self.embeddings[row]
+                      if row is not None else self._pending[image_hash])
+        return out
+
+    def matrix(self):
+        """(embeddings, hashes): an (N, dim) float16 matrix and its hash ids"""
+        self.save()
+        if self.embeddings is None:
+            return np.empty((0, 0), dtype=np.float16), self.hashes
+        return self.embeddings, self.hashes
+
+    def save(self):
+        if not self._pending and self._keep is None:
+            return
+        keep_rows = [
+            row for image_hash, row in self._rows.items()
+            if self._keep is None or image_hash in self._keep
+        ]
+        pending = [(h, e) for h, e in self._pending.items()
+                   if self._keep is None or h in self._keep]
+        total = len(keep_rows) + len(pending)
+        dim = self.dim or 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix='.npy')
+        os.close(fd)
+        embeddings = np.lib.format.open_memmap(tmp_path,
+                                               mode='w+',
+                                               dtype=np.float16,
+                                               shape=(total, dim))
+        # Copy kept rows in ascending order so the old file is read
+        # sequentially
+        keep_rows.sort()
+        for start in range(0, len(keep_rows), 4096):
+            chunk = keep_rows[start:start + 4096]
+            embeddings[start:start + len(chunk)] = self.embeddings[chunk]
+        for i, (_, embedding) in enumerate(pending):
+            embeddings[len(keep_rows) + i] = embedding
+        embeddings.flush()
+        del embeddings
+
+        hashes = np.array([self.hashes[row] for row in keep_rows] +
+                          [h for h, _ in pending],
+                          dtype='<U32')
+        with open(self.store_dir / 'hashes.npy.tmp', 'wb') as f:
+            np.save(f, hashes)
+        os.replace(self.store_dir / 'hashes.npy.tmp',
+                   self.store_dir / 'hashes.npy')
+        self.embeddings = None
+        os.replace(tmp_path, self.store_dir / 'embeddings.npy')
+
+        meta_path = self.store_dir / 'meta.json.tmp'
+        with open(meta_path, 'w') as f:
+            json.dump(
+                {
+                    'backbone_version': self.backbone_version,
+                    'count': total,
+                    'dim': dim
+                }, f)
+        os.replace(meta_path, self.store_dir / 'meta.json')
+        self._load()
+
+    def update(self, hashes, load_pixels, embed, batch_size=64, log=print):
+        """Embed the hashes not yet stored and drop the ones no longer listed
+
+        load_pixels(hashes) returns their uint8 images and embed(images)
+        their embeddings. Returns counts of embedded, removed and reused
+        images.
+        """
+        hashes = list(hashes)
+        removed = (set(self._rows) | set(self._pending)) - set(hashes)
+        self.retain(hashes)
+        todo = self.missing(hashes)
+        for start in range(0, len(todo), batch_size):
+            chunk = todo[start:start + batch_size]
+            self.add(chunk, embed(load_pixels(chunk)))
+            log(f"Embedded {min(start + batch_size, len(todo))}/{len(todo)} new images")
+        self.save()
+        return {
+            'embedded': len(todo),
+            'removed': len(removed),
+            'reused': len(set(hashes)) - len(todo)
+        }
+
+
+def cache_pixel_loader(cache: DatasetCache):
+    """load_pixels for EmbeddingStore.update() reading from a DatasetCache"""
+    key_by_hash = {}
+    for key in cache.keys():
+        key_by_hash.setdefault(cache.entries[key]['hash'], key)
+
+    def load_pixels(hashes):
+        return cache.read([key_by_hash[h] for h in hashes])
+
+    return load_pixels
+
+
+def sync_embeddings(cache: DatasetCache, store: EmbeddingStore, embed,
+                    batch_size=64, log=print):
+    """Bring store up to date with every image in cache
+
+    Returns (embeddings, ids, labels, stats): one float16 row per cached
+    document, its _id and its label, plus the update() counts.
+    """
+    keys = cache.keys()
+    hashes = [cache.entries[key]['hash'] for key in keys]
+    stats = store.update(hashes, cache_pixel_loader(cache), embed,
+                         batch_size, log)
+    return store.get(hashes), np.array(keys), cache.labels(keys), stats
+
+
+def imagenet_backbone(name='EfficientNetB0', image_size=(224, 224),
+                      decoder='pil', precision='float32'):
+    """ImageNet backbone embedding as train.py's Phase 1 head sees it
+
+    Matches split_feature_head() on a freshly created model trained with
+    the same precision policy, so training with cached Phase 1 features and
+    this store share embeddings. Returns (embed, version); embed maps uint8
+    images to pooled features.
+    """
+    import tensorflow as tf
+    from tensorflow import keras
+
+    width, height = image_size
+    applications = {
+        'EfficientNetB0': keras.applications.EfficientNetB0,
+        'EfficientNetB2': keras.applications.EfficientNetB2
+    }
+    global_policy = keras.mixed_precision.global_policy()
+    keras.mixed_precision.set_global_policy(precision)
+    try:
+        inputs = keras.Input(shape=(height, width, 3))
+        x = keras.layers.Rescaling(1. / 127.5, offset=-1)(inputs)
+        x = applications[name](input_shape=(height, width, 3),
+                               include_top=False,
+                               weights='imagenet')(x, training=False)
+        x = keras.layers.GlobalAveragePooling2D()(x)
+        extractor = keras.Model(inputs, x)
+    finally:
+        keras.mixed_precision.set_global_policy(global_policy)
+
+    preprocessing = dict(TRAINING_PREPROCESSING, image_size=[width, height])
+
+    def embed(images):
+        batch = normalize(images, preprocessing)
+        return np.asarray(extractor.predict_on_batch(tf.constant(batch)))
+
+    version = backbone_version(name.lower(), f'imagenet/keras-{keras.__version__}',
+                               preprocessing, decoder, precision)
+    return embed, version
+
+
+def model_backbone(model_path, decoder='pil'):
+    """Embedding from a trained model's pooled backbone features
+
+    Returns (embed, version). The version includes a digest of the model
+    file, so retraining or replacing the model invalidates the store.
+    """
+    import tensorflow as tf
+    from tensorflow import keras
+
+    model = keras.models.load_model(model_path, compile=False)
+    pool = model.get_layer('backbone_pool')
+    extractor = keras.Model(model.inputs, pool.output)
+    preprocessing = load_preprocessing(model_path)
+
+    def embed(images):
+        batch = normalize(images, preprocessing)
+        return np.asarray(extractor.predict_on_batch(tf.constant(batch)))
+
+    version = backbone_version('model', file_digest(model_path),
+                               preprocessing, decoder, pool.dtype_policy.name)
+    return embed, version
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Embed new training images into the persistent embedding store')
+    parser.add_argument('--mongo-uri',
+                        help='MongoDB connection URI; omit to embed the dataset cache as it is')
+    parser.add_argument('--model',
+                        help='Trained model whose backbone to use (default: ImageNet EfficientNetB0)')
+    parser.add_argument('--backbone', choices=['EfficientNetB0', 'EfficientNetB2'],
+                        default='EfficientNetB0',
+                        help='ImageNet backbone when --model is not given')
+    parser.add_argument('--decoder', choices=DECODERS, default='pil',
+                        help='Decoder of the dataset cache to embed (default: pil)')
+    parser.add_argument('--precision', choices=['float32', 'mixed_float16', 'mixed_bfloat16'],
+                        default='float32',
+                        help="ImageNet backbone's dtype policy when --model is not given; match "
+                             "the policy train.py records to share its store (default: float32)")
+    parser.add_argument('--dataset-cache-dir', default=str(DEFAULT_CACHE_ROOT),
+                        help='Decoded image cache directory')
+    parser.add_argument('--store-dir',
+                        help='Embedding store directory (default: ./data/embeddings/<backbone>)')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='Images embedded per batch (default: 64)')
+    args = parser.parse_args()
+
+    cache = DatasetCache.for_config(args.dataset_cache_dir, decoder=args.decoder)
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri)
+        sync_stats = cache.sync(client['Construction_test']['materialimages'],
+                                log=lambda m: print(m, file=sys.stderr))
+        client.close()
+        print(f"Dataset cache: {json.dumps(sync_stats)}", file=sys.stderr)
+
+    if args.model:
+        embed, version = model_backbone(args.model, args.decoder)
+        name = Path(args.model).parent.name
+    else:
+        embed, version = imagenet_backbone(args.backbone, cache.image_size,
+                                           args.decoder, args.precision)
+        name = args.backbone.lower()
+
+    store = EmbeddingStore(args.store_dir or DEFAULT_STORE_ROOT / name, version)
+    embeddings, ids, _, stats = sync_embeddings(
+        cache, store, embed, args.batch_size,
+        log=lambda m: print(m, file=sys.stderr))
+    print(json.dumps({
+        **stats,
+        'images': len(ids),
+        'stored': len(store),
+        'dim': store.dim,
+        'store_dir': str(store.store_dir)
+    }))
+
+
+if __name__ == '__main__':
+    main()
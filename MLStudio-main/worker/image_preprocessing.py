@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Image preprocessing shared by training and inference.
+
+A preprocessing spec describes how decoded RGB pixels are turned into model
+input: resize to image_size, then pixels * scale + offset. train.py records
+the spec it trained with in metadata.json so predict.py and the exported
+serving model apply exactly the same transform.
+
+Decoders are pluggable. 'pil' fully decodes and LANCZOS-resizes (the
+reference path); 'pil-draft' and 'cv2' let libjpeg decode JPEGs at 1/2, 1/4
+or 1/8 scale first and use a cheaper resize filter, which is much faster for
+multi-megapixel phone photos. benchmark_decode.py compares them.
+"""
+
+import io
+import json
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+DECODERS = ('pil', 'pil-draft', 'cv2')
+
+# What train.py feeds the model: pixels scaled to [0, 1]
+TRAINING_PREPROCESSING = {
+    'image_size': [224, 224],
+    'scale': 1.0 / 255.0,
+    'offset': 0.0
+}
+
+# What predict.py fed models trained before the spec was recorded
+LEGACY_PREPROCESSING = {
+    'image_size': [224, 224],
+    'scale': 1.0 / 127.5,
+    'offset': -1.0
+}
+
+
+def load_preprocessing(model_path: str):
+    """Read the preprocessing spec recorded next to a model.
+
+    Models trained before specs were recorded keep the legacy transform they
+    have always been served with.
+    """
+    metadata_path = Path(model_path).parent / 'metadata.json'
+    try:
+        with open(metadata_path, 'r') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return dict(LEGACY_PREPROCESSING)
+    return metadata.get('preprocessing') or dict(LEGACY_PREPROCESSING)
+
+
+def get_image_hash(img_data):
+    """MD5 of encoded image bytes, the content hash every cache is keyed by
+
+    add_training_images.py stores it on materialimages documents.
+    """
+    return hashlib.md5(img_data).hexdigest()
+
+
+def normalize(pixels, preprocessing):
+    """Scale uint8/float RGB pixels into model input range"""
+    pixels = np.asarray(pixels, dtype=np.float32)
+    return pixels * np.float32(preprocessing['scale']) + np.float32(
+        preprocessing['offset'])
+
+
+def _decode_pil(image, image_size):
+    img = Image.open(image)
+    img = img.convert('RGB')
+    img = img.resize(tuple(image_size), Image.Resampling.LANCZOS)
+    return np.array(img)
+
+
+def _decode_pil_draft(image, image_size):
+    img = Image.open(image)
+    # For JPEGs, ask libjpeg for the smallest DCT scale that is still at
+    # least image_size; a no-op for other formats
+    img.draft('RGB', tuple(image_size))
+    img = img.convert('RGB')
+    img = img.resize(tuple(image_size), Image.Resampling.BILINEAR,
+                     reducing_gap=2.0)
+    return np.array(img)
+
+
+def _decode_cv2(image, image_size):
+    if cv2 is None:
+        raise RuntimeError('OpenCV not available (pip install opencv-python-headless)')
+    if not isinstance(image, io.BytesIO):
+        with open(image, 'rb') as f:
+            image = io.BytesIO(f.read())
+    data = image.getbuffer()
+
+    # Largest reduction that keeps both sides at or above image_size
+    with Image.open(io.BytesIO(data)) as header:
+        width, height = header.size
+    reduction = min(width // image_size[0], height // image_size[1])
+    flag = cv2.IMREAD_COLOR
+    if reduction >= 8:
+        flag = cv2.IMREAD_REDUCED_COLOR_8
+    elif reduction >= 4:
+        flag = cv2.IMREAD_REDUCED_COLOR_4
+    elif reduction >= 2:
+        flag = cv2.IMREAD_REDUCED_COLOR_2
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if img is None:
+        raise ValueError('OpenCV could not decode image')
+    img = cv2.resize(img, tuple(image_size), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+_DECODE_FNS = {
+    'pil': _decode_pil,
+    'pil-draft': _decode_pil_draft,
+    'cv2': _decode_cv2
+}
+
+
+def decode_image(image, image_size=(224, 224), decoder='pil'):
+    """Decode a path or encoded bytes into a resized uint8 RGB array
+
+    decoder is one of DECODERS; 'pil' is the exact reference path and the
+    others trade a little resize quality for much faster decoding.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    return _DECODE_FNS[decoder](image, image_size)
+
+
+def make_serving_module(model, preprocessing):
+    """Wrap a Keras model in a tf.Module whose signature takes encoded images.
+
+    Decoding, resizing and normalization run inside the graph, batched over
+    the input vector of JPEG/PNG bytes.
+    """
+    import tensorflow as tf
+
+    width, height = preprocessing['image_size']
+    scale = float(preprocessing['scale'])
+    offset = float(preprocessing['offset'])
+
+    def preprocess(image_bytes):
+        image = tf.io.decode_image(image_bytes, channels=3,
+                                   expand_animations=False)
+        image = tf.image.resize(image, (height, width), method='lanczos3',
+                                antialias=True)
+        image = tf.clip_by_value(image, 0.0, 255.0)
+        return image * scale + offset
+
+    class ServingModule(tf.Module):
+
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        @tf.function(input_signature=[
+            tf.TensorSpec(shape=[None], dtype=tf.string, name='image_bytes')
+        ])
+        def serve(self, image_bytes):
+            images = tf.map_fn(preprocess,
+                               image_bytes,
+                               fn_output_signature=tf.TensorSpec(
+                                   [height, width, 3], tf.float32),
+                               parallel_iterations=16)
+            return {
+                'probabilities':
+                tf.cast(self.model(images, training=False), tf.float32)
+            }
+
+    return ServingModule()
+
+
+def export_serving_model(model, export_dir, preprocessing):
+    """Save a SavedModel whose serving_default signature takes image bytes"""
+    import tensorflow as tf
+
+    module = make_serving_module(model, preprocessing)
+    tf.saved_model.save(module,
+                        str(export_dir),
+                        signatures={'serving_default': module.serve})
+    return export_dir
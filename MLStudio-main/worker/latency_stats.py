@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Per-stage latency measurement for the inference worker.
+
+StageTimer records how long each stage of one prediction took. LatencyStats
+accumulates those timings across requests and reports count and p50/p95/p99
+per stage, as JSON or in the Prometheus text exposition format.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def process_startup_ms():
+    """Milliseconds from process creation until now, or None if unknown
+
+    Uses /proc, so it is only available on Linux.
+    """
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # The command name may contain spaces; fields resume after ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return max(0.0, (uptime - started) * 1000)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StageTimer:
+    """Collects wall-clock milliseconds per named stage"""
+
+    def __init__(self):
+        self.timings = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, ms):
+        self.timings[name] = self.timings.get(name, 0.0) + ms
+
+    def finish(self):
+        """Record total time since the timer was created and return timings"""
+        self.timings['total'] = (time.perf_counter() - self._start) * 1000
+        return {name: round(ms, 3) for name, ms in self.timings.items()}
+
+
+class LatencyStats:
+    """Rolling per-stage latency summaries.
+
+    Counts and sums are cumulative; percentiles are computed over the most
+    recent window samples of each stage.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=10000):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._sums = {}
+        self._lock = threading.Lock()
+
+    def observe(self, timings):
+        with self._lock:
+            for stage, ms in timings.items():
+                if ms is None:
+                    continue
+                if stage not in self._samples:
+                    self._samples[stage] = deque(maxlen=self.window)
+                    self._counts[stage] = 0
+                    self._sums[stage] = 0.0
+                self._samples[stage].append(ms)
+                self._counts[stage] += 1
+                self._sums[stage] += ms
+
+    def summary(self):
+        with self._lock:
+            summary = {}
+            for stage, samples in self._samples.items():
+                values = np.percentile(np.array(samples),
+                                       [q * 100 for q in self.QUANTILES])
+                summary[stage] = {
+                    'count': self._counts[stage],
+                    'sum_ms': round(self._sums[stage], 3),
+                    **{
+                        f'p{int(q * 100)}_ms': round(float(v), 3)
+                        for q, v in zip(self.QUANTILES, values)
+                    }
+                }
+            return summary
+
+    def prometheus(self, name='predict_stage_latency_ms'):
+        lines = [
+            f'# HELP {name} Inference latency per stage in milliseconds',
+            f'# TYPE {name} summary'
+        ]
+        for stage, stats in sorted(self.summary().items()):
+            for q in self.QUANTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} '
+                             f'{stats[f"p{int(q * 100)}_ms"]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {stats["sum_ms"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {stats["count"]}')
+        return '\n'.join(lines) + '\n'
@@ -2,122 +2,495 @@
 """
 Script to run inference using a trained model.
 Used by EcoBuild to make predictions on uploaded images.
+
+Runs either once per image (--image), over many images in one process
+(--batch), or as a long-lived server (--serve) that keeps the model loaded and
+answers JSON-line requests on stdin/stdout, with an optional local HTTP
+endpoint for health and readiness probes.
 """
 
 import os
 import sys
 import json
 import argparse
+import asyncio
+import glob
+import importlib.util
+import threading
 import numpy as np
 from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import io
 
+from dataset_cache import DEFAULT_CACHE_ROOT
+from embedding_classifier import CLASSIFIERS, EmbeddingClassifierCache
+from image_preprocessing import (DECODERS, LEGACY_PREPROCESSING, decode_image,
+                                 get_image_hash, load_preprocessing, normalize)
+from prediction_cache import PredictionCache, model_identity
+from latency_stats import LatencyStats, StageTimer, process_startup_ms
+
+# Interpreter start-up plus module imports, before any TensorFlow work
+PROCESS_STARTUP_MS = process_startup_ms()
+
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 try:
-    import tensorflow as tf
-    from tensorflow import keras
     from PIL import Image
-    TF_AVAILABLE = True
+    TF_AVAILABLE = importlib.util.find_spec('tensorflow') is not None
 except ImportError:
     TF_AVAILABLE = False
 
+# Imported on first use, so cache hits and health probes never pay for it
+tf = None
+keras = None
+
+
+def import_tensorflow():
+    global tf, keras
+    if tf is None:
+        import tensorflow
+        from tensorflow import keras as tf_keras
+        tf, keras = tensorflow, tf_keras
+    return tf
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+MANIFEST_EXTENSIONS = ('.txt', '.lst', '.jsonl')
+
 
-def load_and_preprocess_image(image_path: str, target_size=(224, 224)):
-    """Load and preprocess an image for prediction"""
-    img = Image.open(image_path)
-    img = img.convert('RGB')
-    img = img.resize(target_size, Image.Resampling.LANCZOS)
-    img_array = np.array(img).astype(np.float32)
-    img_array = (img_array - 127.5) / 127.5
+def load_and_preprocess_image(image_path: str, target_size=(224, 224),
+                              preprocessing=None, decoder='pil'):
+    """Load and preprocess an image for prediction
+
+    preprocessing is the spec the model was trained with (see
+    image_preprocessing.load_preprocessing); defaults to the legacy
+    (x - 127.5) / 127.5 transform. decoder selects the decode path (see
+    image_preprocessing.DECODERS).
+    """
+    preprocessing = preprocessing or LEGACY_PREPROCESSING
+    img_array = normalize(decode_image(image_path, target_size, decoder),
+                          preprocessing)
     img_array = np.expand_dims(img_array, axis=0)
     return img_array
 
 
-def predict(image_path: str, model_path: str, labels_path: str, 
-            multi_material_threshold: float = 0.15, max_materials: int = 5):
+def load_labels(labels_path: str):
+    """Load the index -> class name mapping written by train.py"""
+    with open(labels_path, 'r') as f:
+        labels_map = json.load(f)
+    return {int(k): v for k, v in labels_map.items()}
+
+
+BACKENDS = ('keras', 'tflite-float16', 'tflite-int8', 'savedmodel')
+
+
+class TFLiteModel:
+    """TFLite interpreter with the subset of the Keras model API used here"""
+
+    def __init__(self, model_path: str, num_threads=None):
+        import_tensorflow()
+        self.interpreter = tf.lite.Interpreter(model_path=model_path,
+                                               num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.nbytes = os.path.getsize(model_path)
+        self._lock = threading.Lock()
+
+    def predict(self, images, verbose=0):
+        images = np.asarray(images, dtype=self._input['dtype'])
+        with self._lock:
+            if tuple(self._input['shape']) != images.shape:
+                self.interpreter.resize_tensor_input(self._input['index'],
+                                                     images.shape)
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+            self.interpreter.set_tensor(self._input['index'], images)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output['index']).copy()
+
+
+class ServingModel:
+    """Exported serving SavedModel that takes encoded image bytes.
+
+    Decode, resize and normalization run inside the TF graph, so callers
+    pass raw file contents instead of preprocessed arrays.
+    """
+
+    accepts_encoded_images = True
+
+    def __init__(self, export_dir: str):
+        import_tensorflow()
+        self._serve = tf.saved_model.load(export_dir).signatures['serving_default']
+        self.nbytes = sum(p.stat().st_size for p in Path(export_dir).rglob('*')
+                          if p.is_file())
+
+    def predict(self, images, verbose=0):
+        outputs = self._serve(image_bytes=tf.constant(list(images),
+                                                      dtype=tf.string))
+        return outputs['probabilities'].numpy()
+
+
+def resolve_backend_path(model_path: str, backend: str = 'keras'):
+    """Map a Keras model path to the artifact for the requested backend
+
+    TFLite variants are the model_<variant>.tflite files and savedmodel is
+    the serving/ directory that train.py exports next to model.keras. Falls
+    back to the Keras model if the artifact was never exported.
+    """
+    if (backend == 'keras' or model_path.endswith('.tflite')
+            or os.path.isdir(model_path)):
+        return model_path
+    if backend == 'savedmodel':
+        artifact = Path(model_path).with_name('serving')
+    else:
+        variant = backend.split('-', 1)[1]
+        artifact = Path(model_path).with_name(f'model_{variant}.tflite')
+    if artifact.exists():
+        return str(artifact)
+    print(f'No {backend} export next to {model_path}, using Keras model',
+          file=sys.stderr, flush=True)
+    return model_path
+
+
+def load_model(model_path: str):
+    """Load a trained Keras model, TFLite model or serving SavedModel"""
+    if model_path.endswith('.tflite'):
+        return TFLiteModel(model_path)
+    if os.path.isdir(model_path):
+        return ServingModel(model_path)
+    import_tensorflow()
+    return keras.models.load_model(model_path, compile=False)
+
+
+def prepare_input(model, image_path: str, preprocessing, decoder='pil'):
+    """Read one image in the form the model takes: encoded bytes or an array"""
+    if getattr(model, 'accepts_encoded_images', False):
+        with open(image_path, 'rb') as f:
+            return f.read()
+    return load_and_preprocess_image(image_path,
+                                     tuple(preprocessing['image_size']),
+                                     preprocessing, decoder)[0]
+
+
+def collate_inputs(inputs):
+    """Stack per-image inputs into one model batch"""
+    if isinstance(inputs[0], bytes):
+        return np.array(inputs, dtype=object)
+    return np.stack(inputs)
+
+
+def warm_up_input(model, preprocessing):
+    """A one-image batch used to trace the model before the first request"""
+    width, height = preprocessing['image_size']
+    if getattr(model, 'accepts_encoded_images', False):
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height)).save(buffer, format='JPEG')
+        return collate_inputs([buffer.getvalue()])
+    return np.zeros((1, height, width, 3), dtype=np.float32)
+
+
+def predict_each(model, inputs):
+    """Predict a batch, isolating failures to the inputs that cause them
+
+    Returns one (probabilities, error) pair per input. If the batched call
+    fails (e.g. one corrupt image in an in-graph decode), inputs are retried
+    one at a time.
+    """
+    try:
+        return [(row, None) for row in model.predict(collate_inputs(inputs),
+                                                     verbose=0)]
+    except Exception as e:
+        if len(inputs) == 1:
+            return [(None, str(e))]
+    return [predict_each(model, [item])[0] for item in inputs]
+
+
+def estimate_model_bytes(model):
+    """Approximate resident size of a model from its weight tensors
+
+    TFLite and serving models do not expose their weights; their size on
+    disk stands in.
+    """
+    if isinstance(model, (TFLiteModel, ServingModel)):
+        return model.nbytes
+    total = 0
+    for weight in model.weights:
+        dtype = getattr(weight.dtype, 'name', weight.dtype)
+        total += int(np.prod(weight.shape)) * np.dtype(dtype).itemsize
+    return total
+
+
+class ModelCache:
+    """In-process LRU cache of loaded models, their labels and preprocessing.
+
+    Entries are keyed by the model and labels paths together with each
+    file's mtime and size, so a model rewritten in place is reloaded rather
+    than served stale. Least recently used models are evicted once the
+    estimated weight memory exceeds budget_bytes; the most recently used
+    model is always kept, even if it alone is over budget.
+
+    Models load outside the lock, so a slow load (e.g. a hot-swap) does not
+    stall requests for models already cached; concurrent misses on the same
+    key share one load.
+    """
+
+    def __init__(self, budget_bytes=2048 * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_key(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, model_path: str, labels_path: str):
+        """Return (model, labels_map, preprocessing), loading on a cache miss"""
+        key = (self._file_key(model_path), self._file_key(labels_path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return (entry['model'], entry['labels_map'],
+                        entry['preprocessing'])
+            loading = self._loading.get(key)
+            owner = loading is None
+            if owner:
+                loading = self._loading[key] = Future()
+        if not owner:
+            return loading.result()
+
+        try:
+            model = load_model(model_path)
+            labels_map = load_labels(labels_path)
+            preprocessing = load_preprocessing(model_path)
+            nbytes = estimate_model_bytes(model)
+        except Exception as e:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(e)
+            raise
+
+        with self._lock:
+            # Drop older versions of the same files
+            for stale in [k for k in self._entries
+                          if k[0][0] == key[0][0] and k != key]:
+                del self._entries[stale]
+
+            self._entries[key] = {
+                'model': model,
+                'labels_map': labels_map,
+                'preprocessing': preprocessing,
+                'bytes': nbytes
+            }
+            self._evict()
+            del self._loading[key]
+        loading.set_result((model, labels_map, preprocessing))
+        return model, labels_map, preprocessing
+
+    def _evict(self):
+        while (len(self._entries) > 1
+               and self.total_bytes() > self.budget_bytes):
+            self._entries.popitem(last=False)
+
+    def total_bytes(self):
+        return sum(entry['bytes'] for entry in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'models': [key[0][0] for key in self._entries],
+                'bytes': self.total_bytes(),
+                'budget_bytes': self.budget_bytes
+            }
+
+
+MODEL_CACHE = ModelCache(
+    int(float(os.environ.get('PREDICT_MODEL_CACHE_MB', 2048)) * 1024 * 1024))
+
+EMBEDDING_CLASSIFIERS = EmbeddingClassifierCache()
+
+
+def classifier_head(model, model_path: str, labels_map, classifier='softmax',
+                    embedding_store_dir=None,
+                    dataset_cache_dir=DEFAULT_CACHE_ROOT):
+    """Return (model to run, output row -> probabilities, labels_map)
+
+    'softmax' runs the trained head. 'prototype' and 'knn' run the model up
+    to its pooled backbone features and classify those against the images
+    in the model's embedding store, so classes added since training are
+    predicted too.
+    """
+    if classifier == 'softmax':
+        return model, lambda row: row, labels_map
+    if classifier not in CLASSIFIERS:
+        raise ValueError(f'Unknown classifier: {classifier}')
+    if isinstance(model, (TFLiteModel, ServingModel)):
+        raise ValueError(f'The {classifier} classifier needs the keras backend')
+    embedding_classifier, labels_map = EMBEDDING_CLASSIFIERS.get(
+        classifier, model_path, embedding_store_dir, dataset_cache_dir)
+    return (EMBEDDING_CLASSIFIERS.extractor(model),
+            lambda row: embedding_classifier.predict_proba(row[None])[0],
+            labels_map)
+
+
+def format_predictions(probabilities, labels_map, model_path: str,
+                       multi_material_threshold: float = 0.15,
+                       max_materials: int = 5):
+    """Turn one row of class probabilities into the predict() result payload"""
+    pred_classes = []
+    for idx, confidence in enumerate(probabilities):
+        class_name = labels_map.get(idx, f'class_{idx}')
+        pred_classes.append({
+            'class': class_name,
+            'confidence': float(confidence)
+        })
+
+    pred_classes.sort(key=lambda x: x['confidence'], reverse=True)
+
+    detected_materials = [
+        p for p in pred_classes
+        if p['confidence'] >= multi_material_threshold
+    ][:max_materials]
+
+    is_multi_material = len(detected_materials) > 1
+
+    top_prediction = pred_classes[0] if pred_classes else None
+    confidence_gap = 0
+    if len(pred_classes) >= 2:
+        confidence_gap = pred_classes[0]['confidence'] - pred_classes[1]['confidence']
+
+    return {
+        'predictions': pred_classes,
+        'detectedMaterials': detected_materials,
+        'isMultiMaterial': is_multi_material,
+        'topPrediction': top_prediction,
+        'confidenceGap': confidence_gap,
+        'threshold': multi_material_threshold,
+        'model': os.path.basename(model_path),
+        'success': True
+    }
+
+
+def prediction_cache_key(image_path, model_path, labels_path,
+                         multi_material_threshold, max_materials, decoder):
+    """(image hash, model identity, options) key for PredictionCache"""
+    with open(image_path, 'rb') as f:
+        image_hash = get_image_hash(f.read())
+    options = PredictionCache.options_key(
+        threshold=multi_material_threshold,
+        max_materials=max_materials,
+        decoder=decoder)
+    return image_hash, model_identity(model_path, labels_path), options
+
+
+def predict(image_path: str, model_path: str, labels_path: str,
+            multi_material_threshold: float = 0.15, max_materials: int = 5,
+            backend: str = 'keras', decoder: str = 'pil', cache=None,
+            timings: bool = False, classifier: str = 'softmax',
+            embedding_store_dir=None, dataset_cache_dir=DEFAULT_CACHE_ROOT):
     """Run prediction on an image using the trained model
-    
+
     Args:
         image_path: Path to the image file
         model_path: Path to the trained model
         labels_path: Path to the labels JSON file
         multi_material_threshold: Minimum confidence threshold for multi-material detection (default 0.15)
         max_materials: Maximum number of materials to detect (default 5)
-    
+        backend: 'keras', 'tflite-float16', 'tflite-int8' or 'savedmodel' (default 'keras')
+        decoder: 'pil', 'pil-draft' or 'cv2' (default 'pil')
+        cache: Optional PredictionCache; hits are returned without loading
+            the model
+        timings: Add a 'timings' dict of milliseconds per stage (cache_lookup,
+            tf_import, model_load, decode, inference, postprocess, total)
+        classifier: 'softmax' (the trained head), 'prototype' or 'knn'
+            (backbone embeddings against embedding_store_dir, by default
+            the store embedding_store.py --model writes for this model)
+        dataset_cache_dir: Dataset cache holding the stored images' labels
+
     Returns:
         Dictionary with predictions, detected materials, and analysis
     """
-    
+
     if not TF_AVAILABLE:
         return {
             'error': 'TensorFlow not available',
             'predictions': []
         }
-    
+
     if not os.path.exists(model_path):
         return {
             'error': f'Model not found: {model_path}',
             'predictions': []
         }
-    
+
     if not os.path.exists(labels_path):
         return {
             'error': f'Labels not found: {labels_path}',
             'predictions': []
         }
-    
+
     if not os.path.exists(image_path):
         return {
             'error': f'Image not found: {image_path}',
             'predictions': []
         }
-    
+
+    # Embedding classifiers gain classes as images are uploaded, so their
+    # results cannot be cached by model identity
+    if classifier != 'softmax':
+        cache = None
+
+    timer = StageTimer()
     try:
-        with open(labels_path, 'r') as f:
-            labels_map = json.load(f)
-        
-        labels_map = {int(k): v for k, v in labels_map.items()}
-        
-        model = keras.models.load_model(model_path, compile=False)
-        
-        img_array = load_and_preprocess_image(image_path)
-        
-        predictions = model.predict(img_array, verbose=0)
-        
-        pred_classes = []
-        for idx, confidence in enumerate(predictions[0]):
-            class_name = labels_map.get(idx, f'class_{idx}')
-            pred_classes.append({
-                'class': class_name,
-                'confidence': float(confidence)
-            })
-        
-        pred_classes.sort(key=lambda x: x['confidence'], reverse=True)
-        
-        detected_materials = [
-            p for p in pred_classes 
-            if p['confidence'] >= multi_material_threshold
-        ][:max_materials]
-        
-        is_multi_material = len(detected_materials) > 1
-        
-        top_prediction = pred_classes[0] if pred_classes else None
-        confidence_gap = 0
-        if len(pred_classes) >= 2:
-            confidence_gap = pred_classes[0]['confidence'] - pred_classes[1]['confidence']
-        
-        return {
-            'predictions': pred_classes,
-            'detectedMaterials': detected_materials,
-            'isMultiMaterial': is_multi_material,
-            'topPrediction': top_prediction,
-            'confidenceGap': confidence_gap,
-            'threshold': multi_material_threshold,
-            'model': os.path.basename(model_path),
-            'success': True
-        }
-        
+        model_path = resolve_backend_path(model_path, backend)
+
+        if cache is not None:
+            with timer.stage('cache_lookup'):
+                cache_key = prediction_cache_key(image_path, model_path,
+                                                 labels_path,
+                                                 multi_material_threshold,
+                                                 max_materials, decoder)
+                cached = cache.get(*cache_key)
+            if cached is not None:
+                result = {**cached, 'cached': True}
+                if timings:
+                    result['timings'] = timer.finish()
+                return result
+
+        with timer.stage('tf_import'):
+            import_tensorflow()
+
+        with timer.stage('model_load'):
+            model, labels_map, preprocessing = MODEL_CACHE.get(model_path,
+                                                               labels_path)
+            run_model, to_probabilities, labels_map = classifier_head(
+                model, model_path, labels_map, classifier,
+                embedding_store_dir, dataset_cache_dir)
+
+        with timer.stage('decode'):
+            model_input = prepare_input(model, image_path, preprocessing,
+                                        decoder)
+
+        with timer.stage('inference'):
+            predictions = run_model.predict(collate_inputs([model_input]),
+                                            verbose=0)
+
+        with timer.stage('postprocess'):
+            result = format_predictions(to_probabilities(predictions[0]),
+                                        labels_map, model_path,
+                                        multi_material_threshold,
+                                        max_materials)
+        if cache is not None:
+            cache.put(*cache_key, result)
+        if timings:
+            result = {**result, 'timings': timer.finish()}
+        return result
+
     except Exception as e:
         return {
             'error': str(e),
@@ -125,21 +498,738 @@ def predict(image_path: str, model_path: str, labels_path: str,
         }
 
 
+def read_manifest(manifest_path: str):
+    """Read image paths from a manifest file.
+
+    Each non-empty line is either a path or a JSON object with an "image" key.
+    Relative paths are resolved against the manifest's directory.
+    """
+    base_dir = Path(manifest_path).parent
+    paths = []
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                line = json.loads(line)['image']
+            path = Path(line)
+            if not path.is_absolute():
+                path = base_dir / path
+            paths.append(str(path))
+    return paths
+
+
+def collect_image_paths(sources):
+    """Expand directories, glob patterns and manifest files into image paths"""
+    image_paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            image_paths.extend(
+                str(p) for p in sorted(Path(source).iterdir())
+                if p.suffix.lower() in IMAGE_EXTENSIONS)
+        elif any(c in source for c in '*?['):
+            image_paths.extend(
+                p for p in sorted(glob.glob(source, recursive=True))
+                if Path(p).suffix.lower() in IMAGE_EXTENSIONS)
+        elif Path(source).suffix.lower() in MANIFEST_EXTENSIONS:
+            image_paths.extend(read_manifest(source))
+        else:
+            image_paths.append(source)
+    return image_paths
+
+
+def _decode_for_batch(model, image_path, preprocessing, decoder):
+    try:
+        return prepare_input(model, image_path, preprocessing, decoder), None
+    except Exception as e:
+        return None, str(e)
+
+
+def predict_batch(image_paths, model_path: str, labels_path: str,
+                  multi_material_threshold: float = 0.15,
+                  max_materials: int = 5, batch_size: int = 32,
+                  num_workers: int = 4, backend: str = 'keras',
+                  decoder: str = 'pil', classifier: str = 'softmax',
+                  embedding_store_dir=None,
+                  dataset_cache_dir=DEFAULT_CACHE_ROOT):
+    """Run prediction over many images with a single model load
+
+    Images are decoded on a thread pool one batch ahead of model.predict, so
+    decoding overlaps with inference.
+
+    Yields:
+        One predict()-shaped dictionary per image, in input order, with an
+        extra 'image' key holding the image path
+    """
+
+    if not TF_AVAILABLE:
+        yield {'error': 'TensorFlow not available', 'predictions': []}
+        return
+
+    for path, kind in ((model_path, 'Model'), (labels_path, 'Labels')):
+        if not os.path.exists(path):
+            yield {'error': f'{kind} not found: {path}', 'predictions': []}
+            return
+
+    model_path = resolve_backend_path(model_path, backend)
+    try:
+        model, labels_map, preprocessing = MODEL_CACHE.get(model_path,
+                                                           labels_path)
+        run_model, to_probabilities, labels_map = classifier_head(
+            model, model_path, labels_map, classifier, embedding_store_dir,
+            dataset_cache_dir)
+    except Exception as e:
+        yield {'error': str(e), 'predictions': []}
+        return
+
+    def decode(image_path):
+        return _decode_for_batch(model, image_path, preprocessing, decoder)
+
+    chunks = [image_paths[i:i + batch_size]
+              for i in range(0, len(image_paths), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = executor.map(decode, chunks[0]) if chunks else None
+        for i, chunk in enumerate(chunks):
+            decoded = list(pending)
+            if i + 1 < len(chunks):
+                pending = executor.map(decode, chunks[i + 1])
+
+            inputs = [item for item, _ in decoded if item is not None]
+            outputs = iter(predict_each(run_model, inputs) if inputs else [])
+
+            for image_path, (item, error) in zip(chunk, decoded):
+                if item is not None:
+                    probabilities, error = next(outputs)
+                if error is not None:
+                    result = {'error': error, 'predictions': []}
+                else:
+                    result = format_predictions(
+                        to_probabilities(probabilities), labels_map,
+                        model_path, multi_material_threshold, max_materials)
+                yield {'image': image_path, **result}
+
+
+class MicroBatcher:
+    """Groups concurrent prediction requests into one model call.
+
+    Requests queue up on the event loop; a batch is flushed as soon as it
+    holds max_batch_size images or the oldest request has waited max_wait_ms.
+    The model runs on a single executor thread so the loop keeps accepting
+    requests while a batch is in flight. predict_fn takes a list of model
+    inputs and returns one (probabilities, error) pair per input, as
+    predict_each() does.
+
+    submit() resolves to (probabilities, queue_wait_ms, inference_ms), where
+    queue_wait_ms is how long the input waited for its batch to start.
+    close() stops the batching task on shutdown.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, model_input):
+        """Queue one model input and wait for its probability row and timings"""
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((model_input, future, loop.time()))
+        return await future
+
+    async def close(self):
+        """Cancel the batching task and any requests still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            future.cancel()
+        self._queue = None
+        self._executor.shutdown(wait=False)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(),
+                                                        remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            inputs = [model_input for model_input, _, _ in batch]
+            started = loop.time()
+            try:
+                outputs = await loop.run_in_executor(self._executor,
+                                                     self.predict_fn, inputs)
+            except Exception as e:
+                outputs = [(None, str(e))] * len(batch)
+            inference_ms = (loop.time() - started) * 1000
+
+            for (_, future, queued), (row, error) in zip(batch, outputs):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(RuntimeError(error))
+                else:
+                    future.set_result(
+                        (row, (started - queued) * 1000, inference_ms))
+
+
+class InferenceServer:
+    """Keeps models resident and answers prediction requests.
+
+    The default model is loaded and warmed up on a background thread so
+    health probes answer immediately; prediction requests wait until it is
+    ready. Requests may name another model/labels pair, which is served from
+    the ModelCache. Requests are handled on a private event loop, and
+    concurrent predictions for the same model are grouped by a MicroBatcher.
+
+    activate() swaps the default model without downtime: the new model is
+    loaded and warmed up first, then active_model is replaced in a single
+    assignment. Requests resolve their model when they start, so in-flight
+    scans finish on the model they started with.
+
+    classifier selects the default head ('softmax', 'prototype' or 'knn');
+    requests may pick another one.
+    """
+
+    def __init__(self, model_path, labels_path, multi_material_threshold=0.15,
+                 max_materials=5, load_timeout=300, max_batch_size=16,
+                 max_wait_ms=5.0, model_cache=None, backend='keras',
+                 decoder='pil', prediction_cache=None, classifier='softmax',
+                 embedding_store_dir=None,
+                 dataset_cache_dir=DEFAULT_CACHE_ROOT):
+        self.active_model = (model_path, labels_path)
+        self.multi_material_threshold = multi_material_threshold
+        self.max_materials = max_materials
+        self.load_timeout = load_timeout
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.cache = model_cache or MODEL_CACHE
+        self.backend = backend
+        self.decoder = decoder
+        self.prediction_cache = prediction_cache
+        self.classifier = classifier
+        self.embedding_store_dir = embedding_store_dir
+        self.dataset_cache_dir = dataset_cache_dir
+        self.stats = LatencyStats()
+        self.error = None
+        self.loop = asyncio.new_event_loop()
+        self._batchers = {}
+        self._ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._load, daemon=True).start()
+        self._loop_thread = threading.Thread(target=self.loop.run_forever,
+                                             daemon=True)
+        self._loop_thread.start()
+
+    def stop(self):
+        """Close the micro-batchers, then stop and close the request loop"""
+
+        async def close_batchers():
+            await asyncio.gather(*(batcher.close()
+                                   for batcher in self._batchers.values()))
+
+        asyncio.run_coroutine_threadsafe(close_batchers(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._loop_thread.join()
+        self.loop.close()
+
+    def _warm_up(self, model_path, labels_path):
+        if not TF_AVAILABLE:
+            raise RuntimeError('TensorFlow not available')
+        if not os.path.exists(model_path):
+            raise RuntimeError(f'Model not found: {model_path}')
+        if not os.path.exists(labels_path):
+            raise RuntimeError(f'Labels not found: {labels_path}')
+
+        model_path = resolve_backend_path(model_path, self.backend)
+        model, _, preprocessing = self.cache.get(model_path, labels_path)
+        # Run one dummy batch so the first real request does not pay
+        # for graph tracing
+        model.predict(warm_up_input(model, preprocessing), verbose=0)
+
+    def _load(self):
+        try:
+            self._warm_up(*self.active_model)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self._ready.set()
+
+    def activate(self, model_path, labels_path):
+        """Load and warm up a model, then make it the default for new requests.
+
+        Blocks the calling thread (not the request loop) while loading. On
+        failure the current model stays active and the exception propagates.
+        """
+        self._warm_up(model_path, labels_path)
+        self.active_model = (model_path, labels_path)
+        self.error = None
+        self._ready.set()
+        if self.prediction_cache is not None:
+            self.prediction_cache.invalidate_except(model_identity(
+                resolve_backend_path(model_path, self.backend), labels_path))
+
+    def _get_batcher(self, model_path, labels_path, embeddings=False):
+        """Batcher for a model's probabilities, or its backbone embeddings"""
+        key = (model_path, labels_path, embeddings)
+        if key not in self._batchers:
+
+            def predict_fn(inputs):
+                model, _, _ = self.cache.get(model_path, labels_path)
+                if embeddings:
+                    model = EMBEDDING_CLASSIFIERS.extractor(model)
+                return predict_each(model, inputs)
+
+            self._batchers[key] = MicroBatcher(predict_fn, self.max_batch_size,
+                                               self.max_wait_ms)
+        return self._batchers[key]
+
+    @property
+    def ready(self):
+        return self._ready.is_set() and self.error is None
+
+    def health(self):
+        return {'status': 'ok'}
+
+    def readiness(self):
+        return {
+            'ready': self.ready,
+            'loading': not self._ready.is_set(),
+            'model': os.path.basename(self.active_model[0]),
+            'error': self.error,
+            'cache': self.cache.stats(),
+            'prediction_cache': (self.prediction_cache.stats()
+                                 if self.prediction_cache is not None else None)
+        }
+
+    async def predict(self, image_path, multi_material_threshold=None,
+                      max_materials=None, model_path=None, labels_path=None,
+                      timings=False, classifier=None):
+        """Same result payload as predict(), using a resident model
+
+        Stage timings of successful requests are recorded in self.stats, and
+        added to the result as 'timings' when requested.
+        """
+        timer = StageTimer()
+        result = await self._predict(timer, image_path,
+                                     multi_material_threshold, max_materials,
+                                     model_path, labels_path,
+                                     classifier or self.classifier)
+        stage_timings = timer.finish()
+        if 'error' not in result:
+            self.stats.observe(stage_timings)
+        if timings:
+            result = {**result, 'timings': stage_timings}
+        return result
+
+    async def _predict(self, timer, image_path, multi_material_threshold,
+                       max_materials, model_path, labels_path, classifier):
+        loop = asyncio.get_running_loop()
+        if not model_path:
+            model_path, labels_path = self.active_model
+        labels_path = labels_path or self.active_model[1]
+
+        for path, kind in ((model_path, 'Model'), (labels_path, 'Labels'),
+                           (image_path, 'Image')):
+            if not path or not os.path.exists(path):
+                return {'error': f'{kind} not found: {path}', 'predictions': []}
+
+        if multi_material_threshold is None:
+            multi_material_threshold = self.multi_material_threshold
+        if max_materials is None:
+            max_materials = self.max_materials
+
+        try:
+            is_default_model = model_path == self.active_model[0]
+            model_path = resolve_backend_path(model_path, self.backend)
+
+            # Cache hits are answered even while the model is still loading.
+            # Embedding classifiers gain classes as images are uploaded, so
+            # their results are not cached
+            cache_key = None
+            if self.prediction_cache is not None and classifier == 'softmax':
+                with timer.stage('cache_lookup'):
+                    cache_key = await loop.run_in_executor(
+                        None, prediction_cache_key, image_path, model_path,
+                        labels_path, multi_material_threshold, max_materials,
+                        self.decoder)
+                    cached = await loop.run_in_executor(
+                        None, self.prediction_cache.get, *cache_key)
+                if cached is not None:
+                    return {**cached, 'cached': True}
+
+            if is_default_model:
+                if not await loop.run_in_executor(None, self._ready.wait,
+                                                  self.load_timeout):
+                    return {'error': 'Model is still loading', 'predictions': []}
+                if self.error:
+                    return {'error': self.error, 'predictions': []}
+
+            with timer.stage('model_load'):
+                model, labels_map, preprocessing = await loop.run_in_executor(
+                    None, self.cache.get, model_path, labels_path)
+                _, to_probabilities, labels_map = await loop.run_in_executor(
+                    None, classifier_head, model, model_path, labels_map,
+                    classifier, self.embedding_store_dir,
+                    self.dataset_cache_dir)
+            with timer.stage('decode'):
+                model_input = await loop.run_in_executor(
+                    None, prepare_input, model, image_path, preprocessing,
+                    self.decoder)
+            batcher = self._get_batcher(model_path, labels_path,
+                                        classifier != 'softmax')
+            row, queue_ms, inference_ms = await batcher.submit(model_input)
+            timer.add('queue_wait', queue_ms)
+            timer.add('inference', inference_ms)
+            with timer.stage('postprocess'):
+                result = format_predictions(to_probabilities(row), labels_map,
+                                            model_path,
+                                            multi_material_threshold,
+                                            max_materials)
+            if cache_key is not None:
+                await loop.run_in_executor(None, self.prediction_cache.put,
+                                           *cache_key, result)
+            return result
+        except Exception as e:
+            return {'error': str(e), 'predictions': []}
+
+    async def handle_async(self, request):
+        """Dispatch one decoded JSON request; echoes its 'id' if present"""
+        cmd = request.get('cmd', 'predict')
+        if cmd == 'health':
+            response = self.health()
+        elif cmd == 'ready':
+            response = self.readiness()
+        elif cmd == 'stats':
+            response = {'stages': self.stats.summary()}
+        elif cmd == 'predict':
+            response = await self.predict(request.get('image'),
+                                          request.get('threshold'),
+                                          request.get('max_materials'),
+                                          request.get('model'),
+                                          request.get('labels'),
+                                          bool(request.get('timings')),
+                                          request.get('classifier'))
+        else:
+            response = {'error': f'Unknown command: {cmd}'}
+
+        if 'id' in request:
+            response = {'id': request['id'], **response}
+        return response
+
+    def submit(self, request):
+        """Schedule a request from any thread; returns a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(self.handle_async(request),
+                                                self.loop)
+
+    def handle(self, request):
+        return self.submit(request).result()
+
+
+def activation_file_source(path):
+    """Read the model activated by sync_model_to_ecobuild.py from a JSON file"""
+
+    def read():
+        try:
+            with open(path, 'r') as f:
+                active = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not active.get('modelPath') or not active.get('labelsPath'):
+            return None
+        return active['modelPath'], active['labelsPath']
+
+    return read
+
+
+def mongo_active_model_source(collection):
+    """Poll an mlmodels collection (or any stand-in with find_one) for the active model"""
+
+    def read():
+        doc = collection.find_one({'isActive': True, 'status': 'ready'},
+                                  {'modelPath': 1, 'labelsPath': 1})
+        if not doc or not doc.get('modelPath') or not doc.get('labelsPath'):
+            return None
+        return doc['modelPath'], doc['labelsPath']
+
+    return read
+
+
+class ModelWatcher:
+    """Polls a source for the active model and hot-swaps it into a server.
+
+    The swap runs on the watcher thread, so requests keep being served by the
+    current model until the new one is loaded and warmed up.
+    """
+
+    def __init__(self, server: InferenceServer, source, interval=5.0):
+        self.server = server
+        self.source = source
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def poll(self):
+        """Check the source once; returns True if a new model was activated"""
+        wanted = self.source()
+        if wanted is None or tuple(wanted) == self.server.active_model:
+            return False
+        self.server.activate(*wanted)
+        print(f'Activated model {wanted[0]}', file=sys.stderr, flush=True)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f'Model watcher error: {e}', file=sys.stderr, flush=True)
+
+
+def serve_stdio(server: InferenceServer):
+    """Answer JSON requests read from stdin with JSON lines on stdout.
+
+    Requests are dispatched without waiting for earlier ones, so responses
+    may arrive out of order; clients match them by 'id'.
+    """
+    write_lock = threading.Lock()
+    in_flight = set()
+
+    def respond(response):
+        with write_lock:
+            print(json.dumps(response), flush=True)
+
+    def on_done(future):
+        in_flight.discard(future)
+        try:
+            respond(future.result())
+        except Exception as e:
+            respond({'error': str(e)})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            respond({'error': f'Invalid JSON request: {e}'})
+            continue
+        future = server.submit(request)
+        in_flight.add(future)
+        future.add_done_callback(on_done)
+
+    wait(list(in_flight))
+
+
+def make_http_handler(server: InferenceServer):
+
+    class InferenceRequestHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/healthz':
+                self._send_json(200, server.health())
+            elif self.path == '/readyz':
+                readiness = server.readiness()
+                self._send_json(200 if readiness['ready'] else 503, readiness)
+            elif self.path == '/metrics':
+                body = server.stats.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send_json(404, {'error': f'Not found: {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send_json(404, {'error': f'Not found: {self.path}'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+            except (ValueError, json.JSONDecodeError) as e:
+                self._send_json(400, {'error': f'Invalid JSON request: {e}'})
+                return
+            request['cmd'] = 'predict'
+            result = server.handle(request)
+            self._send_json(200 if result.get('success') else 422, result)
+
+        def log_message(self, format, *args):
+            # Keep stdout/stderr free for the JSON-line protocol
+            pass
+
+    return InferenceRequestHandler
+
+
+def serve_http(server: InferenceServer, host: str, port: int):
+    """Serve /healthz, /readyz, /metrics and POST /predict on a local HTTP socket"""
+    httpd = ThreadingHTTPServer((host, port), make_http_handler(server))
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
 def main():
     parser = argparse.ArgumentParser(description='Run inference on an image')
-    parser.add_argument('--image', required=True, help='Path to image file')
+    parser.add_argument('--image', help='Path to image file')
     parser.add_argument('--model', required=True, help='Path to model file')
     parser.add_argument('--labels', required=True, help='Path to labels JSON file')
-    parser.add_argument('--threshold', type=float, default=0.15, 
+    parser.add_argument('--threshold', type=float, default=0.15,
                         help='Confidence threshold for multi-material detection (default: 0.15)')
     parser.add_argument('--max-materials', type=int, default=5,
                         help='Maximum number of materials to detect (default: 5)')
-    
+    parser.add_argument('--backend', choices=BACKENDS, default='keras',
+                        help='Inference backend; TFLite variants use the model_<variant>.tflite and '
+                             'savedmodel the serving/ directory exported next to --model (default: keras)')
+    parser.add_argument('--decoder', choices=DECODERS, default='pil',
+                        help='Image decode path; pil-draft and cv2 decode JPEGs at reduced '
+                             'resolution first (default: pil)')
+    parser.add_argument('--batch', nargs='+', metavar='SOURCE',
+                        help='Directories, glob patterns or manifest files of images to '
+                             'score; prints one JSON line per image')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Images per model.predict call in --batch mode (default: 32)')
+    parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1),
+                        help='Image decoding threads in --batch mode')
+    parser.add_argument('--serve', action='store_true',
+                        help='Keep the model loaded and answer JSON-line requests on stdin')
+    parser.add_argument('--max-batch-size', type=int, default=16,
+                        help='Most concurrent requests grouped into one model call in --serve mode (default: 16)')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='Longest a request waits for others to batch with in --serve mode (default: 5)')
+    parser.add_argument('--cache-budget-mb', type=float,
+                        default=float(os.environ.get('PREDICT_MODEL_CACHE_MB', 2048)),
+                        help='Weight memory budget for models kept loaded in --serve mode (default: 2048)')
+    parser.add_argument('--cache-db', default=os.environ.get('PREDICTION_CACHE_DB'),
+                        help='SQLite file caching results by image content and model '
+                             '(default: $PREDICTION_CACHE_DB, disabled if unset)')
+    parser.add_argument('--cache-max-entries', type=int, default=100000,
+                        help='Most cached results kept before LRU eviction (default: 100000)')
+    parser.add_argument('--cache-ttl-hours', type=float, default=720,
+                        help='Hours a cached result stays valid (default: 720)')
+    parser.add_argument('--watch-file',
+                        help='Hot-swap to the model named in this activation file when it changes (with --serve)')
+    parser.add_argument('--watch-mongo-uri',
+                        help='Hot-swap to the active model in EcoBuild\'s mlmodels collection (with --serve)')
+    parser.add_argument('--watch-interval', type=float, default=5.0,
+                        help='Seconds between checks for a newly activated model (default: 5)')
+    parser.add_argument('--http-port', type=int, default=None,
+                        help='Also serve /healthz, /readyz, /metrics and POST /predict on this port (with --serve)')
+    parser.add_argument('--http-host', default='127.0.0.1',
+                        help='Interface for the HTTP endpoint (default: 127.0.0.1)')
+    parser.add_argument('--classifier', choices=CLASSIFIERS, default='softmax',
+                        help='softmax uses the trained head; prototype and knn classify backbone '
+                             'embeddings against the embedding store, so classes added since '
+                             'training are predicted too (default: softmax)')
+    parser.add_argument('--embedding-store-dir',
+                        help='Embedding store for prototype/knn (default: the one '
+                             'embedding_store.py --model writes for --model)')
+    parser.add_argument('--dataset-cache-dir', default=str(DEFAULT_CACHE_ROOT),
+                        help='Dataset cache holding the labels of stored embeddings')
+    parser.add_argument('--timings', action='store_true',
+                        help='Add per-stage latency in milliseconds to the result, including '
+                             'process start-up')
+
     args = parser.parse_args()
-    
-    result = predict(args.image, args.model, args.labels, 
-                     args.threshold, args.max_materials)
-    
+
+    prediction_cache = None
+    if args.cache_db:
+        prediction_cache = PredictionCache(args.cache_db,
+                                           args.cache_max_entries,
+                                           args.cache_ttl_hours * 3600)
+
+    if args.serve:
+        server = InferenceServer(args.model, args.labels, args.threshold,
+                                 args.max_materials,
+                                 max_batch_size=args.max_batch_size,
+                                 max_wait_ms=args.max_wait_ms,
+                                 model_cache=ModelCache(
+                                     int(args.cache_budget_mb * 1024 * 1024)),
+                                 backend=args.backend,
+                                 decoder=args.decoder,
+                                 prediction_cache=prediction_cache,
+                                 classifier=args.classifier,
+                                 embedding_store_dir=args.embedding_store_dir,
+                                 dataset_cache_dir=args.dataset_cache_dir)
+        server.start()
+        if args.watch_file:
+            ModelWatcher(server, activation_file_source(args.watch_file),
+                         args.watch_interval).start()
+        if args.watch_mongo_uri:
+            from pymongo import MongoClient
+            collection = MongoClient(args.watch_mongo_uri)['Construction_test']['mlmodels']
+            ModelWatcher(server, mongo_active_model_source(collection),
+                         args.watch_interval).start()
+        httpd = None
+        if args.http_port is not None:
+            httpd = serve_http(server, args.http_host, args.http_port)
+        serve_stdio(server)
+        if httpd is not None:
+            httpd.shutdown()
+        server.stop()
+        return
+
+    if args.batch:
+        image_paths = collect_image_paths(args.batch)
+        for result in predict_batch(image_paths, args.model, args.labels,
+                                    args.threshold, args.max_materials,
+                                    args.batch_size, args.workers,
+                                    args.backend, args.decoder,
+                                    args.classifier, args.embedding_store_dir,
+                                    args.dataset_cache_dir):
+            print(json.dumps(result), flush=True)
+        return
+
+    if not args.image:
+        parser.error('--image is required unless --batch or --serve is used')
+
+    result = predict(args.image, args.model, args.labels,
+                     args.threshold, args.max_materials, args.backend,
+                     args.decoder, prediction_cache, args.timings,
+                     args.classifier, args.embedding_store_dir,
+                     args.dataset_cache_dir)
+    if args.timings and 'timings' in result:
+        result['timings']['startup'] = (round(PROCESS_STARTUP_MS, 3)
+                                        if PROCESS_STARTUP_MS is not None
+                                        else None)
+
     print(json.dumps(result))
 
 
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Persistent, content-addressed cache of prediction results.
+
+Results are keyed by the MD5 of the image bytes (image_preprocessing's
+get_image_hash), the identity of the model that
+produced them and the request options, and stored in a local SQLite file
+shared by every inference process on the host.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+def model_identity(model_path: str, labels_path: str):
+    """Identify a model by its files' paths, mtimes and sizes
+
+    A model rewritten in place gets a new identity, so its old results are
+    never served.
+    """
+    parts = []
+    for path in (model_path, labels_path):
+        stat = os.stat(path)
+        parts.append(f'{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}')
+    return '|'.join(parts)
+
+
+class PredictionCache:
+    """SQLite-backed cache of predict() payloads.
+
+    Entries expire after ttl_seconds, and put() evicts the least recently
+    used entries whenever there are more than max_entries. The row count is
+    kept by triggers, so checking it does not scan the table.
+    invalidate_except() drops every other model's results when a new model
+    is activated.
+    """
+
+    def __init__(self, db_path: str, max_entries=100000,
+                 ttl_seconds=30 * 24 * 3600):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(db_path, timeout=30,
+                                     check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS predictions (
+                    image_hash TEXT NOT NULL,
+                    model_key TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (image_hash, model_key, options)
+                )''')
+            self._conn.execute('''
+                CREATE INDEX IF NOT EXISTS predictions_last_used
+                ON predictions (last_used)''')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS prediction_count (n INTEGER NOT NULL)')
+            self._conn.execute(
+                'INSERT INTO prediction_count SELECT 0 '
+                'WHERE NOT EXISTS (SELECT 1 FROM prediction_count)')
+            self._conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS predictions_count_insert
+                AFTER INSERT ON predictions
+                BEGIN UPDATE prediction_count SET n = n + 1; END''')
+            self._conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS predictions_count_delete
+                AFTER DELETE ON predictions
+                BEGIN UPDATE prediction_count SET n = n - 1; END''')
+
+    @staticmethod
+    def options_key(**options):
+        return json.dumps(options, sort_keys=True)
+
+    def get(self, image_hash: str, model_key: str, options: str):
+        """Return the stored payload, or None on a miss or expired entry"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT payload, created_at FROM predictions '
+                'WHERE image_hash = ? AND model_key = ? AND options = ?',
+                (image_hash, model_key, options)).fetchone()
+            if row is None:
+                return None
+            payload, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute(
+                    'DELETE FROM predictions '
+                    'WHERE image_hash = ? AND model_key = ? AND options = ?',
+                    (image_hash, model_key, options))
+                return None
+            self._conn.execute(
+                'UPDATE predictions SET last_used = ? '
+                'WHERE image_hash = ? AND model_key = ? AND options = ?',
+                (now, image_hash, model_key, options))
+        return json.loads(payload)
+
+    def put(self, image_hash: str, model_key: str, options: str, payload):
+        now = time.time()
+        with self._lock, self._conn:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete
+            # would not fire the count trigger
+            self._conn.execute(
+                'INSERT INTO predictions '
+                '(image_hash, model_key, options, payload, created_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (image_hash, model_key, options) DO UPDATE SET '
+                'payload = excluded.payload, created_at = excluded.created_at, '
+                'last_used = excluded.last_used',
+                (image_hash, model_key, options, json.dumps(payload), now, now))
+            self._evict_least_recent()
+            self._puts += 1
+            # Expired rows are never served, so purging them can be amortized
+            if self._puts % 100 == 0:
+                self._expire(now)
+
+    def _evict_least_recent(self):
+        count = self._conn.execute(
+            'SELECT n FROM prediction_count').fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                'DELETE FROM predictions WHERE rowid IN ('
+                'SELECT rowid FROM predictions ORDER BY last_used LIMIT ?)',
+                (count - self.max_entries, ))
+
+    def _expire(self, now):
+        self._conn.execute('DELETE FROM predictions WHERE created_at < ?',
+                           (now - self.ttl_seconds, ))
+
+    def _evict(self, now):
+        self._expire(now)
+        self._evict_least_recent()
+
+    def evict(self):
+        with self._lock, self._conn:
+            self._evict(time.time())
+
+    def invalidate_except(self, model_key: str):
+        """Drop results produced by any model other than model_key"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM predictions WHERE model_key != ?',
+                               (model_key, ))
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute(
+                'SELECT n FROM prediction_count').fetchone()[0]
+        return {'entries': entries, 'max_entries': self.max_entries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
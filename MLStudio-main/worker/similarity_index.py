@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Top-k cosine similarity search over image embeddings.
+
+ExactIndex scores every vector with blocked matrix multiplies, which is
+exact and fast enough for tens of thousands of images. IVFIndex clusters the
+vectors with spherical k-means and only scores the clusters nearest to the
+query (an inverted file index), trading a little recall for sublinear query
+time on large sets. build_index() picks between them by size.
+
+Run as a script to find the training images most similar to an image or a
+stored hash, or with --benchmark to time both indexes on synthetic data.
+"""
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from dataset_cache import DEFAULT_CACHE_ROOT, DatasetCache
+from embedding_store import EmbeddingStore
+from image_preprocessing import decode_image, get_image_hash
+
+# Above this many vectors build_index() uses IVFIndex
+EXACT_SEARCH_LIMIT = 50000
+
+
+def normalize_rows(vectors, dtype=np.float32):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(dtype)
+
+
+def _normalize_blocked(vectors, dtype=np.float16, block_size=65536):
+    """Unit-normalize rows into a new array without a full float32 copy"""
+    out = np.empty(vectors.shape, dtype=dtype)
+    for start in range(0, len(vectors), block_size):
+        out[start:start + block_size] = normalize_rows(
+            vectors[start:start + block_size], dtype)
+    return out
+
+
+def _merge_top_k(best_scores, best_rows, scores, rows, k):
+    """Merge a block of candidate scores into the running top k per query"""
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        rows = np.take_along_axis(rows, part, axis=1)
+    if best_scores is not None:
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, rows], axis=1)
+    order = np.argsort(-scores, axis=1)[:, :k]
+    return (np.take_along_axis(scores, order, axis=1),
+            np.take_along_axis(rows, order, axis=1))
+
+
+class ExactIndex:
+    """Brute-force cosine search in blocks of block_size vectors.
+
+    Vectors are kept as float32 by default: converting float16 rows costs
+    more than the matrix multiply itself. Pass dtype=np.float16 to halve
+    memory for batch queries over large sets.
+    """
+
+    def __init__(self, embeddings, ids, block_size=16384, dtype=np.float32):
+        self.vectors = _normalize_blocked(embeddings, dtype)
+        self.ids = np.asarray(ids)
+        self.block_size = block_size
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, k=10):
+        """(scores, ids) of the k most similar vectors for each query row"""
+        queries = normalize_rows(np.atleast_2d(queries))
+        k = min(k, len(self.vectors))
+        best_scores = best_rows = None
+        for start in range(0, len(self.vectors), self.block_size):
+            block = self.vectors[start:start + self.block_size].astype(
+                np.float32, copy=False)
+            scores = queries @ block.T
+            rows = np.broadcast_to(
+                np.arange(start, start + len(block)), scores.shape)
+            best_scores, best_rows = _merge_top_k(best_scores, best_rows,
+                                                  scores, rows, k)
+        return best_scores, self.ids[best_rows]
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=10, seed=0,
+                     block_size=16384):
+    """Unit-norm centroids of float16 unit vectors"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters,
+                                   replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignments = _assign(vectors, centroids, block_size)
+        sums = np.zeros_like(centroids)
+        for start in range(0, len(vectors), block_size):
+            np.add.at(sums, assignments[start:start + block_size],
+                      vectors[start:start + block_size].astype(np.float32))
+        empty = ~sums.any(axis=1)
+        # Re-seed empty clusters with random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def _assign(vectors, centroids, block_size=16384):
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size].astype(np.float32)
+        assignments[start:start + block_size] = np.argmax(
+            block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """Inverted file index: k-means clusters scanned nearest-first.
+
+    Vectors are stored grouped by cluster, so scanning a cluster is one
+    contiguous matrix multiply. Queries score n_probe clusters exactly.
+    """
+
+    def __init__(self, embeddings, ids, n_lists=None, n_probe=None,
+                 sample_size=None, iterations=10, seed=0):
+        n = len(embeddings)
+        self.n_lists = n_lists or max(1, int(np.sqrt(n)))
+        self.n_probe = n_probe or min(self.n_lists, max(4, self.n_lists // 64))
+
+        # Train centroids on a sample; a few dozen points per list suffice
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, sample_size or 64 * self.n_lists)
+        sample = _normalize_blocked(
+            embeddings[np.sort(rng.choice(n, sample_size, replace=False))])
+        self.centroids = spherical_kmeans(sample, self.n_lists, iterations,
+                                          seed)
+        del sample
+
+        # The nearest centroid does not depend on the vector's norm, so
+        # assign raw rows and normalize straight into cluster order
+        assignments = _assign(embeddings, self.centroids)
+        order = np.argsort(assignments, kind='stable')
+        self.vectors = np.empty(embeddings.shape, dtype=np.float16)
+        for start in range(0, n, 65536):
+            self.vectors[start:start + 65536] = normalize_rows(
+                embeddings[order[start:start + 65536]], np.float16)
+        self.ids = np.asarray(ids)[order]
+        counts = np.bincount(assignments, minlength=self.n_lists)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries, k=10, n_probe=None):
+        """(scores, ids) of the approximate k most similar vectors per query
+
+        Rows with fewer than k vectors in their probed lists are padded with
+        -inf scores.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        nearest = np.argpartition(-(queries @ self.centroids.T),
+                                  n_probe - 1,
+                                  axis=1)[:, :n_probe]
+
+        # Scan list-major, so each list is converted once per query batch
+        probes = {}
+        for q, lists in enumerate(nearest):
+            for c in lists:
+                probes.setdefault(c, []).append(q)
+        candidates = [([], []) for _ in range(len(queries))]
+        for c, qs in probes.items():
+            start, end = self.offsets[c], self.offsets[c + 1]
+            if start == end:
+                continue
+            scores = queries[qs] @ self.vectors[start:end].astype(np.float32).T
+            rows = np.broadcast_to(np.arange(start, end), scores.shape)
+            top_scores, top_rows = _merge_top_k(None, None, scores, rows,
+                                                min(k, end - start))
+            for j, q in enumerate(qs):
+                candidates[q][0].append(top_scores[j])
+                candidates[q][1].append(top_rows[j])
+
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.zeros((len(queries), k), dtype=self.ids.dtype)
+        for q, (scores, rows) in enumerate(candidates):
+            if not scores:
+                continue
+            scores, rows = np.concatenate(scores), np.concatenate(rows)
+            order = np.argsort(-scores)[:k]
+            all_scores[q, :len(order)] = scores[order]
+            all_ids[q, :len(order)] = self.ids[rows[order]]
+        return all_scores, all_ids
+
+
+def build_index(embeddings, ids, exact_limit=EXACT_SEARCH_LIMIT, **kwargs):
+    """ExactIndex for up to exact_limit vectors, IVFIndex beyond"""
+    if len(embeddings) <= exact_limit:
+        return ExactIndex(embeddings, ids)
+    return IVFIndex(embeddings, ids, **kwargs)
+
+
+def synthetic_embeddings(n, dim, path=None, n_centers=1000, seed=0,
+                         block_size=65536):
+    """Clustered float16 vectors, like embeddings of similar-looking images
+
+    With a path they are written to a memory-mapped .npy file, as
+    EmbeddingStore.matrix() returns them.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_centers, dim)).astype(np.float32)
+    if path is None:
+        out = np.empty((n, dim), dtype=np.float16)
+    else:
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float16,
+                                        shape=(n, dim))
+    for start in range(0, n, block_size):
+        size = min(block_size, n - start)
+        labels = rng.integers(0, n_centers, size)
+        out[start:start + size] = centers[labels] + rng.standard_normal(
+            (size, dim), dtype=np.float32)
+    return out
+
+
+def _time_search(index, queries, k, singles=10):
+    """(ids, batch ms per query, single-query ms)"""
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    batch = (time.perf_counter() - start) / len(queries)
+    start = time.perf_counter()
+    for query in queries[:singles]:
+        index.search(query, k)
+    single = (time.perf_counter() - start) / singles
+    return ids, batch * 1000, single * 1000
+
+
+def benchmark(sizes, dim, n_queries=100, k=10, work_dir=None):
+    results = []
+    for n in sizes:
+        embeddings = synthetic_embeddings(
+            n, dim, Path(work_dir) / 'embeddings.npy' if work_dir else None)
+        ids = np.arange(n)
+        rng = np.random.default_rng(1)
+        queries = embeddings[rng.choice(n, n_queries)].astype(np.float32)
+        queries += rng.standard_normal(queries.shape, dtype=np.float32) * 0.5
+
+        # Past the exact search limit a float32 copy may not fit in memory
+        exact_dtype = np.float32 if n <= EXACT_SEARCH_LIMIT else np.float16
+        start = time.perf_counter()
+        exact = ExactIndex(embeddings, ids, dtype=exact_dtype)
+        exact_build = time.perf_counter() - start
+        exact_ids, exact_batch, exact_single = _time_search(exact, queries, k)
+        del exact
+
+        start = time.perf_counter()
+        ivf = IVFIndex(embeddings, ids)
+        ivf_build = time.perf_counter() - start
+        ivf_ids, ivf_batch, ivf_single = _time_search(ivf, queries, k)
+        recall = np.mean([
+            len(set(a) & set(b)) / k for a, b in zip(exact_ids, ivf_ids)
+        ])
+
+        results.append({
+            'vectors': n,
+            'dim': dim,
+            'exact_dtype': np.dtype(exact_dtype).name,
+            'exact_build_s': exact_build,
+            'exact_batch_ms': exact_batch,
+            'exact_single_ms': exact_single,
+            'ivf_lists': ivf.n_lists,
+            'ivf_probe': ivf.n_probe,
+            'ivf_build_s': ivf_build,
+            'ivf_batch_ms': ivf_batch,
+            'ivf_single_ms': ivf_single,
+            f'ivf_recall_at_{k}': float(recall)
+        })
+        del ivf, embeddings
+        print(json.dumps(results[-1]), file=sys.stderr, flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Find visually similar training images')
+    parser.add_argument('--store-dir',
+                        help='Embedding store built by embedding_store.py')
+    parser.add_argument('--image', help='Query image file')
+    parser.add_argument('--hash', help='Query by the content hash of a stored image')
+    parser.add_argument('--model',
+                        help='Trained model the store was built with (default: ImageNet backbone)')
+    parser.add_argument('--k', type=int, default=10,
+                        help='Number of similar images to return (default: 10)')
+    parser.add_argument('--dataset-cache-dir', default=str(DEFAULT_CACHE_ROOT),
+                        help='Decoded image cache, used to name the results')
+    parser.add_argument('--exact-limit', type=int, default=EXACT_SEARCH_LIMIT,
+                        help='Largest store searched exactly (default: 50000)')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Time exact and IVF search on synthetic embeddings')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='Vector counts for --benchmark')
+    parser.add_argument('--dim', type=int, default=1280,
+                        help='Embedding size for --benchmark (default: 1280, EfficientNetB0)')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = benchmark(args.sizes, args.dim, k=args.k,
+                                work_dir=work_dir)
+        # Query times are ms per query, batched and one at a time
+        print(f"{'vectors':>9} {'exact build s':>14} {'batch ms':>9} "
+              f"{'single ms':>10} {'ivf build s':>12} {'batch ms':>9} "
+              f"{'single ms':>10} {'recall@' + str(args.k):>10}")
+        for r in results:
+            print(f"{r['vectors']:>9} {r['exact_build_s']:>14.2f} "
+                  f"{r['exact_batch_ms']:>9.2f} {r['exact_single_ms']:>10.2f} "
+                  f"{r['ivf_build_s']:>12.2f} {r['ivf_batch_ms']:>9.2f} "
+                  f"{r['ivf_single_ms']:>10.2f} "
+                  f"{r[f'ivf_recall_at_{args.k}']:>10.3f}")
+        print(json.dumps(results))
+        return
+
+    if not args.store_dir or not (args.image or args.hash):
+        parser.error('--store-dir and --image or --hash are required unless --benchmark is used')
+
+    store = EmbeddingStore.open(args.store_dir)
+    embeddings, hashes = store.matrix()
+    if len(hashes) == 0:
+        print(json.dumps({'error': f'Embedding store is empty: {args.store_dir}'}))
+        sys.exit(1)
+
+    version = json.loads(store.backbone_version)
+    image_size = tuple(version['preprocessing']['image_size'])
+    query_hash = args.hash
+    if args.image:
+        with open(args.image, 'rb') as f:
+            image_bytes = f.read()
+        query_hash = get_image_hash(image_bytes)
+    if query_hash in store:
+        query = store.get([query_hash])
+    elif args.image:
+        # New image: embed it with the backbone the store was built with
+        from embedding_store import imagenet_backbone, model_backbone
+        backbones = {'efficientnetb0': 'EfficientNetB0',
+                     'efficientnetb2': 'EfficientNetB2'}
+        if args.model:
+            embed, _ = model_backbone(args.model, version['decoder'])
+        elif version['backbone'] in backbones:
+            embed, _ = imagenet_backbone(backbones[version['backbone']],
+                                         image_size, version['decoder'],
+                                         version.get('precision', 'float32'))
+        else:
+            parser.error('--model is required to embed new images for this store')
+        query = embed(
+            decode_image(image_bytes, image_size, version['decoder'])[None])
+    else:
+        print(json.dumps({'error': f'Hash not in embedding store: {query_hash}'}))
+        sys.exit(1)
+
+    index = build_index(embeddings, hashes, args.exact_limit)
+    scores, result_hashes = index.search(query, args.k)
+
+    # Name results after the cached documents with those hashes
+    cache = DatasetCache.for_config(args.dataset_cache_dir, image_size,
+                                    version['decoder'])
+    docs = {}
+    for key, entry in cache.entries.items():
+        docs.setdefault(entry['hash'], {
+            'id': key,
+            'filename': entry['filename'],
+            'label': entry['label']
+        })
+    print(json.dumps({
+        'query_hash': query_hash,
+        'index': type(index).__name__,
+        'results': [{
+            'hash': str(h),
+            'score': float(s),
+            **docs.get(str(h), {})
+        } for h, s in zip(result_hashes[0], scores[0])]
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,27 @@ from pathlib import Path
 from datetime import datetime
 from pymongo import MongoClient
 
+ACTIVE_MODEL_FILE = Path("./data/active_model.json")
+
+
+def write_active_model_file(model_id: str, model_path: Path, labels_path: Path,
+                            path: Path = ACTIVE_MODEL_FILE):
+    """Record the activated model for inference workers watching this file
+
+    Written to a temporary file and renamed into place, so a watcher never
+    reads a partially written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'mlstudioModelId': model_id,
+            'modelPath': str(model_path.absolute()),
+            'labelsPath': str(labels_path.absolute()),
+            'activatedAt': datetime.now().isoformat()
+        }, f, indent=2)
+    os.replace(tmp_path, path)
+
 
 def sync_model(model_id: str, mongo_uri: str, activate: bool = True):
     """Sync a trained model to EcoBuild's MLModel collection"""
@@ -97,6 +118,8 @@ def sync_model(model_id: str, mongo_uri: str, activate: bool = True):
                 {'$set': {'isActive': True}}
             )
             print(f"Model activated as the primary model for EcoBuild")
+            write_active_model_file(model_id, model_path,
+                                    model_dir / 'labels.json')
         
         final_model = ml_models.find_one({'_id': mongo_id})
         print("\nModel synced successfully!")
@@ -0,0 +1,147 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from dataset_cache import DatasetCache
+from image_preprocessing import get_image_hash
+
+
+def make_cache(tmp_path, shard_rows=(3, 4)):
+    cache = DatasetCache(tmp_path, image_size=(4, 2))
+    rng = np.random.default_rng(0)
+    for shard, rows in enumerate(shard_rows):
+        pixels = rng.integers(0, 256, (rows, 2, 4, 3), dtype=np.uint8)
+        name = cache._write_shard(pixels)
+        for row in range(rows):
+            cache.entries[f'{shard}-{row}'] = {
+                'hash': f'{shard}-{row}',
+                'label': 'brick',
+                'filename': f'{shard}-{row}.jpg',
+                'shard': name,
+                'row': row
+            }
+    return cache
+
+
+def test_cached_images_match_read(tmp_path):
+    cache = make_cache(tmp_path)
+    keys = cache.keys()[::-1]
+    images = cache.images(keys)
+    expected = cache.read(keys)
+
+    assert images.shape == expected.shape
+    assert len(images) == len(keys)
+    rows = np.array([6, 0, 3, 3, 1])
+    np.testing.assert_array_equal(images[rows], expected[rows])
+    np.testing.assert_array_equal(images[[2]], expected[[2]])
+    np.testing.assert_array_equal(images[4], expected[4])
+
+
+def test_cached_images_read_from_shards(tmp_path):
+    cache = make_cache(tmp_path)
+    images = cache.images(cache.keys())
+
+    assert all(isinstance(shard, np.memmap) for shard in images._shards)
+
+
+class FakeCollection:
+    """The subset of a pymongo collection DatasetCache.sync() uses"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.fetched = []
+
+    def find(self, query, projection, batch_size=None):
+        ids = query.get('_id', {}).get('$in')
+        if ids is not None:
+            self.fetched.extend(ids)
+        return [{field: doc[field] for field in projection if field in doc}
+                for doc in self.docs if ids is None or doc['_id'] in ids]
+
+
+def make_doc(i, label='brick'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (i * 10, 0, 0)).save(buffer, format='PNG')
+    data = buffer.getvalue()
+    return {'_id': f'doc-{i:03d}', 'data': data,
+            'hash': get_image_hash(data), 'material_key': label,
+            'filename': f'{i}.png'}
+
+
+def test_sync_starts_from_the_index_on_disk(tmp_path):
+    first = DatasetCache(tmp_path, image_size=(8, 8))
+    second = DatasetCache(tmp_path, image_size=(8, 8))
+    docs = [make_doc(i) for i in range(5)]
+
+    first.sync(FakeCollection(docs[:3]), log=lambda message: None)
+    stats = second.sync(FakeCollection(docs), log=lambda message: None)
+
+    assert stats['added'] == 2 and stats['unchanged'] == 3
+    reloaded = DatasetCache(tmp_path, image_size=(8, 8))
+    assert reloaded.keys() == [doc['_id'] for doc in docs]
+    assert len({entry['shard'] for entry in reloaded.entries.values()}) == 2
+
+
+def test_readers_survive_another_process_compacting(tmp_path):
+    docs = [make_doc(i) for i in range(8)]
+    writer = DatasetCache(tmp_path, image_size=(8, 8), shard_size=2)
+    writer.sync(FakeCollection(docs), log=lambda message: None)
+    reader = DatasetCache(tmp_path, image_size=(8, 8), shard_size=2)
+    keys = reader.keys()
+    expected = DatasetCache(tmp_path, image_size=(8, 8)).read(keys)
+
+    # Dropping most documents compacts and deletes the reader's shards
+    writer.sync(FakeCollection(docs[:1]), log=lambda message: None)
+    assert not any((tmp_path / name).exists() for name in reader.shards)
+
+    np.testing.assert_array_equal(reader.read(keys), expected)
+    np.testing.assert_array_equal(reader.images(keys)[[0, 7]],
+                                  expected[[0, 7]])
+
+
+def test_sync_waits_for_the_cache_lock(tmp_path):
+    holder = DatasetCache(tmp_path, image_size=(8, 8))
+    syncing = DatasetCache(tmp_path, image_size=(8, 8))
+    done = threading.Event()
+
+    def sync():
+        syncing.sync(FakeCollection([make_doc(0)]), log=lambda message: None)
+        done.set()
+
+    with holder._locked():
+        thread = threading.Thread(target=sync)
+        thread.start()
+        assert not done.wait(0.3)
+    assert done.wait(5)
+    thread.join()
+
+
+def test_sync_fetches_only_new_and_changed_documents(tmp_path):
+    cache = DatasetCache(tmp_path, image_size=(8, 8))
+    docs = [make_doc(i) for i in range(4)]
+    small = io.BytesIO()
+    Image.new('RGB', (20, 20)).save(small, format='PNG')
+    docs.append({'_id': 'doc-small', 'data': small.getvalue(),
+                 'hash': get_image_hash(small.getvalue()),
+                 'filename': 'small.png'})
+    cache.sync(FakeCollection(docs), log=lambda message: None)
+
+    changed = make_doc(9)
+    changed['_id'] = 'doc-001'
+    docs[1] = changed
+    docs[2] = {**docs[2], 'material_key': 'wood'}
+    del docs[3]
+    docs.append(make_doc(4))
+    collection = FakeCollection(docs)
+    stats = cache.sync(collection, log=lambda message: None)
+
+    assert stats == {'added': 2, 'removed': 1, 'relabelled': 1,
+                     'skipped': 1, 'unchanged': 1}
+    assert sorted(collection.fetched) == ['doc-001', 'doc-004']
+    assert cache.keys() == ['doc-000', 'doc-001', 'doc-002', 'doc-004']
+    assert list(cache.labels()) == ['brick', 'brick', 'wood', 'brick']
+    expected = np.zeros((8, 8, 3), dtype=np.uint8)
+    expected[..., 0] = 90
+    np.testing.assert_array_equal(cache.read(['doc-001'])[0], expected)
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from dataset_cache import DatasetCache
+from embedding_classifier import (EmbeddingClassifierCache, KNNClassifier,
+                                  PrototypeClassifier)
+from embedding_store import EmbeddingStore, backbone_version, file_digest
+
+
+def clustered_embeddings(rng, per_class=20, dim=16, noise=0.1):
+    centers = rng.normal(size=(3, dim))
+    labels = np.repeat(np.array(['brick', 'glass', 'wood']), per_class)
+    embeddings = (np.repeat(centers, per_class, axis=0) +
+                  noise * rng.normal(size=(3 * per_class, dim)))
+    return centers, embeddings.astype(np.float32), labels
+
+
+@pytest.mark.parametrize('make_classifier', [
+    lambda embeddings, labels: PrototypeClassifier(embeddings, labels),
+    lambda embeddings, labels: KNNClassifier(embeddings, labels, k=5)
+])
+def test_classifies_by_nearest_class(make_classifier):
+    rng = np.random.default_rng(0)
+    centers, embeddings, labels = clustered_embeddings(rng)
+    classifier = make_classifier(embeddings, labels)
+
+    queries = centers + 0.1 * rng.normal(size=centers.shape)
+    probabilities = classifier.predict_proba(queries.astype(np.float32))
+
+    assert list(classifier.classes) == ['brick', 'glass', 'wood']
+    assert list(classifier.counts) == [20, 20, 20]
+    np.testing.assert_allclose(probabilities.sum(axis=1), 1, rtol=1e-5)
+    assert list(probabilities.argmax(axis=1)) == [0, 1, 2]
+
+
+def test_prototype_is_the_normalized_class_mean():
+    embeddings = np.array([[2, 0], [0, 3], [0, 1]], dtype=np.float32)
+    classifier = PrototypeClassifier(embeddings, ['a', 'b', 'b'])
+
+    np.testing.assert_allclose(classifier.prototypes, [[1, 0], [0, 1]])
+
+
+def test_knn_with_fewer_images_than_k():
+    embeddings = np.array([[1, 0], [0, 1]], dtype=np.float32)
+    classifier = KNNClassifier(embeddings, ['a', 'b'], k=10)
+
+    probabilities = classifier.predict_proba(
+        np.array([[1, 0.1]], dtype=np.float32))
+
+    assert np.isfinite(probabilities).all()
+    assert probabilities[0, 0] > probabilities[0, 1]
+    np.testing.assert_allclose(probabilities.sum(), 1, rtol=1e-5)
+
+
+def make_model_store(tmp_path, labels):
+    model_path = tmp_path / 'model' / 'model.keras'
+    model_path.parent.mkdir()
+    model_path.write_bytes(b'weights')
+    version = backbone_version('model', file_digest(model_path),
+                               {'image_size': [2, 2]}, 'pil')
+    cache = DatasetCache.for_config(tmp_path / 'cache', (2, 2), 'pil')
+    name = cache._write_shard(np.zeros((len(labels), 2, 2, 3), np.uint8))
+    for row, label in enumerate(labels):
+        cache.entries[f'doc-{row}'] = {'hash': f'h{row}', 'label': label,
+                                       'filename': f'{row}.png',
+                                       'shard': name, 'row': row}
+    cache._save_index()
+    store = EmbeddingStore(tmp_path / 'store', version)
+    return str(model_path), store
+
+
+def test_new_class_is_predictable_once_embedded(tmp_path):
+    model_path, store = make_model_store(tmp_path, ['brick', 'brick', 'glass'])
+    store.add(['h0', 'h1'], [[1, 0], [1, 0.1]])
+    store.save()
+    classifiers = EmbeddingClassifierCache()
+
+    _, labels_map = classifiers.get('prototype', model_path, store.store_dir,
+                                    tmp_path / 'cache')
+    assert labels_map == {0: 'brick'}
+
+    store.add(['h2'], [[0, 1]])
+    store.save()
+    classifier, labels_map = classifiers.get('prototype', model_path,
+                                             store.store_dir,
+                                             tmp_path / 'cache')
+
+    assert labels_map == {0: 'brick', 1: 'glass'}
+    assert classifier.predict_proba(
+        np.array([[0.1, 1]], dtype=np.float32)).argmax() == 1
+
+
+def test_store_from_another_model_is_rejected(tmp_path):
+    model_path, store = make_model_store(tmp_path, ['brick'])
+    store.add(['h0'], [[1, 0]])
+    store.save()
+    with open(model_path, 'wb') as f:
+        f.write(b'retrained weights')
+
+    with pytest.raises(RuntimeError, match='not built from'):
+        EmbeddingClassifierCache().get('knn', model_path, store.store_dir,
+                                       tmp_path / 'cache')
@@ -0,0 +1,95 @@
+import json
+
+import numpy as np
+
+from dataset_cache import DatasetCache
+from embedding_store import EmbeddingStore, sync_embeddings
+
+
+def fake_embed(calls):
+
+    def embed(images):
+        calls.append(len(images))
+        # One row per image, derived from its pixels
+        return images.reshape(len(images), -1)[:, :4].astype(np.float32)
+
+    return embed
+
+
+def pixels_for(hashes):
+    return np.stack([np.full((2, 2, 3), int(h), dtype=np.uint8)
+                     for h in hashes])
+
+
+def test_update_embeds_only_new_hashes(tmp_path):
+    store = EmbeddingStore(tmp_path, 'v1')
+    calls = []
+    log = lambda message: None
+    store.update(['1', '2', '3'], pixels_for, fake_embed(calls), 2, log)
+
+    stats = store.update(['2', '3', '4', '4'], pixels_for, fake_embed(calls),
+                         2, log)
+
+    assert stats == {'embedded': 1, 'removed': 1, 'reused': 2}
+    assert calls == [2, 1, 1]
+    assert '1' not in store and len(store) == 3
+    np.testing.assert_array_equal(store.get(['4', '2'])[:, 0], [4, 2])
+
+
+def test_store_persists_per_backbone_version(tmp_path):
+    store = EmbeddingStore(tmp_path, 'v1')
+    store.add(['a', 'b'], np.ones((2, 3)))
+    store.save()
+
+    reopened = EmbeddingStore.open(tmp_path)
+    assert reopened.backbone_version == 'v1'
+    assert len(reopened) == 2 and reopened.dim == 3
+    embeddings, hashes = reopened.matrix()
+    assert embeddings.dtype == np.float16
+    assert list(hashes) == ['a', 'b']
+
+    # Embeddings from another backbone are not comparable
+    assert len(EmbeddingStore(tmp_path, 'v2')) == 0
+
+
+def test_store_ignores_an_interrupted_save(tmp_path):
+    store = EmbeddingStore(tmp_path, 'v1')
+    store.add(['a', 'b'], np.ones((2, 3)))
+    store.save()
+    meta = json.loads((tmp_path / 'meta.json').read_text())
+    (tmp_path / 'meta.json').write_text(json.dumps({**meta, 'count': 3}))
+
+    assert len(EmbeddingStore(tmp_path, 'v1')) == 0
+
+
+def test_retain_drops_pending_and_stored_rows(tmp_path):
+    store = EmbeddingStore(tmp_path, 'v1')
+    store.add(['a', 'b'], np.ones((2, 3)))
+    store.save()
+    store.add(['c'], np.zeros((1, 3)))
+
+    store.retain(['b', 'c'])
+    store.save()
+
+    assert list(store.matrix()[1]) == ['b', 'c']
+
+
+def test_sync_embeddings_follows_the_dataset_cache(tmp_path):
+    cache = DatasetCache(tmp_path / 'cache', image_size=(2, 2))
+    name = cache._write_shard(pixels_for(['5', '6', '5']))
+    for row, (key, image_hash) in enumerate([('x', 'h5'), ('y', 'h6'),
+                                             ('z', 'h5')]):
+        cache.entries[key] = {'hash': image_hash, 'label': key,
+                              'filename': f'{key}.png', 'shard': name,
+                              'row': row}
+    store = EmbeddingStore(tmp_path / 'store', 'v1')
+    calls = []
+
+    embeddings, ids, labels, stats = sync_embeddings(
+        cache, store, fake_embed(calls), log=lambda message: None)
+
+    # Duplicate images share one embedding
+    assert calls == [2]
+    assert stats == {'embedded': 2, 'removed': 0, 'reused': 0}
+    assert list(ids) == ['x', 'y', 'z'] and list(labels) == ['x', 'y', 'z']
+    np.testing.assert_array_equal(embeddings[:, 0], [5, 6, 5])
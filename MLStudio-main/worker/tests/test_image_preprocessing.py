@@ -0,0 +1,67 @@
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_preprocessing
+
+
+def test_load_preprocessing_reads_recorded_spec(tmp_path):
+    spec = dict(image_preprocessing.TRAINING_PREPROCESSING)
+    (tmp_path / 'metadata.json').write_text(
+        json.dumps({'preprocessing': spec}))
+
+    assert image_preprocessing.load_preprocessing(
+        str(tmp_path / 'model.keras')) == spec
+
+
+def test_load_preprocessing_defaults_to_legacy_transform(tmp_path):
+    (tmp_path / 'metadata.json').write_text(json.dumps({'classes': 2}))
+
+    assert image_preprocessing.load_preprocessing(
+        str(tmp_path / 'model.keras')
+    ) == image_preprocessing.LEGACY_PREPROCESSING
+    assert image_preprocessing.load_preprocessing(
+        str(tmp_path / 'missing' / 'model.keras')
+    ) == image_preprocessing.LEGACY_PREPROCESSING
+
+
+def make_jpeg(size):
+    # Smooth gradient so resize filters agree closely
+    width, height = size
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([np.broadcast_to(x, (height, width)),
+                       np.broadcast_to(y, (height, width)),
+                       np.full((height, width), 128, np.float32)], axis=-1)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(buffer, format='JPEG',
+                                                  quality=95)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('decoder', ['pil-draft', 'cv2'])
+def test_fast_decoders_match_reference(decoder):
+    if decoder == 'cv2' and image_preprocessing.cv2 is None:
+        pytest.skip('OpenCV not installed')
+    data = make_jpeg((1600, 1200))
+
+    reference = image_preprocessing.decode_image(data, (224, 224), 'pil')
+    fast = image_preprocessing.decode_image(data, (224, 224), decoder)
+
+    assert fast.shape == reference.shape == (224, 224, 3)
+    assert fast.dtype == np.uint8
+    difference = np.abs(fast.astype(np.int16) - reference.astype(np.int16))
+    assert difference.mean() < 2
+
+
+def test_decode_image_accepts_paths_and_bytes(tmp_path):
+    data = make_jpeg((300, 200))
+    path = tmp_path / 'image.jpg'
+    path.write_bytes(data)
+
+    np.testing.assert_array_equal(
+        image_preprocessing.decode_image(str(path), (64, 64), 'pil-draft'),
+        image_preprocessing.decode_image(data, (64, 64), 'pil-draft'))
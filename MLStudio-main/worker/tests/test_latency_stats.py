@@ -0,0 +1,64 @@
+import pytest
+
+from latency_stats import LatencyStats, StageTimer
+
+
+def test_latency_stats_reports_percentiles_per_stage():
+    stats = LatencyStats()
+    for ms in range(1, 101):
+        stats.observe({'decode': float(ms), 'inference': 10.0,
+                       'tf_import': None})
+
+    summary = stats.summary()
+
+    assert set(summary) == {'decode', 'inference'}
+    assert summary['decode']['count'] == 100
+    assert summary['decode']['sum_ms'] == 5050
+    assert summary['decode']['p50_ms'] == pytest.approx(50.5)
+    assert summary['decode']['p95_ms'] == pytest.approx(95.05)
+    assert summary['decode']['p99_ms'] == pytest.approx(99.01)
+    assert summary['inference']['p99_ms'] == 10
+
+
+def test_latency_stats_percentiles_cover_the_recent_window():
+    stats = LatencyStats(window=10)
+    for ms in [1000.0] * 10 + [1.0] * 10:
+        stats.observe({'inference': ms})
+
+    summary = stats.summary()['inference']
+
+    assert summary['count'] == 20
+    assert summary['sum_ms'] == 10010
+    assert summary['p99_ms'] == 1
+
+
+def test_latency_stats_prometheus_exposition():
+    stats = LatencyStats()
+    stats.observe({'total': 4.0})
+    stats.observe({'total': 6.0})
+
+    lines = stats.prometheus().splitlines()
+
+    assert lines == [
+        '# HELP predict_stage_latency_ms Inference latency per stage in '
+        'milliseconds',
+        '# TYPE predict_stage_latency_ms summary',
+        'predict_stage_latency_ms{stage="total",quantile="0.5"} 5.0',
+        'predict_stage_latency_ms{stage="total",quantile="0.95"} 5.9',
+        'predict_stage_latency_ms{stage="total",quantile="0.99"} 5.98',
+        'predict_stage_latency_ms_sum{stage="total"} 10.0',
+        'predict_stage_latency_ms_count{stage="total"} 2',
+    ]
+
+
+def test_stage_timer_accumulates_repeated_stages():
+    timer = StageTimer()
+    timer.add('decode', 1.5)
+    timer.add('decode', 2.0)
+    with timer.stage('inference'):
+        pass
+
+    timings = timer.finish()
+
+    assert timings['decode'] == 3.5
+    assert timings['total'] >= timings['inference'] >= 0
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import predict
+
+
+def make_serving_model(nbytes):
+    # Skips loading a SavedModel; the cache only needs the model object
+    model = predict.ServingModel.__new__(predict.ServingModel)
+    model.nbytes = nbytes
+    return model
+
+
+def test_model_cache_loads_serving_model(tmp_path, monkeypatch):
+    serving_dir = tmp_path / 'serving'
+    serving_dir.mkdir()
+    labels_path = tmp_path / 'labels.json'
+    labels_path.write_text(json.dumps({'0': 'brick', '1': 'wood'}))
+    model = make_serving_model(1234)
+    monkeypatch.setattr(predict, 'load_model', lambda path: model)
+
+    cache = predict.ModelCache()
+    loaded, labels_map, _ = cache.get(str(serving_dir), str(labels_path))
+
+    assert loaded is model
+    assert labels_map == {0: 'brick', 1: 'wood'}
+    assert cache.stats()['bytes'] == 1234
+
+
+def make_model_files(tmp_path, name):
+    model_dir = tmp_path / name
+    model_dir.mkdir()
+    labels_path = tmp_path / f'{name}_labels.json'
+    labels_path.write_text(json.dumps({'0': 'brick'}))
+    return str(model_dir), str(labels_path)
+
+
+def test_slow_load_does_not_block_cached_models(tmp_path, monkeypatch):
+    model_a, labels_a = make_model_files(tmp_path, 'a')
+    model_b, labels_b = make_model_files(tmp_path, 'b')
+    loading_b = threading.Event()
+    release_b = threading.Event()
+
+    def load_model(path):
+        if path == model_b:
+            loading_b.set()
+            release_b.wait(5)
+        return make_serving_model(10)
+
+    monkeypatch.setattr(predict, 'load_model', load_model)
+    cache = predict.ModelCache()
+    cached_a = cache.get(model_a, labels_a)[0]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        swap = executor.submit(cache.get, model_b, labels_b)
+        assert loading_b.wait(5)
+        started = time.perf_counter()
+        assert cache.get(model_a, labels_a)[0] is cached_a
+        assert time.perf_counter() - started < 1
+        assert not swap.done()
+        release_b.set()
+        assert swap.result(5)[0] is not cached_a
+
+
+def test_concurrent_misses_load_once(tmp_path, monkeypatch):
+    model_path, labels_path = make_model_files(tmp_path, 'a')
+    loads = []
+    release = threading.Event()
+
+    def load_model(path):
+        loads.append(path)
+        release.wait(5)
+        return make_serving_model(10)
+
+    monkeypatch.setattr(predict, 'load_model', load_model)
+    cache = predict.ModelCache()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        gets = [executor.submit(cache.get, model_path, labels_path)
+                for _ in range(4)]
+        time.sleep(0.1)
+        release.set()
+        models = {id(get.result(5)[0]) for get in gets}
+
+    assert loads == [model_path]
+    assert len(models) == 1
+
+
+def test_failed_load_is_retried(tmp_path, monkeypatch):
+    model_path, labels_path = make_model_files(tmp_path, 'a')
+
+    def load_model(path):
+        raise OSError('corrupt model')
+
+    monkeypatch.setattr(predict, 'load_model', load_model)
+    cache = predict.ModelCache()
+    with pytest.raises(OSError):
+        cache.get(model_path, labels_path)
+
+    model = make_serving_model(10)
+    monkeypatch.setattr(predict, 'load_model', lambda path: model)
+    assert cache.get(model_path, labels_path)[0] is model
+
+
+def test_model_cache_evicts_least_recently_used_over_budget(
+        tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'load_model',
+                        lambda path: make_serving_model(100))
+    cache = predict.ModelCache(budget_bytes=250)
+    paths = {name: make_model_files(tmp_path, name) for name in 'abc'}
+
+    cache.get(*paths['a'])
+    cache.get(*paths['b'])
+    cache.get(*paths['a'])
+    cache.get(*paths['c'])
+
+    assert cache.stats()['models'] == [paths['a'][0], paths['c'][0]]
+    assert cache.stats()['bytes'] == 200
+
+
+def test_model_cache_keeps_one_model_over_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'load_model',
+                        lambda path: make_serving_model(1000))
+    cache = predict.ModelCache(budget_bytes=10)
+    model_path, labels_path = make_model_files(tmp_path, 'a')
+
+    model = cache.get(model_path, labels_path)[0]
+
+    assert cache.get(model_path, labels_path)[0] is model
+    assert cache.stats()['bytes'] == 1000
+
+
+def test_model_cache_reloads_rewritten_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'load_model',
+                        lambda path: make_serving_model(10))
+    cache = predict.ModelCache()
+    model_path, labels_path = make_model_files(tmp_path, 'a')
+    first = cache.get(model_path, labels_path)[0]
+
+    with open(labels_path, 'w') as f:
+        json.dump({'0': 'brick', '1': 'wood'}, f)
+    second, labels_map, _ = cache.get(model_path, labels_path)
+
+    assert second is not first
+    assert labels_map == {0: 'brick', 1: 'wood'}
+    # The stale version is dropped rather than kept until evicted
+    assert cache.stats()['models'] == [model_path]
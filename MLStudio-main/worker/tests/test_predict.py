@@ -0,0 +1,333 @@
+import asyncio
+import io
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import predict
+
+
+def test_predict_batch_reports_model_load_error(tmp_path, monkeypatch):
+    model_path = tmp_path / 'model.keras'
+    model_path.write_bytes(b'not a model')
+    labels_path = tmp_path / 'labels.json'
+    labels_path.write_text(json.dumps({'0': 'brick'}))
+
+    def load_model(path):
+        raise OSError(f'Unable to load model: {path}')
+
+    monkeypatch.setattr(predict, 'TF_AVAILABLE', True)
+    monkeypatch.setattr(predict, 'load_model', load_model)
+    results = list(
+        predict.predict_batch(['a.jpg', 'b.jpg'], str(model_path),
+                              str(labels_path)))
+
+    assert results == [{
+        'error': f'Unable to load model: {model_path}',
+        'predictions': []
+    }]
+
+
+def test_micro_batcher_close_cancels_its_task():
+    batcher = predict.MicroBatcher(
+        lambda inputs: [(value * 2, None) for value in inputs], max_wait_ms=1)
+
+    async def run():
+        row, _, _ = await batcher.submit(21)
+        task = batcher._task
+        await batcher.close()
+        return row, task
+
+    row, task = asyncio.run(run())
+
+    assert row == 42
+    assert task.cancelled()
+    assert batcher._task is None
+
+
+def test_inference_server_stop_closes_batchers(tmp_path):
+    server = predict.InferenceServer(str(tmp_path / 'model.keras'),
+                                     str(tmp_path / 'labels.json'))
+    server.start()
+    batcher = server._get_batcher('model.keras', 'labels.json')
+    batcher.predict_fn = lambda inputs: [(value, None) for value in inputs]
+    asyncio.run_coroutine_threadsafe(batcher.submit(1), server.loop).result()
+
+    server.stop()
+
+    assert batcher._task is None
+    assert server.loop.is_closed()
+
+
+class FakeModel:
+    """Stands in for a loaded Keras model"""
+
+    def __init__(self, path):
+        self.path = path
+        self.weights = []
+
+    def predict(self, inputs, verbose=0):
+        return np.tile([0.8, 0.2], (len(inputs), 1))
+
+
+def make_model(tmp_path, name):
+    model_path = tmp_path / name / 'model.keras'
+    model_path.parent.mkdir()
+    model_path.write_bytes(b'model')
+    labels_path = tmp_path / name / 'labels.json'
+    labels_path.write_text(json.dumps({'0': 'brick', '1': 'wood'}))
+    return str(model_path), str(labels_path)
+
+
+def make_server(tmp_path, monkeypatch, load_model=FakeModel):
+    monkeypatch.setattr(predict, 'TF_AVAILABLE', True)
+    monkeypatch.setattr(predict, 'load_model', load_model)
+    active = make_model(tmp_path, 'old')
+    server = predict.InferenceServer(*active, model_cache=predict.ModelCache())
+    server._load()
+    return server, active
+
+
+def test_activate_swaps_the_default_model(tmp_path, monkeypatch):
+    server, _ = make_server(tmp_path, monkeypatch)
+    new = make_model(tmp_path, 'new')
+
+    server.activate(*new)
+
+    assert server.active_model == new
+    assert server.ready
+    assert new[0] in server.cache.stats()['models']
+
+
+def test_requests_use_the_old_model_while_activating(tmp_path, monkeypatch):
+    new = make_model(tmp_path, 'new')
+    with open(new[1], 'w') as f:
+        json.dump({'0': 'wood', '1': 'brick'}, f)
+    loading_new = threading.Event()
+    release_new = threading.Event()
+
+    def load_model(path):
+        if path == new[0]:
+            loading_new.set()
+            release_new.wait(5)
+        return FakeModel(path)
+
+    server, _ = make_server(tmp_path, monkeypatch, load_model)
+    server.start()
+    request = {'cmd': 'predict', 'image': make_image(tmp_path)}
+    try:
+        activating = threading.Thread(target=server.activate, args=new)
+        activating.start()
+        assert loading_new.wait(5)
+        during = server.submit(request).result(5)
+        release_new.set()
+        activating.join(5)
+        after = server.submit(request).result(5)
+    finally:
+        release_new.set()
+        server.stop()
+
+    assert during['topPrediction']['class'] == 'brick'
+    assert after['topPrediction']['class'] == 'wood'
+
+
+def test_failed_activate_keeps_the_current_model(tmp_path, monkeypatch):
+    server, active = make_server(tmp_path, monkeypatch)
+
+    with pytest.raises(RuntimeError):
+        server.activate(str(tmp_path / 'missing.keras'), active[1])
+
+    assert server.active_model == active
+    assert server.ready
+
+
+def test_model_watcher_activates_only_new_models(tmp_path, monkeypatch):
+    server, active = make_server(tmp_path, monkeypatch)
+    new = make_model(tmp_path, 'new')
+    wanted = [active]
+    watcher = predict.ModelWatcher(server, lambda: wanted[0])
+
+    assert not watcher.poll()
+    wanted[0] = None
+    assert not watcher.poll()
+    wanted[0] = new
+    assert watcher.poll()
+    assert server.active_model == new
+    assert not watcher.poll()
+
+
+def test_activation_file_source_reads_complete_entries(tmp_path):
+    path = tmp_path / 'active.json'
+    source = predict.activation_file_source(str(path))
+    assert source() is None
+
+    path.write_text(json.dumps({'modelPath': 'model.keras'}))
+    assert source() is None
+
+    path.write_text(
+        json.dumps({'modelPath': 'model.keras', 'labelsPath': 'labels.json'}))
+    assert source() == ('model.keras', 'labels.json')
+
+
+def make_image(tmp_path):
+    image_path = tmp_path / 'image.png'
+    Image.new('RGB', (64, 64), (120, 60, 30)).save(image_path)
+    return str(image_path)
+
+
+def test_serve_stdio_answers_requests_by_id(tmp_path, monkeypatch, capsys):
+    server, _ = make_server(tmp_path, monkeypatch)
+    server.start()
+    image_path = make_image(tmp_path)
+    requests = [{'cmd': 'health', 'id': 1},
+                {'cmd': 'predict', 'image': image_path, 'id': 2},
+                {'cmd': 'predict', 'image': 'missing.png', 'id': 3},
+                {'cmd': 'restart', 'id': 4}]
+    monkeypatch.setattr(
+        sys, 'stdin',
+        io.StringIO('\n'.join(map(json.dumps, requests)) + '\nnot json\n'))
+
+    predict.serve_stdio(server)
+    server.stop()
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    responses = {line.get('id'): line for line in lines}
+    assert responses[1] == {'id': 1, 'status': 'ok'}
+    assert responses[2]['success']
+    assert responses[2]['topPrediction'] == {'class': 'brick',
+                                             'confidence': 0.8}
+    assert responses[3]['error'] == 'Image not found: missing.png'
+    assert responses[4]['error'] == 'Unknown command: restart'
+    assert responses[None]['error'].startswith('Invalid JSON request')
+
+
+def test_server_reports_readiness(tmp_path, monkeypatch):
+    server, active = make_server(tmp_path, monkeypatch)
+
+    readiness = asyncio.run(server.handle_async({'cmd': 'ready'}))
+
+    assert readiness['ready']
+    assert readiness['model'] == 'model.keras'
+    assert readiness['cache']['models'] == [active[0]]
+
+
+def test_predict_batch_keeps_input_order_and_isolates_errors(
+        tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'TF_AVAILABLE', True)
+    monkeypatch.setattr(predict, 'load_model', FakeModel)
+    monkeypatch.setattr(predict, 'MODEL_CACHE', predict.ModelCache())
+    model_path, labels_path = make_model(tmp_path, 'model')
+    good = make_image(tmp_path)
+    corrupt = tmp_path / 'corrupt.jpg'
+    corrupt.write_bytes(b'not an image')
+    image_paths = [good, str(corrupt), good, good]
+
+    results = list(
+        predict.predict_batch(image_paths, model_path, labels_path,
+                              batch_size=2, num_workers=2))
+
+    assert [result['image'] for result in results] == image_paths
+    assert [result.get('success', False) for result in results] == [
+        True, False, True, True
+    ]
+    assert results[1]['predictions'] == []
+    assert results[0]['topPrediction']['class'] == 'brick'
+
+
+def test_collect_image_paths_expands_sources(tmp_path):
+    images = tmp_path / 'images'
+    images.mkdir()
+    for name in ('b.jpg', 'a.png', 'notes.txt'):
+        (images / name).write_bytes(b'')
+    manifest = tmp_path / 'manifest.txt'
+    manifest.write_text('# scans\nimages/a.png\n\n{"image": "/abs/c.jpg"}\n')
+
+    paths = predict.collect_image_paths(
+        [str(images), str(images / '*.jpg'), str(manifest), 'd.jpg'])
+
+    assert paths == [
+        str(images / 'a.png'), str(images / 'b.jpg'), str(images / 'b.jpg'),
+        str(tmp_path / 'images' / 'a.png'), '/abs/c.jpg', 'd.jpg'
+    ]
+
+
+def run_batched(batcher, inputs):
+
+    async def run():
+        results = await asyncio.gather(
+            *(batcher.submit(value) for value in inputs),
+            return_exceptions=True)
+        await batcher.close()
+        return results
+
+    return asyncio.run(run())
+
+
+def test_micro_batcher_flushes_full_batches_without_waiting():
+    calls = []
+
+    def predict_fn(inputs):
+        calls.append(list(inputs))
+        return [(value * 2, None) for value in inputs]
+
+    batcher = predict.MicroBatcher(predict_fn, max_batch_size=4,
+                                   max_wait_ms=10000)
+    started = time.perf_counter()
+    results = run_batched(batcher, range(4))
+
+    assert calls == [[0, 1, 2, 3]]
+    assert [row for row, _, _ in results] == [0, 2, 4, 6]
+    assert time.perf_counter() - started < 5
+
+
+def test_micro_batcher_flushes_partial_batches_after_max_wait():
+    calls = []
+
+    def predict_fn(inputs):
+        calls.append(list(inputs))
+        return [(value, None) for value in inputs]
+
+    batcher = predict.MicroBatcher(predict_fn, max_batch_size=16,
+                                   max_wait_ms=50)
+    results = run_batched(batcher, range(3))
+
+    assert calls == [[0, 1, 2]]
+    queue_ms = [queue for _, queue, _ in results]
+    assert max(queue_ms) >= 40
+
+
+def test_micro_batcher_fails_only_the_inputs_that_error():
+    batcher = predict.MicroBatcher(
+        lambda inputs: [(None, 'bad image') if value == 1 else (value, None)
+                        for value in inputs], max_wait_ms=5)
+
+    results = run_batched(batcher, range(3))
+
+    assert isinstance(results[1], RuntimeError)
+    assert [results[0][0], results[2][0]] == [0, 2]
+
+
+def test_resolve_backend_path_maps_exported_artifacts(tmp_path):
+    model_path = str(tmp_path / 'model.keras')
+    (tmp_path / 'model_float16.tflite').write_bytes(b'tflite')
+    (tmp_path / 'serving').mkdir()
+
+    assert predict.resolve_backend_path(model_path) == model_path
+    assert predict.resolve_backend_path(model_path, 'tflite-float16') == str(
+        tmp_path / 'model_float16.tflite')
+    assert predict.resolve_backend_path(model_path, 'savedmodel') == str(
+        tmp_path / 'serving')
+
+
+def test_resolve_backend_path_falls_back_to_keras(tmp_path):
+    model_path = str(tmp_path / 'model.keras')
+    tflite_path = str(tmp_path / 'model_int8.tflite')
+
+    assert predict.resolve_backend_path(model_path, 'tflite-int8') == model_path
+    # Explicit artifacts are used as given whatever the backend
+    assert predict.resolve_backend_path(tflite_path, 'savedmodel') == tflite_path
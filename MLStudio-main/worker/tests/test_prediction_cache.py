@@ -0,0 +1,81 @@
+import os
+import time
+
+import prediction_cache
+from prediction_cache import PredictionCache, model_identity
+
+
+def row_count(cache):
+    return cache._conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+
+def test_put_keeps_cache_within_max_entries(tmp_path):
+    cache = PredictionCache(str(tmp_path / 'cache.db'), max_entries=5)
+    for i in range(120):
+        cache.put(f'hash-{i}', 'model', '{}', {'i': i})
+        # Rewriting an entry must not change the count
+        cache.put(f'hash-{i}', 'model', '{}', {'i': i})
+
+    assert row_count(cache) == 5
+    assert cache.stats()['entries'] == 5
+    assert cache.get('hash-119', 'model', '{}') == {'i': 119}
+    assert cache.get('hash-114', 'model', '{}') is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = PredictionCache(str(tmp_path / 'cache.db'), max_entries=2)
+    cache.put('a', 'model', '{}', {'image': 'a'})
+    cache.put('b', 'model', '{}', {'image': 'b'})
+    cache.get('a', 'model', '{}')
+    cache.put('c', 'model', '{}', {'image': 'c'})
+
+    assert cache.get('a', 'model', '{}') == {'image': 'a'}
+    assert cache.get('b', 'model', '{}') is None
+
+
+
+def test_expired_entries_are_not_served(tmp_path, monkeypatch):
+    cache = PredictionCache(str(tmp_path / 'cache.db'), ttl_seconds=60)
+    cache.put('a', 'model', '{}', {'image': 'a'})
+
+    later = time.time() + 61
+    monkeypatch.setattr(prediction_cache.time, 'time', lambda: later)
+
+    assert cache.get('a', 'model', '{}') is None
+    assert row_count(cache) == 0
+
+
+def test_invalidate_except_keeps_only_the_active_model(tmp_path):
+    cache = PredictionCache(str(tmp_path / 'cache.db'))
+    cache.put('a', 'old', '{}', {'model': 'old'})
+    cache.put('a', 'new', '{}', {'model': 'new'})
+
+    cache.invalidate_except('new')
+
+    assert cache.get('a', 'old', '{}') is None
+    assert cache.get('a', 'new', '{}') == {'model': 'new'}
+    assert cache.stats()['entries'] == 1
+
+
+def test_entries_persist_across_processes(tmp_path):
+    db_path = str(tmp_path / 'cache.db')
+    cache = PredictionCache(db_path)
+    cache.put('a', 'model', '{}', {'image': 'a'})
+    cache.close()
+
+    reopened = PredictionCache(db_path)
+    assert reopened.get('a', 'model', '{}') == {'image': 'a'}
+    assert reopened.stats()['entries'] == 1
+
+
+def test_model_identity_changes_when_a_model_is_rewritten(tmp_path):
+    model_path = tmp_path / 'model.keras'
+    labels_path = tmp_path / 'labels.json'
+    model_path.write_bytes(b'weights')
+    labels_path.write_text('{}')
+    before = model_identity(str(model_path), str(labels_path))
+
+    model_path.write_bytes(b'new weights')
+    os.utime(model_path, ns=(1, 1))
+
+    assert model_identity(str(model_path), str(labels_path)) != before
@@ -0,0 +1,72 @@
+import numpy as np
+
+from similarity_index import (ExactIndex, IVFIndex, build_index,
+                              synthetic_embeddings)
+
+
+def brute_force_top_k(embeddings, queries, k):
+    vectors = embeddings.astype(np.float64)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+
+
+def recall(found, expected):
+    return np.mean([len(set(f) & set(e)) / len(e)
+                    for f, e in zip(found, expected)])
+
+
+def test_exact_index_matches_brute_force_across_blocks():
+    embeddings = synthetic_embeddings(1000, 16, n_centers=20, seed=1)
+    ids = np.arange(1000) + 5000
+    queries = np.random.default_rng(2).standard_normal((10, 16))
+
+    scores, found = ExactIndex(embeddings, ids, block_size=128).search(
+        queries, k=5)
+
+    expected = brute_force_top_k(embeddings, queries, 5) + 5000
+    np.testing.assert_array_equal(found, expected)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+    assert np.all(scores <= 1 + 1e-5)
+
+
+def test_exact_index_limits_k_to_its_size():
+    scores, found = ExactIndex(np.eye(3), ['a', 'b', 'c']).search([1, 0, 0],
+                                                                  k=10)
+
+    assert found.tolist() == [['a', 'b', 'c']]
+    np.testing.assert_allclose(scores, [[1, 0, 0]])
+
+
+def test_ivf_index_recall_against_exact_search():
+    embeddings = synthetic_embeddings(4000, 32, n_centers=50, seed=3)
+    ids = np.arange(4000)
+    queries = embeddings[::200].astype(np.float32)
+
+    index = IVFIndex(embeddings, ids, n_lists=32, n_probe=8)
+    _, found = index.search(queries, k=10)
+    _, exact = ExactIndex(embeddings, ids).search(queries, k=10)
+
+    assert len(index) == 4000
+    assert recall(found, exact) >= 0.9
+    # Every vector is found by probing its own list
+    _, self_match = index.search(queries, k=1)
+    np.testing.assert_array_equal(self_match[:, 0], ids[::200])
+
+
+def test_ivf_index_pads_short_results():
+    embeddings = np.eye(4)
+    index = IVFIndex(embeddings, ['a', 'b', 'c', 'd'], n_lists=4, n_probe=1)
+
+    scores, found = index.search([0, 1, 0, 0], k=3)
+
+    assert found[0, 0] == 'b'
+    assert scores[0, 0] == 1 and np.all(np.isinf(scores[0, 1:]))
+
+
+def test_build_index_switches_to_ivf_above_the_limit():
+    embeddings = synthetic_embeddings(200, 8, n_centers=5)
+
+    assert isinstance(build_index(embeddings, np.arange(200)), ExactIndex)
+    assert isinstance(build_index(embeddings, np.arange(200), exact_limit=100,
+                                  n_lists=4), IVFIndex)
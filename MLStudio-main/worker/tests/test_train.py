@@ -0,0 +1,622 @@
+import io
+import json
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+import train
+
+
+class Clock:
+
+    def __init__(self, now=1000.):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Schedule:
+
+    def __init__(self):
+        self.total_epochs = None
+
+    def set_total_epochs(self, epochs):
+        self.total_epochs = epochs
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(train.time, 'time', clock)
+    return clock
+
+
+def test_time_budget_shares_time_by_weighted_epochs(clock):
+    # 100s is reserved for finalizing; 900s is shared 3 : 3 : 2
+    budget = train.TimeBudget(1000, clock.now, [3, 2, 1])
+    schedule = Schedule()
+
+    assert budget.start_phase(1, schedule) == 3
+    assert budget.phase_deadline == pytest.approx(clock.now + 900 * 3 / 8)
+    assert schedule.total_epochs == 3
+
+
+def test_time_budget_fits_epochs_to_measured_cost(clock):
+    budget = train.TimeBudget(1000, clock.now, [10, 4, 0])
+    schedule = Schedule()
+    budget.start_phase(1, schedule)
+    # Phase 1 gets 900 * 10 / 16 = 562.5s; each epoch takes 100s
+    for epoch in range(2):
+        budget.on_epoch_begin(epoch)
+        clock.now += 100
+        budget.on_epoch_end(epoch)
+
+    assert budget.epoch_estimate(1) == pytest.approx(100)
+    assert schedule.total_epochs == 5
+    assert budget.epoch_estimate(2) == pytest.approx(150)
+
+
+def test_time_budget_counts_feature_extraction_as_phase_0(clock):
+    budget = train.TimeBudget(1000, clock.now, [3, 2, 1])
+    budget.start_feature_extraction(2)
+    # Views count as phase 0 epochs: 2 : 3 : 3 : 2 of 900s
+    assert budget.phase_deadline == pytest.approx(clock.now + 180)
+    clock.now += 60
+    budget.end_feature_extraction()
+
+    assert budget.epoch_seconds[0] == [30]
+    # Head-only Phase 1 epochs say nothing about the cost of later phases
+    assert budget.epoch_estimate(1) is None
+    assert budget.epoch_estimate(2) == pytest.approx(45)
+
+
+def test_time_budget_skips_exports_that_do_not_fit(clock):
+    budget = train.TimeBudget(100, clock.now, [1, 0, 0])
+    clock.now += 90
+
+    assert budget.export_fits('serving', 5)
+    assert not budget.export_fits('TFLite int8', 15)
+    budget.record_export('serving', 4.04)
+    assert budget.summary()['export_seconds'] == {'serving': 4.0}
+
+
+def test_rng_state_round_trips_through_json():
+    saved = json.loads(json.dumps(train.rng_state()))
+    expected = (random.random(), np.random.rand())
+
+    train.set_rng_state(saved)
+
+    assert (random.random(), np.random.rand()) == expected
+
+
+def make_fitted_model():
+    keras = train.keras
+    model = keras.Sequential([keras.Input((3, )), keras.layers.Dense(2)])
+    model.compile(optimizer='adam', loss='mse')
+    model.fit(np.ones((4, 3)), np.ones((4, 2)), epochs=1, verbose=0)
+    return model
+
+
+def test_training_checkpoint_round_trip(tmp_path):
+    keras = train.keras
+    checkpoint_dir = tmp_path / 'checkpoint'
+    model = make_fitted_model()
+    early_stopping = keras.callbacks.EarlyStopping(patience=3)
+    best = keras.callbacks.ModelCheckpoint(str(tmp_path / 'best.keras'))
+    state = {'phase': 2, 'epoch': 0, 'histories': {}, 'seed': 7}
+    checkpoint = train.TrainingCheckpoint(checkpoint_dir, model, state,
+                                          early_stopping, best)
+    checkpoint.set_model(model)
+    early_stopping.wait, early_stopping.best = 1, 0.5
+    checkpoint.on_epoch_end(0, {'loss': 0.25})
+
+    saved = train.TrainingCheckpoint.load(checkpoint_dir)
+    assert (saved['phase'], saved['epoch']) == (2, 1)
+    assert saved['histories'] == {'2': {'loss': [0.25]}}
+    assert saved['early_stopping'] == {'wait': 1, 'best': 0.5}
+    assert saved['rng'] is not None
+
+    restored = train.TrainingCheckpoint.load_model(checkpoint_dir, saved)
+    for expected, actual in zip(model.get_weights(), restored.get_weights()):
+        np.testing.assert_array_equal(expected, actual)
+
+    restored.compile(optimizer='adam', loss='mse')
+    resumed_stopping = keras.callbacks.EarlyStopping(patience=3)
+    resumed = train.TrainingCheckpoint(
+        checkpoint_dir, restored, saved, resumed_stopping,
+        keras.callbacks.ModelCheckpoint(str(tmp_path / 'best.keras')))
+    assert resumed.start_phase(2, restored) == 1
+    for expected, actual in zip(
+            train.optimizer_variables(model.optimizer),
+            train.optimizer_variables(restored.optimizer)):
+        np.testing.assert_array_equal(np.asarray(expected),
+                                      np.asarray(actual))
+    resumed.on_train_begin()
+    assert (resumed_stopping.wait, resumed_stopping.best) == (1, 0.5)
+
+
+def test_training_checkpoint_starts_new_phases_fresh(tmp_path):
+    keras = train.keras
+    model = make_fitted_model()
+    state = {'phase': 1, 'epoch': 3, 'histories': {}, 'seed': 7}
+    checkpoint = train.TrainingCheckpoint(
+        tmp_path / 'checkpoint', model, state,
+        keras.callbacks.EarlyStopping(),
+        keras.callbacks.ModelCheckpoint(str(tmp_path / 'best.keras')))
+
+    assert checkpoint.start_phase(2, model) == 0
+    assert (state['phase'], state['epoch']) == (2, 0)
+
+
+def test_export_tflite_variants_match_keras(tmp_path):
+    import predict
+
+    model = make_fitted_model()
+    images = np.random.rand(8, 3).astype(np.float32)
+
+    artifacts = train.export_tflite(model, tmp_path, images)
+
+    assert set(artifacts) == {'float16', 'int8'}
+    expected = model.predict(images, verbose=0)
+    for variant, tolerance in (('float16', 1e-2), ('int8', 1e-1)):
+        tflite = predict.TFLiteModel(str(tmp_path / artifacts[variant]['path']))
+        np.testing.assert_allclose(tflite.predict(images), expected,
+                                   atol=tolerance)
+
+
+def test_serving_model_preprocesses_encoded_images(tmp_path):
+    import io
+
+    from PIL import Image
+
+    import image_preprocessing
+    import predict
+
+    keras = train.keras
+    model = keras.Sequential([
+        keras.Input((224, 224, 3)),
+        keras.layers.GlobalAveragePooling2D(),
+        keras.layers.Dense(2, activation='softmax')
+    ])
+    preprocessing = image_preprocessing.TRAINING_PREPROCESSING
+    image_preprocessing.export_serving_model(model, tmp_path / 'serving',
+                                             preprocessing)
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), (200, 120, 40)).save(buffer, format='PNG')
+
+    serving = predict.ServingModel(str(tmp_path / 'serving'))
+    pixels = image_preprocessing.normalize(
+        image_preprocessing.decode_image(buffer.getvalue()), preprocessing)
+
+    np.testing.assert_allclose(serving.predict([buffer.getvalue()]),
+                               model.predict(pixels[None], verbose=0),
+                               atol=1e-4)
+
+
+class Cursor:
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def close(self):
+        self.closed = True
+
+
+class Collection:
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.finds = []
+        self.cursor = None
+
+    def find(self, query, projection, batch_size=None):
+        self.finds.append((query, projection, batch_size))
+        self.cursor = Cursor(self.docs)
+        return self.cursor
+
+
+def encode_image(size, color=(200, 0, 0)):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_stream_mongo_images_projects_and_skips_unusable_docs():
+    data = encode_image((64, 64))
+    collection = Collection([
+        {'data': data, 'material_key': 'brick', 'filename': 'a.png',
+         'hash': 'stored'},
+        {'data': data, 'material_official': 'Wood', 'filename': 'b.png'},
+        {'filename': 'missing.png'},
+        {'data': encode_image((20, 20)), 'filename': 'small.png'},
+        {'data': b'not an image', 'filename': 'corrupt.png'},
+    ])
+
+    images = list(train.stream_mongo_images(collection, (16, 16),
+                                            batch_size=2))
+
+    assert collection.finds == [({}, train.TRAINING_PROJECTION, 2)]
+    assert collection.cursor.closed
+    assert [(label, filename, image_hash)
+            for _, label, filename, image_hash in images] == [
+                ('brick', 'a.png', 'stored'),
+                ('Wood', 'b.png', train.get_image_hash(data))]
+    assert images[0][0].shape == (16, 16, 3)
+    assert images[0][0].dtype == np.uint8
+
+
+def one_hot(classes, num_classes):
+    return np.eye(num_classes, dtype=np.float32)[classes]
+
+
+def test_create_tf_dataset_normalizes_selected_uint8_rows():
+    X = np.random.default_rng(0).integers(0, 256, (6, 4, 4, 3),
+                                          dtype=np.uint8)
+    y = one_hot([0, 1, 0, 1, 0, 1], 2)
+
+    batches = list(train.create_tf_dataset(X, y, 2, shuffle=False,
+                                           indices=[5, 1, 2]))
+
+    images = np.concatenate([images.numpy() for images, _ in batches])
+    labels = np.concatenate([labels.numpy() for _, labels in batches])
+    assert [len(images) for images, _ in batches] == [2, 1]
+    assert images.dtype == np.float32
+    np.testing.assert_allclose(images, X[[5, 1, 2]] / 255.0, atol=1e-6)
+    np.testing.assert_array_equal(labels, y[[5, 1, 2]])
+
+
+def test_create_index_dataset_rebalances_by_sampling_indices():
+    # 18 rows of class 0 and 2 of class 1, of which row 19 is held out
+    y = one_hot([0] * 18 + [1] * 2, 2)
+    indices = np.arange(19)
+
+    batches = train.create_index_dataset(indices, y, 32,
+                                         samples_per_class=200)
+    sampled = np.concatenate([batch.numpy() for batch in batches])
+
+    assert len(sampled) == 400
+    assert set(sampled) <= set(indices)
+    # Classes are drawn with equal weight, so row 18 makes up about half
+    assert 120 < np.sum(sampled == 18) < 280
+
+
+def test_create_index_dataset_uses_every_index_once_without_rebalancing():
+    y = one_hot([0] * 18 + [1] * 2, 2)
+
+    batches = train.create_index_dataset(np.arange(20), y, 8)
+
+    assert sorted(np.concatenate([batch.numpy() for batch in batches])) == \
+        list(range(20))
+
+
+def test_advanced_augment_batch_keeps_pixels_in_range():
+    train.tf.random.set_seed(0)
+    images = np.random.default_rng(0).uniform(0, 255, (16, 32, 32, 3))
+    images = train.tf.constant(images, dtype=train.tf.float32)
+
+    augmented = train.advanced_augment_batch(images).numpy()
+
+    assert augmented.shape == (16, 32, 32, 3)
+    assert augmented.dtype == np.float32
+    assert augmented.min() >= 0 and augmented.max() <= 255
+    # Transforms are drawn per image, so the batch is not changed uniformly
+    changed = np.abs(augmented - images.numpy()).mean(axis=(1, 2, 3))
+    assert changed.max() > 0 and len(np.unique(changed)) > 1
+
+
+def test_rotate_matches_exact_rotations():
+    images = np.arange(2 * 5 * 5 * 3, dtype=np.float32).reshape(2, 5, 5, 3)
+
+    rotated = train._rotate(train.tf.constant(images),
+                            train.tf.constant([0.0, np.pi]), 128.0).numpy()
+
+    np.testing.assert_allclose(rotated[0], images[0], atol=1e-3)
+    np.testing.assert_allclose(rotated[1], images[1, ::-1, ::-1], atol=1e-3)
+
+
+def test_advanced_pil_augmentation_returns_uint8_batches():
+    images = np.random.default_rng(0).integers(0, 256, (4, 32, 32, 3),
+                                               dtype=np.uint8)
+
+    augmented = train.advanced_augment_batch_pil(images)
+
+    assert augmented.shape == images.shape
+    assert augmented.dtype == np.uint8
+
+
+def make_pooled_model():
+    keras = train.keras
+    inputs = keras.Input((8, 8, 3))
+    x = keras.layers.Conv2D(4, 3)(inputs)
+    x = keras.layers.GlobalAveragePooling2D(name='backbone_pool')(x)
+    x = keras.layers.Dense(5, activation='relu')(x)
+    outputs = keras.layers.Dense(2, activation='softmax')(x)
+    return keras.Model(inputs, outputs)
+
+
+def test_split_feature_head_shares_the_models_layers():
+    model = make_pooled_model()
+    images = np.random.default_rng(0).uniform(0, 1, (3, 8, 8, 3))
+
+    feature_extractor, head = train.split_feature_head(model)
+
+    np.testing.assert_allclose(
+        head.predict(feature_extractor.predict(images, verbose=0),
+                     verbose=0),
+        model.predict(images, verbose=0), atol=1e-6)
+    assert head.layers[-1] is model.layers[-1]
+
+
+def test_extract_features_writes_one_row_per_view(tmp_path):
+    feature_extractor, _ = train.split_feature_head(make_pooled_model())
+    X = np.random.default_rng(0).integers(0, 256, (5, 8, 8, 3),
+                                          dtype=np.uint8)
+    y = one_hot([0, 1, 0, 1, 0], 2)
+    indices = np.array([4, 0, 2])
+
+    features = train.extract_features(feature_extractor, X, y, indices, 2,
+                                      tmp_path / 'features.npy', views=2)
+
+    assert features.shape == (6, 4) and features.dtype == np.float16
+    expected = feature_extractor.predict(X[indices] / 255.0, verbose=0)
+    np.testing.assert_allclose(features[:3], expected, rtol=1e-2, atol=1e-3)
+
+
+def test_extract_features_reads_plain_view_from_store(tmp_path):
+    import embedding_store
+
+    feature_extractor, _ = train.split_feature_head(make_pooled_model())
+    X = np.zeros((3, 8, 8, 3), dtype=np.uint8)
+    hashes = ['a', 'b', 'c']
+    store = embedding_store.EmbeddingStore(tmp_path / 'store', 'v1')
+    stored = np.arange(12, dtype=np.float16).reshape(3, 4)
+    store.add(hashes, stored)
+    store.save()
+
+    features = train.extract_features(feature_extractor, X,
+                                      one_hot([0, 1, 0], 2), [2, 0], 2,
+                                      tmp_path / 'features.npy', store=store,
+                                      hashes=hashes)
+
+    np.testing.assert_array_equal(features, stored[[2, 0]])
+
+
+def test_resize_output_layer_keeps_weights_of_known_classes():
+    keras = train.keras
+    model = keras.Sequential([keras.Input((4, )), keras.layers.Dense(5),
+                              keras.layers.Dense(3, activation='softmax')])
+    old_kernel, old_bias = model.layers[-1].get_weights()
+    old_bias[:] = [1, 2, 3]
+    model.layers[-1].set_weights([old_kernel, old_bias])
+
+    resized = train.resize_output_layer(model, ['a', 'b', 'c'],
+                                        ['c', 'a', 'd'])
+
+    kernel, bias = resized.layers[-1].get_weights()
+    assert tuple(resized.output.shape) == (None, 3)
+    np.testing.assert_array_equal(kernel[:, :2], old_kernel[:, [2, 0]])
+    np.testing.assert_array_equal(bias, [3, 1, 0])
+    # The backbone is shared, not copied
+    assert resized.layers[-2] is model.layers[-2]
+    assert train.resize_output_layer(model, ['a', 'b'], ['a', 'b']) is model
+
+
+def test_select_warm_start_samples_replays_old_classes():
+    y = np.repeat([0, 1, 2], 10)
+    is_new = np.zeros(30, dtype=bool)
+    is_new[20:25] = True
+    # Rows 9 and 29 are held out for validation
+    indices = np.setdiff1d(np.arange(30), [9, 29])
+
+    selected, replayed = train.select_warm_start_samples(
+        indices, y, is_new, 4, np.random.default_rng(0))
+
+    # ceil(4 * 5 new / 3 classes) = 7 is raised to MIN_REPLAY_PER_CLASS
+    assert replayed == 8 + 8 + 4
+    assert len(selected) == len(set(selected)) == 5 + replayed
+    assert set(range(20, 25)) <= set(selected) <= set(indices)
+    assert list(np.bincount(y[selected][~is_new[selected]])) == [8, 8, 4]
+    assert list(selected) == sorted(selected)
+
+
+def test_select_warm_start_samples_without_old_samples():
+    is_new = np.ones(6, dtype=bool)
+
+    selected, replayed = train.select_warm_start_samples(
+        np.arange(6), np.zeros(6, dtype=int), is_new, 1,
+        np.random.default_rng(0))
+
+    assert list(selected) == list(range(6)) and replayed == 0
+
+
+def test_load_split_follows_images_by_hash(tmp_path, capsys):
+    train.save_split(tmp_path, ['a', 'b', 'c', 'd'], np.array([0, 1, 2, 1]),
+                     np.array([0, 2, 3]), np.array([1]))
+
+    # 'c' was deleted and 'e' added; rows moved since the split was saved
+    y, train_idx, val_idx = train.load_split(tmp_path, ['e', 'd', 'b', 'a'])
+
+    assert list(train_idx) == [3, 1] and list(val_idx) == [2]
+    assert list(y) == [0, 1, 1, 0]
+    assert '1 images of the saved split no longer exist' in capsys.readouterr().out
+
+
+class Model:
+    stop_training = False
+
+
+def test_time_budget_stops_a_phase_that_outgrows_its_share(clock):
+    budget = train.TimeBudget(1000, clock.now, [4, 0, 0])
+    budget.set_model(Model())
+    schedule = Schedule()
+    budget.start_phase(1, schedule)
+    for epoch, seconds in enumerate([100, 500]):
+        budget.on_epoch_begin(epoch)
+        clock.now += seconds
+        budget.on_epoch_end(epoch)
+
+    # 300s of the 900s share is left, less than one 500s epoch
+    assert budget.model.stop_training
+
+
+def test_time_budget_reserves_time_for_final_evaluation(clock):
+    budget = train.TimeBudget(1000, clock.now, [1, 1, 0])
+    assert budget.training_deadline() == clock.now + 900
+
+    budget.on_test_begin()
+    clock.now += 50
+    budget.on_test_end()
+
+    assert budget.training_deadline() == clock.now - 50 + 850
+    clock.now = budget.training_deadline() + 1
+    budget.set_model(Model())
+    budget.on_train_batch_end(0)
+    assert budget.model.stop_training
+    budget.epoch_seconds[1] = [10]
+    assert not train.phase_fits(budget, 2, Schedule(), 0)
+    assert train.phase_fits(None, 2, Schedule(), 0)
+
+
+@pytest.fixture
+def host(monkeypatch):
+    host = {'gpus': [], 'bfloat16': False}
+    monkeypatch.setattr(train.tf.config, 'list_physical_devices',
+                        lambda kind: host['gpus'] if kind == 'GPU' else [])
+    monkeypatch.setattr(train, 'cpu_supports_bfloat16',
+                        lambda: host['bfloat16'])
+    yield host
+    train.keras.mixed_precision.set_global_policy('float32')
+
+
+def test_precision_candidates_avoid_float16_on_cpu(host):
+    assert train.precision_candidates() == ['float32']
+    host['bfloat16'] = True
+    assert train.precision_candidates() == ['mixed_bfloat16', 'float32']
+    host['gpus'] = ['GPU:0']
+    assert train.precision_candidates() == ['mixed_float16', 'float32']
+
+
+def test_select_precision_policy_keeps_the_fastest_candidate(
+        host, monkeypatch):
+    host['bfloat16'] = True
+    step_seconds = {'mixed_bfloat16': 0.02, 'float32': 0.01}
+    monkeypatch.setattr(train, 'time_precision_policy', step_seconds.get)
+
+    info = train.select_precision_policy()
+
+    assert info['policy'] == 'float32' and info['source'] == 'benchmark'
+    assert info['benchmark_step_ms'] == {'mixed_bfloat16': 20.0,
+                                         'float32': 10.0}
+    assert train.keras.mixed_precision.global_policy().name == 'float32'
+
+
+def test_select_precision_policy_without_benchmark(host, monkeypatch):
+    host['bfloat16'] = True
+
+    def fail(policy):
+        raise RuntimeError('unsupported')
+
+    monkeypatch.setattr(train, 'time_precision_policy', fail)
+
+    assert train.select_precision_policy()['source'] == 'host'
+    assert train.keras.mixed_precision.global_policy().name == \
+        'mixed_bfloat16'
+    info = train.select_precision_policy('mixed_float16')
+    assert (info['policy'], info['source']) == ('mixed_float16', 'flag')
+
+
+def logged_events(capsys):
+    """JSON events printed since the last call, grouped by type"""
+    grouped = {}
+    for line in capsys.readouterr().out.splitlines():
+        event = json.loads(line)
+        grouped.setdefault(event['type'], []).append(event)
+    return grouped
+
+
+@pytest.fixture
+def perf_clock(monkeypatch):
+    clock = Clock(0.)
+    monkeypatch.setattr(train.time, 'perf_counter', clock)
+    return clock
+
+
+def test_training_callback_throttles_batch_events(perf_clock, capsys):
+    callback = train.TrainingCallback(total_epochs=1, event_interval=1.0)
+    callback.on_epoch_begin(0)
+    for batch in range(10):
+        perf_clock.now += 0.3
+        # Keras logs the running mean of per-batch losses 0, 1, 2, ...
+        callback.on_train_batch_end(batch, {'loss': batch / 2,
+                                            'accuracy': 0.5})
+    callback.on_epoch_end(0, {'loss': 4.5})
+
+    logged = logged_events(capsys)
+    batch_events = logged['batch_end']
+    epoch_end = logged['epoch_end'][0]
+    assert [event['batch'] for event in batch_events] == [3, 7]
+    assert [event['window_batches'] for event in batch_events] == [4, 4]
+    assert [event['window_loss'] for event in batch_events] == \
+        pytest.approx([1.5, 5.5])
+    assert batch_events[0]['batches_per_second'] == pytest.approx(4 / 1.2)
+    assert (epoch_end['batches'], epoch_end['batch_events']) == (10, 2)
+
+
+def test_training_callback_reports_every_batch_without_interval(
+        perf_clock, capsys):
+    callback = train.TrainingCallback(total_epochs=1, event_interval=0)
+    callback.on_epoch_begin(0)
+    for batch in range(3):
+        callback.on_train_batch_end(batch, {'loss': 1.0})
+
+    assert len(logged_events(capsys)['batch_end']) == 3
+
+
+def test_step_telemetry_splits_data_wait_from_compute(perf_clock, capsys):
+    telemetry = train.StepTelemetry()
+    telemetry.set_phase(2)
+    telemetry.on_epoch_begin(0)
+    # A mark left over from before the epoch is ignored
+    telemetry._mark(np.zeros(8))
+    for wait, compute in [(0.01, 0.09), (0.05, 0.05)]:
+        perf_clock.now += 1
+        telemetry.on_train_batch_begin(0)
+        perf_clock.now += wait
+        telemetry._mark(np.zeros(8))
+        perf_clock.now += compute
+        telemetry.on_train_batch_end(0)
+    telemetry.on_epoch_end(0)
+
+    event = logged_events(capsys)['step_telemetry'][0]
+    assert (event['phase'], event['steps']) == (2, 2)
+    assert event['data_wait_ms'] == pytest.approx(30)
+    assert event['compute_ms'] == pytest.approx(70)
+    assert event['examples_per_second'] == pytest.approx(80)
+    assert event['data_wait_fraction'] == pytest.approx(0.3)
+    assert event['input_bound']
+    totals = telemetry.summary()['2']
+    assert (totals['epochs'], totals['input_bound_epochs'],
+            totals['examples']) == (1, 1, 16)
+
+
+def test_step_telemetry_marks_each_batch_of_a_wrapped_dataset():
+    telemetry = train.StepTelemetry()
+    y = one_hot([0, 1, 0, 1, 1], 2)
+    dataset = telemetry.wrap(
+        train.tf.data.Dataset.from_tensor_slices((np.zeros((5, 2)),
+                                                  y)).batch(2))
+
+    labels = np.concatenate([labels.numpy() for _, labels in dataset])
+
+    np.testing.assert_array_equal(labels, y)
+    assert [examples for _, examples in telemetry._ready] == [2, 2, 1]
@@ -7,7 +7,21 @@ import numpy as np
 from pathlib import Path
 import tempfile
 import io
+import time
 import random
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from image_preprocessing import (DECODERS, TRAINING_PREPROCESSING, decode_image,
+                                 get_image_hash, normalize, export_serving_model)
+from dataset_cache import DEFAULT_CACHE_ROOT, DatasetCache
+from embedding_store import DEFAULT_STORE_ROOT, EmbeddingStore, backbone_version
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
@@ -21,6 +35,20 @@ def log_message(message, level='info'):
     log_event("log", message=message, level=level)
 
 
+def peak_rss_mb():
+    """Peak resident memory of this process so far in MB, or None if unknown"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def log_peak_rss(stage, peak_rss):
+    peak_rss[stage] = peak_rss_mb()
+    if peak_rss[stage] is not None:
+        log_message(f"Peak RSS after {stage.replace('_', ' ')}: {peak_rss[stage]:.0f} MB")
+
+
 TF_AVAILABLE = False
 try:
     import tensorflow as tf
@@ -30,7 +58,6 @@ try:
     from tensorflow.keras.applications.efficientnet import preprocess_input as efficientnet_preprocess
     from tensorflow.keras.applications.mobilenet_v2 import preprocess_input as mobilenet_preprocess
     from sklearn.preprocessing import LabelEncoder
-    from sklearn.utils import class_weight
     from sklearn.model_selection import train_test_split
     from PIL import Image, ImageEnhance, ImageFilter, ImageOps
     from pymongo import MongoClient
@@ -45,12 +72,6 @@ try:
     else:
         log_message("No GPU found, using CPU (training will be slower)")
 
-    try:
-        tf.keras.mixed_precision.set_global_policy('mixed_float16')
-        log_message("Using mixed precision training for faster performance")
-    except Exception as e:
-        log_message(f"Mixed precision not available: {e}", level='warning')
-
     TF_AVAILABLE = True
     log_message("TensorFlow and dependencies loaded successfully")
 except ImportError as e:
@@ -61,13 +82,127 @@ except ImportError as e:
         level='error')
 
 
+# Keras dtype policies to train with; 'auto' picks one for the host
+PRECISION_POLICIES = ('auto', 'float32', 'mixed_float16', 'mixed_bfloat16')
+
+
+def cpu_supports_bfloat16():
+    """Whether the CPU has native bfloat16 instructions (read on Linux only)"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = set(f.read().split())
+    except OSError:
+        return False
+    return bool(flags & {'avx512_bf16', 'amx_bf16'})
+
+
+def precision_candidates():
+    """Policies worth trying on this host, the expected fastest first
+
+    float16 math is only fast on accelerators; on a CPU it is emulated and
+    slower than float32, while bfloat16 is fast where the CPU supports it.
+    """
+    if tf.config.list_physical_devices('GPU'):
+        return ['mixed_float16', 'float32']
+    if cpu_supports_bfloat16():
+        return ['mixed_bfloat16', 'float32']
+    return ['float32']
+
+
+def time_precision_policy(policy, steps=5, batch_size=16, image_size=96):
+    """Seconds per training step of a small EfficientNet-like stack"""
+    keras.mixed_precision.set_global_policy(policy)
+    try:
+        inputs = keras.Input(shape=(image_size, image_size, 3))
+        x = layers.Conv2D(32, 3, strides=2, padding='same',
+                          activation='swish')(inputs)
+        for filters in (32, 64, 128):
+            x = layers.DepthwiseConv2D(3, padding='same',
+                                       activation='swish')(x)
+            x = layers.Conv2D(filters, 1, activation='swish')(x)
+            x = layers.BatchNormalization()(x)
+        x = layers.GlobalAveragePooling2D()(x)
+        outputs = layers.Dense(10, activation='softmax', dtype='float32')(x)
+        model = keras.Model(inputs, outputs)
+        model.compile(optimizer=optimizers.AdamW(learning_rate=1e-3),
+                      loss='categorical_crossentropy')
+
+        rng = np.random.default_rng(0)
+        images = rng.random((batch_size, image_size, image_size, 3),
+                            dtype=np.float32)
+        labels = keras.utils.to_categorical(rng.integers(0, 10, batch_size),
+                                            10)
+        # The first steps include tracing
+        for _ in range(2):
+            model.train_on_batch(images, labels)
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.train_on_batch(images, labels)
+        return (time.perf_counter() - start) / steps
+    finally:
+        keras.mixed_precision.set_global_policy('float32')
+
+
+def select_precision_policy(requested='auto', benchmark=True):
+    """Set the global Keras dtype policy and describe the choice
+
+    An explicit policy is used as given. 'auto' takes the host's expected
+    fastest candidate or, with benchmark and more than one candidate, the
+    one a few timed training steps show to be fastest. Returns the
+    description recorded in metadata.json.
+    """
+    info = {
+        'requested': requested,
+        'device': 'gpu' if tf.config.list_physical_devices('GPU') else 'cpu',
+        'cpu_bfloat16': cpu_supports_bfloat16()
+    }
+    if requested != 'auto':
+        policy, info['source'] = requested, 'flag'
+    else:
+        candidates = precision_candidates()
+        policy, info['source'] = candidates[0], 'host'
+        if benchmark and len(candidates) > 1:
+            timings = {}
+            for candidate in candidates:
+                try:
+                    timings[candidate] = time_precision_policy(candidate)
+                except Exception as e:
+                    log_message(
+                        f"Precision benchmark of {candidate} failed: {e}",
+                        level='warning')
+            if timings:
+                policy = min(timings, key=timings.get)
+                info['source'] = 'benchmark'
+                info['benchmark_step_ms'] = {
+                    candidate: round(seconds * 1000, 2)
+                    for candidate, seconds in timings.items()
+                }
+    keras.mixed_precision.set_global_policy(policy)
+    info['policy'] = policy
+    log_message(f"Precision policy: {policy} ({info['source']})")
+    return info
+
+
+# Default minimum seconds between batch progress events
+EVENT_INTERVAL = 1.0
+
+
 class TrainingCallback(keras.callbacks.Callback):
+    """Report training progress as JSON events on stdout
+
+    Batch progress is throttled to one batch_end event per event_interval
+    seconds (0 reports every batch). Each carries the epoch's running
+    loss and accuracy and their means over the batches since the previous
+    event. epoch_end summarizes the epoch, including the time spent
+    emitting batch events.
+    """
 
     def __init__(self,
                  total_epochs,
                  phase_name="Training",
                  phase_number=1,
-                 total_phases=3):
+                 total_phases=3,
+                 event_interval=EVENT_INTERVAL):
         super().__init__()
         self.total_epochs = total_epochs
         self.global_epoch = 0
@@ -76,6 +211,7 @@ class TrainingCallback(keras.callbacks.Callback):
         self.phase_name = phase_name
         self.phase_number = phase_number
         self.total_phases = total_phases
+        self.event_interval = event_interval
 
     def set_phase(self, phase_name, phase_number):
         self.phase_name = phase_name
@@ -91,6 +227,12 @@ class TrainingCallback(keras.callbacks.Callback):
         log_message(
             f"[{self.phase_name}] Starting epoch {epoch + 1}/{self.total_epochs}"
         )
+        self._epoch_start = self._last_event = time.perf_counter()
+        self._batches = 0
+        self._batch_events = 0
+        self._event_seconds = 0.
+        # (batches, loss sum, accuracy sum) when the window began
+        self._window = (0, 0., 0.)
 
     def on_train_begin(self, logs=None):
         try:
@@ -109,31 +251,183 @@ class TrainingCallback(keras.callbacks.Callback):
     def on_epoch_end(self, epoch, logs=None):
         logs = logs or {}
         self.global_epoch += 1
+        epoch_seconds = time.perf_counter() - self._epoch_start
         log_event("epoch_end",
                   epoch=self.global_epoch,
                   total_epochs=self.total_epochs,
                   loss=float(logs.get('loss', 0)),
                   accuracy=float(logs.get('accuracy', 0)),
                   val_loss=float(logs.get('val_loss', 0)),
-                  val_accuracy=float(logs.get('val_accuracy', 0)))
-
-    def on_batch_end(self, batch, logs=None):
-        if batch % 5 == 0:
-            logs = logs or {}
-            batch_progress = 0
-            if self.steps_per_epoch and self.steps_per_epoch > 0:
-                batch_progress = min(100,
-                                     int((batch / self.steps_per_epoch) * 100))
-
-            log_event("batch_end",
-                      batch=int(batch),
-                      steps_per_epoch=int(self.steps_per_epoch)
-                      if self.steps_per_epoch else None,
-                      epoch=(self.global_epoch + 1),
-                      total_epochs=self.total_epochs,
-                      batch_progress=batch_progress,
-                      loss=float(logs.get('loss', 0)),
-                      accuracy=float(logs.get('accuracy', 0)))
+                  val_accuracy=float(logs.get('val_accuracy', 0)),
+                  batches=self._batches,
+                  batch_events=self._batch_events,
+                  epoch_seconds=round(epoch_seconds, 2),
+                  event_overhead_ms=round(self._event_seconds * 1000, 2),
+                  event_overhead_pct=round(
+                      100 * self._event_seconds / max(epoch_seconds, 1e-9),
+                      3))
+
+    def on_train_batch_end(self, batch, logs=None):
+        start = time.perf_counter()
+        self._batches = batch + 1
+        if start - self._last_event < self.event_interval:
+            self._event_seconds += time.perf_counter() - start
+            return
+
+        # Keras logs running means over the epoch; the sums tell apart the
+        # batches of this window
+        logs = logs or {}
+        loss = float(logs.get('loss', 0))
+        accuracy = float(logs.get('accuracy', 0))
+        window = (batch + 1, loss * (batch + 1), accuracy * (batch + 1))
+        window_batches = window[0] - self._window[0]
+        batch_progress = 0
+        if self.steps_per_epoch and self.steps_per_epoch > 0:
+            batch_progress = min(100,
+                                 int((batch / self.steps_per_epoch) * 100))
+
+        log_event("batch_end",
+                  batch=int(batch),
+                  steps_per_epoch=int(self.steps_per_epoch)
+                  if self.steps_per_epoch else None,
+                  epoch=(self.global_epoch + 1),
+                  total_epochs=self.total_epochs,
+                  batch_progress=batch_progress,
+                  loss=loss,
+                  accuracy=accuracy,
+                  window_batches=window_batches,
+                  window_loss=(window[1] - self._window[1]) / window_batches,
+                  window_accuracy=(window[2] - self._window[2]) /
+                  window_batches,
+                  batches_per_second=window_batches /
+                  max(start - self._last_event, 1e-9))
+        self._window = window
+        self._last_event = time.perf_counter()
+        self._batch_events += 1
+        self._event_seconds += self._last_event - start
+
+
+# Share of step time spent waiting for data above which an epoch is
+# reported as bound by the input pipeline
+INPUT_BOUND_FRACTION = 0.25
+
+
+class StepTelemetry(keras.callbacks.Callback):
+    """Split each training step into data wait and compute time
+
+    wrap() appends a pass-through stage to a training dataset that records
+    when each batch leaves the input pipeline. The stage runs synchronously
+    with prefetch injection disabled, so it fires when the train step pulls
+    the batch; the time from on_train_batch_begin to that mark is spent
+    waiting for data and the rest of the step is compute. A
+    step_telemetry event summarizes every epoch and flags epochs bound by
+    the input pipeline.
+
+    Must come first among the callbacks, so their batch hooks are not
+    counted as compute.
+    """
+
+    def __init__(self, input_bound_fraction=INPUT_BOUND_FRACTION):
+        super().__init__()
+        self.input_bound_fraction = input_bound_fraction
+        self.phase = 1
+        self.phases = {}
+        self._ready = deque()
+
+    def set_phase(self, phase):
+        self.phase = phase
+
+    def wrap(self, dataset):
+        def mark(inputs, labels):
+            marked = tf.numpy_function(self._mark, [labels], labels.dtype,
+                                       stateful=True)
+            marked.set_shape(labels.shape)
+            return inputs, marked
+
+        # A prefetch injected after the mark would record when a batch enters
+        # the buffer rather than when the step takes it
+        options = tf.data.Options()
+        options.experimental_optimization.inject_prefetch = False
+        return dataset.map(mark).with_options(options)
+
+    def _mark(self, labels):
+        self._ready.append((time.perf_counter(), len(labels)))
+        return labels
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._steps = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._begin = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        end = time.perf_counter()
+        # A step pulls one batch; marks from before it began are stale and
+        # later ones belong to the next step
+        while self._ready and self._ready[0][0] < self._begin:
+            self._ready.popleft()
+        if not self._ready or self._ready[0][0] > end:
+            return
+        ready = self._ready.popleft()
+        self._steps.append(
+            (ready[0] - self._begin, end - ready[0], ready[1]))
+
+    def on_epoch_end(self, epoch, logs=None):
+        if not self._steps:
+            return
+        wait, compute, examples = (np.array(column)
+                                   for column in zip(*self._steps))
+        step = wait + compute
+        wait_fraction = float(wait.sum() / step.sum())
+        input_bound = wait_fraction > self.input_bound_fraction
+        summary = {
+            'steps': len(step),
+            'data_wait_ms': round(float(wait.mean()) * 1000, 2),
+            'data_wait_p95_ms': round(float(np.percentile(wait, 95)) * 1000,
+                                      2),
+            'compute_ms': round(float(compute.mean()) * 1000, 2),
+            'compute_p95_ms': round(
+                float(np.percentile(compute, 95)) * 1000, 2),
+            'examples_per_second': round(float(examples.sum() / step.sum()),
+                                         1),
+            'data_wait_fraction': round(wait_fraction, 4),
+            'input_bound': bool(input_bound)
+        }
+        log_event("step_telemetry",
+                  phase=self.phase,
+                  epoch=epoch + 1,
+                  **summary)
+        if input_bound:
+            log_message(
+                f"Input pipeline is the bottleneck: {wait_fraction:.0%} of "
+                f"step time in phase {self.phase} epoch {epoch + 1} was spent "
+                "waiting for data",
+                level='warning')
+
+        phase = self.phases.setdefault(str(self.phase), {
+            'epochs': 0,
+            'input_bound_epochs': 0,
+            'steps': 0,
+            'data_wait_seconds': 0.,
+            'compute_seconds': 0.,
+            'examples': 0
+        })
+        phase['epochs'] += 1
+        phase['input_bound_epochs'] += int(input_bound)
+        phase['steps'] += len(step)
+        phase['data_wait_seconds'] += float(wait.sum())
+        phase['compute_seconds'] += float(compute.sum())
+        phase['examples'] += int(examples.sum())
+
+    def summary(self):
+        """Per-phase totals for metadata.json"""
+        return {
+            phase: dict(totals,
+                        data_wait_seconds=round(totals['data_wait_seconds'],
+                                                2),
+                        compute_seconds=round(totals['compute_seconds'], 2))
+            for phase, totals in self.phases.items()
+        }
 
 
 def create_augmentation_layer():
@@ -215,6 +509,135 @@ def advanced_augment_image(img_array, augmentation_strength=1.0):
     return img_array
 
 
+# Training-time augmentation for --augmentation: the Keras preprocessing
+# layers, advanced_augment_image ported to batched TF ops, the PIL original
+# run on a thread pool, or nothing
+AUGMENTATIONS = ('keras', 'advanced', 'advanced-pil', 'none')
+
+# PIL's ImageFilter.SMOOTH, which ImageEnhance.Sharpness blends against
+_SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]],
+                          dtype=np.float32) / 13
+_BLUR_KERNEL = np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]],
+                        dtype=np.float32) / 16
+
+_augment_pool = None
+
+
+def _per_image_uniform(images, minval, maxval):
+    return tf.random.uniform([tf.shape(images)[0], 1, 1, 1], minval, maxval)
+
+
+def _random_apply(images, augmented, probability):
+    """Take each image from augmented with the given probability"""
+    apply = _per_image_uniform(images, 0.0, 1.0) < probability
+    return tf.where(apply, augmented, images)
+
+
+def _filter3x3(images, kernel):
+    channels = images.shape[-1]
+    kernel = tf.constant(np.tile(kernel[:, :, None, None], (1, 1, channels, 1)))
+    padded = tf.pad(images, [[0, 0], [1, 1], [1, 1], [0, 0]], mode='SYMMETRIC')
+    return tf.nn.depthwise_conv2d(padded, kernel, [1, 1, 1, 1], 'VALID')
+
+
+def _rotate(images, angles, fill_value):
+    """Rotate each image about its centre by its angle in radians"""
+    height = tf.cast(tf.shape(images)[1], tf.float32)
+    width = tf.cast(tf.shape(images)[2], tf.float32)
+    cos, sin = tf.cos(angles), tf.sin(angles)
+    x_offset = ((width - 1) - (cos * (width - 1) - sin * (height - 1))) / 2
+    y_offset = ((height - 1) - (sin * (width - 1) + cos * (height - 1))) / 2
+    zeros = tf.zeros_like(angles)
+    transforms = tf.stack(
+        [cos, -sin, x_offset, sin, cos, y_offset, zeros, zeros], axis=1)
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=tf.shape(images)[1:3],
+        fill_value=fill_value,
+        interpolation='BILINEAR',
+        fill_mode='CONSTANT')
+
+
+def advanced_augment_batch(images, augmentation_strength=1.0):
+    """advanced_augment_image and apply_cutout as vectorized TF ops
+
+    images is a float32 batch of [0, 255] pixels. Every transform is drawn
+    per image with the probabilities and ranges of the PIL version, plus a
+    horizontal flip, so whole batches are augmented inside tf.data.
+    """
+    n = tf.shape(images)[0]
+    height, width = images.shape[1], images.shape[2]
+    strength = augmentation_strength
+
+    images = _random_apply(images, tf.image.flip_left_right(images), 0.5)
+
+    factor = tf.clip_by_value(
+        _per_image_uniform(images, 0.6, 1.4) * strength, 0.3, 2.0)
+    images = _random_apply(images, images * factor, 0.6)
+
+    mean = tf.reduce_mean(tf.image.rgb_to_grayscale(images),
+                          axis=[1, 2, 3],
+                          keepdims=True)
+    factor = tf.clip_by_value(
+        _per_image_uniform(images, 0.6, 1.4) * strength, 0.3, 2.0)
+    images = _random_apply(images, mean + factor * (images - mean), 0.6)
+
+    gray = tf.image.rgb_to_grayscale(images)
+    factor = _per_image_uniform(images, 0.7, 1.3)
+    images = _random_apply(images, gray + factor * (images - gray), 0.5)
+
+    smooth = _filter3x3(images, _SMOOTH_KERNEL)
+    factor = _per_image_uniform(images, 0.8, 1.5)
+    images = _random_apply(images, smooth + factor * (images - smooth), 0.5)
+    images = tf.clip_by_value(images, 0.0, 255.0)
+
+    images = _random_apply(images, _filter3x3(images, _BLUR_KERNEL), 0.2)
+
+    bits = tf.random.uniform([n, 1, 1, 1], 4, 8, dtype=tf.int32)
+    step = tf.pow(2.0, tf.cast(8 - bits, tf.float32))
+    images = _random_apply(images, tf.floor(images / step) * step, 0.1)
+
+    threshold = _per_image_uniform(images, 128.0, 201.0)
+    images = _random_apply(
+        images, tf.where(images >= threshold, 255.0 - images, images), 0.15)
+
+    angles = tf.random.uniform([n], -20.0, 20.0) * (np.pi / 180)
+    images = _random_apply(images, _rotate(images, angles, 128.0), 0.3)
+
+    noise = tf.random.normal(tf.shape(images), stddev=0.05 * strength * 127.5)
+    images = _random_apply(images, images + noise, 0.4)
+    images = tf.clip_by_value(images, 0.0, 255.0)
+
+    cut_h, cut_w = int(height * 0.15), int(width * 0.15)
+    top = tf.random.uniform([n, 1, 1, 1], 0, height - cut_h + 1, dtype=tf.int32)
+    left = tf.random.uniform([n, 1, 1, 1], 0, width - cut_w + 1, dtype=tf.int32)
+    rows = tf.range(height)[None, :, None, None]
+    cols = tf.range(width)[None, None, :, None]
+    inside = ((rows >= top) & (rows < top + cut_h) & (cols >= left) &
+              (cols < left + cut_w))
+    # apply_cutout fills with 0.5 in [-1, 1] space
+    fill = 0.5 * 127.5 + 127.5
+    return _random_apply(images, tf.where(inside, fill, images), 0.5)
+
+
+def advanced_augment_batch_pil(images):
+    """Run advanced_augment_image on each uint8 image of a batch
+
+    Images are spread over a thread pool; PIL releases the GIL while it
+    filters, so the pool scales across cores.
+    """
+    global _augment_pool
+    if _augment_pool is None:
+        _augment_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+    def augment(image):
+        augmented = advanced_augment_image(image.astype(np.float32) / 127.5 - 1)
+        return np.clip(augmented * 127.5 + 127.5, 0, 255).astype(np.uint8)
+
+    return np.stack(list(_augment_pool.map(augment, images)))
+
+
 def create_improved_model(num_classes,
                           input_shape=(224, 224, 3),
                           model_size='small'):
@@ -237,7 +660,9 @@ def create_improved_model(num_classes,
 
     x = base_model(x, training=False)
 
-    x = layers.GlobalAveragePooling2D()(x)
+    # The layers after this one form the classifier head that
+    # split_feature_head() trains on cached backbone features
+    x = layers.GlobalAveragePooling2D(name='backbone_pool')(x)
 
     x = layers.BatchNormalization()(x)
     x = layers.Dense(512, kernel_regularizer=regularizers.l2(0.001))(x)
@@ -303,59 +728,145 @@ def create_segmentation_model(num_classes, input_shape=(224, 224, 3)):
     return model, base_model
 
 
-def load_data_from_mongo(mongo_uri, image_size=(224, 224)):
+# Only the fields training reads; segmentation masks and embodied-energy
+# fields stay on the server
+TRAINING_PROJECTION = {
+    '_id': 0,
+    'data': 1,
+    'material_key': 1,
+    'material_official': 1,
+    'filename': 1,
+    'hash': 1
+}
+
+
+def stream_mongo_images(collection, image_size=(224, 224), decoder='pil',
+                        batch_size=256):
+    """Yield (pixels, label, filename, hash) per usable image in the collection
+
+    Documents are fetched batch_size at a time through a projected cursor and
+    decoded one by one, so only one cursor batch of encoded images is held in
+    memory regardless of collection size.
+    """
+    cursor = collection.find({}, TRAINING_PROJECTION, batch_size=batch_size)
+    try:
+        for doc in cursor:
+            filename = doc.get('filename', 'unknown')
+            try:
+                img_data = doc.get('data')
+                if img_data is None:
+                    continue
+
+                # Opening only parses the header; pixels are decoded below
+                with Image.open(io.BytesIO(img_data)) as img:
+                    width, height = img.size
+
+                if width < 50 or height < 50:
+                    log_message(f"Skipping small image: {filename}",
+                                level='warning')
+                    continue
+
+                pixels = decode_image(img_data, image_size, decoder)
+                label = doc.get('material_key',
+                                doc.get('material_official', 'unknown'))
+                yield (pixels, label, filename, doc.get('hash')
+                       or get_image_hash(img_data))
+            except Exception as e:
+                log_message(f"Error processing image {filename}: {str(e)}",
+                            level='error')
+    finally:
+        cursor.close()
+
+
+def load_data_from_mongo(mongo_uri, image_size=(224, 224), decoder='pil',
+                         batch_size=256):
     log_message("Connecting to MongoDB...")
     client = MongoClient(mongo_uri)
     db = client['Construction_test']
     collection = db['materialimages']
 
-    docs = list(collection.find({}))
-    log_message(f"Found {len(docs)} images in database")
+    total = collection.count_documents({})
+    log_message(f"Found {total} images in database")
 
-    if len(docs) == 0:
+    if total == 0:
         log_message("No images found in database", level='error')
         sys.exit(1)
 
-    X = []
+    # Decode straight into one preallocated uint8 array instead of building a
+    # list of per-image arrays and copying it with np.array(); normalization
+    # happens per batch in create_tf_dataset
+    width, height = image_size
+    X = np.empty((total, height, width, 3), dtype=np.uint8)
     y_labels = []
     filenames = []
+    hashes = []
+
+    for pixels, label, filename, image_hash in stream_mongo_images(
+            collection, image_size, decoder, batch_size):
+        # Documents inserted while streaming are left for the next run
+        if len(y_labels) == total:
+            break
+        X[len(y_labels)] = pixels
+        y_labels.append(label)
+        filenames.append(filename)
+        hashes.append(image_hash)
 
-    for doc in docs:
-        try:
-            img_data = doc.get('data')
-            if img_data is None:
-                continue
+    client.close()
 
-            img = Image.open(io.BytesIO(img_data))
-            img = img.convert('RGB')
+    X = X[:len(y_labels)]
+    y_labels = np.array(y_labels)
 
-            if img.size[0] < 50 or img.size[1] < 50:
-                log_message(
-                    f"Skipping small image: {doc.get('filename', 'unknown')}",
-                    level='warning')
-                continue
+    log_message(f"Loaded {len(X)} images successfully")
+    log_class_counts(y_labels)
 
-            img = img.resize(image_size, Image.Resampling.LANCZOS)
-            img_array = np.array(img).astype(np.float32) / 255.0
+    return X, y_labels, filenames, hashes
 
-            X.append(img_array)
-            label = doc.get('material_key',
-                            doc.get('material_official', 'unknown'))
-            y_labels.append(label)
-            filenames.append(doc.get('filename', 'unknown'))
-        except Exception as e:
-            log_message(
-                f"Error processing image {doc.get('filename', 'unknown')}: {str(e)}",
-                level='error')
-            continue
 
-    client.close()
+def load_data_from_cache(mongo_uri, cache_dir, mode='sync',
+                         image_size=(224, 224), decoder='pil', batch_size=256):
+    """Load training images from the local dataset cache
 
-    X = np.array(X)
-    y_labels = np.array(y_labels)
+    In 'sync' mode the cache is first brought up to date with MongoDB, which
+    only downloads new or changed images; 'offline' trains on the cache as it
+    is without connecting to MongoDB. The images are returned as a
+    CachedImages view, so batches are read from the shards as they are used.
+    """
+    cache = DatasetCache.for_config(cache_dir, image_size, decoder)
+
+    if mode == 'offline':
+        log_message(
+            f"Using {len(cache)} cached images without contacting MongoDB")
+    else:
+        log_message("Connecting to MongoDB...")
+        client = MongoClient(mongo_uri)
+        collection = client['Construction_test']['materialimages']
+        stats = cache.sync(
+            collection,
+            batch_size,
+            log=lambda message: log_message(message, level='warning'))
+        client.close()
+        log_message(
+            f"Dataset cache synced: {stats['added']} added, "
+            f"{stats['removed']} removed, {stats['relabelled']} relabelled, "
+            f"{stats['unchanged']} unchanged, {stats['skipped']} skipped")
+
+    keys = cache.keys()
+    if len(keys) == 0:
+        log_message("No images found in dataset cache", level='error')
+        sys.exit(1)
+
+    X = cache.images(keys)
+    y_labels = cache.labels(keys)
+    filenames = cache.filenames(keys)
+    hashes = [cache.entries[key]['hash'] for key in keys]
 
     log_message(f"Loaded {len(X)} images successfully")
+    log_class_counts(y_labels)
+
+    return X, y_labels, filenames, hashes
+
 
+def log_class_counts(y_labels):
     unique, counts = np.unique(y_labels, return_counts=True)
     for label, count in zip(unique, counts):
         log_message(f"  Class '{label}': {count} samples")
@@ -366,90 +877,168 @@ def load_data_from_mongo(mongo_uri, image_size=(224, 224)):
             f"WARNING: Some classes have fewer than 10 samples. Consider adding more images.",
             level='warning')
 
-    return X, y_labels, filenames
 
+def create_index_dataset(indices, y, batch_size, shuffle=True,
+                         samples_per_class=None):
+    """Batches of row indices for create_tf_dataset and create_feature_dataset
 
-def balance_dataset(X, y_labels, target_samples_per_class=None):
-    unique, counts = np.unique(y_labels, return_counts=True)
+    With samples_per_class, each epoch draws samples_per_class rows per class
+    (by the one-hot labels in y) from per-class streams of shuffled indices
+    sampled with equal weight, so minority classes are oversampled without
+    copying any data; otherwise every index is used once per epoch.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+
+    if samples_per_class is not None:
+        classes = np.argmax(y[indices], axis=1)
+        class_datasets = []
+        for c in np.unique(classes):
+            class_indices = indices[classes == c]
+            class_datasets.append(
+                tf.data.Dataset.from_tensor_slices(class_indices).shuffle(
+                    buffer_size=len(class_indices),
+                    reshuffle_each_iteration=True).repeat())
+        dataset = tf.data.Dataset.sample_from_datasets(
+            class_datasets, rerandomize_each_iteration=True)
+        dataset = dataset.take(samples_per_class * len(class_datasets))
+    else:
+        dataset = tf.data.Dataset.from_tensor_slices(indices)
 
-    if target_samples_per_class is None:
-        target_samples_per_class = max(counts)
+        if shuffle:
+            # Shuffling indices is cheap, so shuffle the whole set
+            dataset = dataset.shuffle(buffer_size=len(indices),
+                                      reshuffle_each_iteration=True)
 
-    log_message(
-        f"Balancing dataset to {target_samples_per_class} samples per class")
+    return dataset.batch(batch_size)
 
-    X_balanced = []
-    y_balanced = []
 
-    for label in unique:
-        mask = y_labels == label
-        X_class = X[mask]
-        n_samples = len(X_class)
+def create_tf_dataset(X, y, batch_size, augment=False, shuffle=True,
+                      indices=None, samples_per_class=None,
+                      augmentation='keras'):
+    """Batches of normalized float32 images from the uint8 images in X
 
-        if n_samples >= target_samples_per_class:
-            indices = np.random.choice(n_samples,
-                                       target_samples_per_class,
-                                       replace=False)
-        else:
-            indices_original = np.arange(n_samples)
-            indices_augmented = np.random.choice(n_samples,
-                                                 target_samples_per_class -
-                                                 n_samples,
-                                                 replace=True)
-            indices = np.concatenate([indices_original, indices_augmented])
-
-        for idx in indices:
-            img = X_class[idx % n_samples]
-            if idx >= n_samples:
-                img_normalized = (img * 255).astype(np.uint8)
-                img_pil = Image.fromarray(img_normalized)
-
-                if random.random() > 0.5:
-                    img_pil = ImageOps.mirror(img_pil)
-                if random.random() > 0.5:
-                    angle = random.uniform(-15, 15)
-                    img_pil = img_pil.rotate(angle, fillcolor=(128, 128, 128))
-                if random.random() > 0.5:
-                    enhancer = ImageEnhance.Brightness(img_pil)
-                    img_pil = enhancer.enhance(random.uniform(0.8, 1.2))
-                if random.random() > 0.5:
-                    enhancer = ImageEnhance.Contrast(img_pil)
-                    img_pil = enhancer.enhance(random.uniform(0.8, 1.2))
-
-                img = np.array(img_pil).astype(np.float32) / 255.0
-
-            X_balanced.append(img)
-            y_balanced.append(label)
-
-    X_balanced = np.array(X_balanced)
-    y_balanced = np.array(y_balanced)
-
-    indices = np.random.permutation(len(X_balanced))
-    return X_balanced[indices], y_balanced[indices]
-
-
-def create_tf_dataset(X, y, batch_size, augment=False, shuffle=True):
-    dataset = tf.data.Dataset.from_tensor_slices((X, y))
-
-    if shuffle:
-        dataset = dataset.shuffle(buffer_size=min(len(X), 10000),
-                                  reshuffle_each_iteration=True)
-
-    if augment:
+    X (an array or a shard-backed CachedImages) is indexed per batch, so
+    only the current batch is gathered and converted. indices selects the
+    rows to use, all by default; samples_per_class rebalances classes as in
+    create_index_dataset. augmentation picks one of AUGMENTATIONS, run on
+    whole batches when augment is set.
+    """
+    if indices is None:
+        indices = np.arange(len(X))
+    image_shape = X.shape[1:]
+    labels = tf.constant(y)
+    scale = TRAINING_PREPROCESSING['scale']
+    offset = TRAINING_PREPROCESSING['offset']
+
+    dataset = create_index_dataset(indices, y, batch_size, shuffle,
+                                   samples_per_class)
+
+    def load_batch(batch_indices):
+        images = tf.numpy_function(lambda rows: X[rows], [batch_indices],
+                                   tf.uint8)
+        images.set_shape((None, ) + tuple(image_shape))
+        if augment and augmentation == 'advanced-pil':
+            images = tf.numpy_function(advanced_augment_batch_pil, [images],
+                                       tf.uint8)
+            images.set_shape((None, ) + tuple(image_shape))
+        images = tf.cast(images, tf.float32)
+        if augment and augmentation == 'advanced':
+            images = advanced_augment_batch(images)
+        images = images * scale + offset
+        return images, tf.gather(labels, batch_indices)
+
+    dataset = dataset.map(load_batch, num_parallel_calls=tf.data.AUTOTUNE)
+
+    if augment and augmentation == 'keras':
         augmentation = create_augmentation_layer()
 
-        def augment_fn(image, label):
-            image = augmentation(image, training=True)
-            return image, label
+        def augment_fn(images, labels):
+            images = augmentation(images, training=True)
+            return images, labels
 
         dataset = dataset.map(augment_fn, num_parallel_calls=tf.data.AUTOTUNE)
 
-    dataset = dataset.batch(batch_size)
     dataset = dataset.prefetch(tf.data.AUTOTUNE)
 
     return dataset
 
 
+def split_feature_head(model):
+    """Split a create_improved_model() model at its pooled backbone features
+
+    Returns (feature_extractor, head). The head is built from the model's own
+    layers, so training it trains the full model's classifier head.
+    """
+    pool = model.get_layer('backbone_pool')
+    feature_extractor = keras.Model(model.inputs, pool.output)
+    features = keras.Input(shape=pool.output.shape[1:])
+    x = features
+    for layer in model.layers[model.layers.index(pool) + 1:]:
+        x = layer(x)
+    return feature_extractor, keras.Model(features, x, name='classifier_head')
+
+
+def extract_features(feature_extractor, X, y, indices, batch_size, path,
+                     views=1, augmentation='keras', store=None, hashes=None):
+    """Run the frozen backbone once per image and view of X[indices]
+
+    Returns a float16 memmap at path with views * len(indices) rows; row
+    v * len(indices) + i holds view v of X[indices[i]]. View 0 is the plain
+    image and later views are augmented. With an up-to-date EmbeddingStore
+    and the content hashes of X's rows, view 0 is read from the store.
+    """
+    n = len(indices)
+    dim = feature_extractor.output.shape[-1]
+    features = np.lib.format.open_memmap(path,
+                                         mode='w+',
+                                         dtype=np.float16,
+                                         shape=(views * n, dim))
+    for view in range(views):
+        if view == 0 and store is not None:
+            for start in range(0, n, 4096):
+                chunk = indices[start:start + 4096]
+                features[start:start + len(chunk)] = store.get(
+                    [hashes[i] for i in chunk])
+            continue
+        dataset = create_tf_dataset(X,
+                                    y,
+                                    batch_size,
+                                    augment=view > 0,
+                                    shuffle=False,
+                                    indices=indices,
+                                    augmentation=augmentation)
+        row = view * n
+        for images, _ in dataset:
+            batch = feature_extractor.predict_on_batch(images)
+            features[row:row + len(batch)] = batch
+            row += len(batch)
+    features.flush()
+    return features
+
+
+def create_feature_dataset(features, y, batch_size, shuffle=True,
+                           samples_per_class=None):
+    """Batches of (features, label) from extract_features() output
+
+    y holds one one-hot label per feature row; samples_per_class rebalances
+    classes as in create_index_dataset.
+    """
+    labels = tf.constant(y)
+    dim = features.shape[1]
+
+    dataset = create_index_dataset(np.arange(len(features)), y, batch_size,
+                                   shuffle, samples_per_class)
+
+    def load_batch(batch_indices):
+        batch = tf.numpy_function(lambda rows: features[rows],
+                                  [batch_indices], tf.float16)
+        batch.set_shape((None, dim))
+        return tf.cast(batch, tf.float32), tf.gather(labels, batch_indices)
+
+    dataset = dataset.map(load_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
 def cosine_decay_with_warmup(epoch, total_epochs, warmup_epochs, initial_lr,
                              min_lr):
     if epoch < warmup_epochs:
@@ -467,8 +1056,16 @@ class WarmupCosineDecay(keras.callbacks.Callback):
         self.initial_lr = initial_lr
         self.total_epochs = total_epochs
         self.warmup_epochs = warmup_epochs
+        self.planned_warmup_epochs = warmup_epochs
         self.min_lr = min_lr
 
+    def set_total_epochs(self, total_epochs):
+        """Stretch or shrink the schedule to end after total_epochs"""
+        self.total_epochs = total_epochs
+        # Leave at least one epoch of decay
+        self.warmup_epochs = min(self.planned_warmup_epochs,
+                                 max(0, total_epochs - 1))
+
     def on_epoch_begin(self, epoch, logs=None):
         lr = cosine_decay_with_warmup(epoch, self.total_epochs,
                                       self.warmup_epochs, self.initial_lr,
@@ -485,17 +1082,631 @@ class WarmupCosineDecay(keras.callbacks.Callback):
         log_message(f"Learning rate: {lr:.2e}")
 
 
+# Relative cost of an epoch in each phase: Phase 1 backpropagates through
+# the head only, Phases 2 and 3 through more and more of the base. Phase 0
+# is one pass of feature extraction over the training images, per view.
+PHASE_EPOCH_COST = {0: 1.0, 1: 1.0, 2: 1.5, 3: 2.0}
+# Part of a --time-budget kept for saving and evaluating the final model,
+# until validation passes have been timed
+FINALIZE_BUDGET_FRACTION = 0.1
+MIN_FINALIZE_SECONDS = 30
+# Expected cost of a TFLite conversion or SavedModel export, in multiples of
+# the final model's save time, until an export has been timed
+EXPORT_SAVE_MULTIPLE = 10
+
+
+class TimeBudget(keras.callbacks.Callback):
+    """Fit the training phases into a wall-clock budget
+
+    The time left, less a reserve for saving and evaluating the final model,
+    is shared among the remaining phases in proportion to their planned
+    epochs weighted by PHASE_EPOCH_COST. Within a phase, the epoch count
+    follows the measured cost of its epochs, capped at the planned count,
+    and the phase's WarmupCosineDecay is refitted to it after every epoch.
+    Time a phase leaves unused, e.g. through early stopping, goes to the
+    phases after it.
+
+    Extracting cached Phase 1 features is phase 0, planned as one epoch per
+    view; Phase 1 then trains only the head, so its epochs say nothing about
+    the cost of later phases. Exports run only if export_fits() their
+    estimated cost.
+    """
+
+    def __init__(self, seconds, start_time, planned_epochs):
+        super().__init__()
+        self.seconds = seconds
+        self.start_time = start_time
+        self.deadline = start_time + seconds
+        self.min_reserve = max(MIN_FINALIZE_SECONDS,
+                               FINALIZE_BUDGET_FRACTION * seconds)
+        self.planned = dict(enumerate(planned_epochs, start=1))
+        self.planned[0] = 0
+        self.head_only_phase1 = False
+        self.epoch_seconds = {}
+        self.export_seconds = {}
+        self.val_seconds = None
+        self.phase = None
+        self.schedule = None
+        self.phase_deadline = None
+
+    def remaining(self):
+        return self.deadline - time.time()
+
+    def training_deadline(self):
+        # Evaluation predicts the validation set twice
+        reserve = self.min_reserve
+        if self.val_seconds is not None:
+            reserve = max(reserve, 3 * self.val_seconds)
+        return self.deadline - reserve
+
+    def epoch_estimate(self, phase):
+        """Expected seconds per epoch of phase, or None before any epoch"""
+        measured = self.epoch_seconds.get(phase)
+        if measured:
+            # The first epoch includes tracing
+            return float(np.median(measured[1:] or measured))
+        if phase == 1 and self.head_only_phase1:
+            return None
+        for earlier in range(phase - 1, -1, -1):
+            if earlier == 1 and self.head_only_phase1:
+                continue
+            if self.epoch_seconds.get(earlier):
+                return (self.epoch_estimate(earlier) *
+                        PHASE_EPOCH_COST[phase] / PHASE_EPOCH_COST[earlier])
+        return None
+
+    def affordable_epochs(self, done):
+        estimate = self.epoch_estimate(self.phase)
+        if estimate is None:
+            return self.planned[self.phase]
+        left = max(0., self.phase_deadline - time.time())
+        return min(self.planned[self.phase], done + int(left // estimate))
+
+    def start_phase(self, phase, schedule, initial_epoch=0):
+        """Allot phase its share of the time left; returns its epoch count
+
+        A count no higher than initial_epoch means the phase does not fit.
+        Phase 1 always gets an epoch, so there is a model to save.
+        """
+        now = time.time()
+        self._allot(phase)
+        self.phase, self.schedule = phase, schedule
+        epochs = self.affordable_epochs(initial_epoch)
+        if phase == 1 and initial_epoch == 0:
+            epochs = max(1, epochs)
+        if epochs > initial_epoch:
+            schedule.set_total_epochs(epochs)
+            log_message(
+                f"Time budget: {self.remaining():.0f}s left, phase {phase} "
+                f"gets {self.phase_deadline - now:.0f}s, about {epochs} "
+                "epoch(s)")
+        else:
+            log_message(f"Time budget: no time left for phase {phase}")
+        return epochs
+
+    def _allot(self, phase):
+        now = time.time()
+        weights = {
+            p: epochs * PHASE_EPOCH_COST[p]
+            for p, epochs in self.planned.items() if p >= phase and epochs > 0
+        }
+        share = (weights.get(phase, 0) / sum(weights.values())
+                 if weights else 0)
+        self.phase_deadline = now + max(0.,
+                                        self.training_deadline() - now) * share
+
+    def start_feature_extraction(self, views):
+        """Allot phase 0 its share for extracting views of cached features
+
+        Extraction always runs, since Phase 1 cannot train without it; its
+        measured cost calibrates the estimates of Phases 2 and 3.
+        """
+        self.planned[0] = views
+        self.head_only_phase1 = True
+        self._allot(0)
+        self.phase = 0
+        self._extraction_start = time.time()
+        log_message(
+            f"Time budget: {self.remaining():.0f}s left, feature extraction "
+            f"gets {self.phase_deadline - self._extraction_start:.0f}s")
+
+    def end_feature_extraction(self):
+        now = time.time()
+        self.epoch_seconds[0] = [
+            (now - self._extraction_start) / self.planned[0]
+        ]
+        if now > self.phase_deadline:
+            log_message(
+                f"Time budget: feature extraction overran its share by "
+                f"{now - self.phase_deadline:.0f}s",
+                level='warning')
+
+    def export_fits(self, name, estimate):
+        """Whether an export expected to take estimate seconds fits"""
+        left = self.remaining()
+        if estimate < left:
+            return True
+        log_message(
+            f"Time budget: skipping the {name} export, which needs about "
+            f"{estimate:.0f}s with {max(0., left):.0f}s left",
+            level='warning')
+        return False
+
+    def record_export(self, name, seconds):
+        self.export_seconds[name] = round(seconds, 1)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_seconds.setdefault(self.phase, []).append(
+            time.time() - self._epoch_start)
+        epochs = self.affordable_epochs(epoch + 1)
+        if epoch + 1 >= self.planned[self.phase]:
+            return
+        if epochs <= epoch + 1:
+            self.model.stop_training = True
+            log_message(
+                f"Time budget: ending phase {self.phase} after epoch {epoch + 1}")
+        elif epochs != self.schedule.total_epochs:
+            self.schedule.set_total_epochs(epochs)
+            log_message(f"Time budget: phase {self.phase} now runs "
+                        f"{epochs} epoch(s)")
+
+    def on_test_begin(self, logs=None):
+        self._test_start = time.time()
+
+    def on_test_end(self, logs=None):
+        self.val_seconds = time.time() - self._test_start
+
+    def on_train_batch_end(self, batch, logs=None):
+        if time.time() > self.training_deadline():
+            self.model.stop_training = True
+
+    def summary(self):
+        return {
+            'budget_seconds': self.seconds,
+            'elapsed_seconds': round(time.time() - self.start_time, 1),
+            'epoch_seconds': {
+                str(phase): round(float(np.mean(seconds)), 2)
+                for phase, seconds in self.epoch_seconds.items()
+            },
+            'export_seconds': self.export_seconds
+        }
+
+
+def phase_fits(time_budget, phase, schedule, initial_epoch):
+    """Whether a phase gets any epochs under time_budget, if there is one"""
+    return (time_budget is None or time_budget.start_phase(
+        phase, schedule, initial_epoch) > initial_epoch)
+
+
+class FullModelCheckpoint(keras.callbacks.Callback):
+    """Save the full model whenever the head being trained improves
+
+    Used while Phase 1 trains the classifier head on cached features. The
+    shared ModelCheckpoint's best value is kept in step, so later phases only
+    overwrite the checkpoint with a better model.
+    """
+
+    def __init__(self, full_model, filepath, checkpoint,
+                 monitor='val_accuracy'):
+        super().__init__()
+        self.full_model = full_model
+        self.filepath = filepath
+        self.checkpoint = checkpoint
+        self.monitor = monitor
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = (logs or {}).get(self.monitor)
+        if value is None:
+            return
+        best = getattr(self.checkpoint, 'best', None)
+        if best is None or value > best:
+            self.checkpoint.best = value
+            self.full_model.save(self.filepath)
+            log_message(
+                f"{self.monitor} improved to {value:.4f}, saved model to {self.filepath}"
+            )
+
+
+# Resumable training state under data/models/<id>/, removed once the run
+# has saved its artifacts
+CHECKPOINT_DIR = 'checkpoint'
+
+
+def set_seeds(seed):
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    tf.random.set_seed(seed)
+
+
+def rng_state():
+    """Python and NumPy global random states, in a JSON-serializable form"""
+    version, internal, gauss_next = random.getstate()
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        'python': [version, list(internal), gauss_next],
+        'numpy': [name, keys.tolist(), int(pos), int(has_gauss),
+                  float(cached_gaussian)]
+    }
+
+
+def set_rng_state(saved):
+    version, internal, gauss_next = saved['python']
+    random.setstate((version, tuple(internal), gauss_next))
+    name, keys, pos, has_gauss, cached_gaussian = saved['numpy']
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos,
+                         has_gauss, cached_gaussian))
+
+
+def optimizer_variables(optimizer):
+    variables = optimizer.variables
+    return variables() if callable(variables) else variables
+
+
+class TrainingCheckpoint(keras.callbacks.Callback):
+    """Save everything needed to resume training at every epoch boundary
+
+    state.json holds the phase, the epochs completed in it, each phase's
+    history, the early stopping and best-model trackers, the seed, the
+    Python and NumPy random states, the classes and the run's arguments. The model and the optimizer variables
+    of the model being fit are written to a new step directory on every
+    save, and state.json is replaced last, so an interrupted save leaves the
+    previous checkpoint usable.
+
+    Must come after the EarlyStopping callback it restores.
+    """
+
+    def __init__(self, checkpoint_dir, full_model, state, early_stopping,
+                 best_checkpoint):
+        super().__init__()
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.full_model = full_model
+        self.state = state
+        self.early_stopping = early_stopping
+        self.best_checkpoint = best_checkpoint
+        self._restore_trackers = False
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        if state.get('checkpoint_best') is not None:
+            best_checkpoint.best = state['checkpoint_best']
+
+    @staticmethod
+    def load(checkpoint_dir):
+        """Saved state, or None if there is no complete checkpoint"""
+        try:
+            with open(Path(checkpoint_dir) / 'state.json', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def load_model(checkpoint_dir, state):
+        return keras.models.load_model(
+            str(Path(checkpoint_dir) / state['files'] / 'model.keras'),
+            compile=False)
+
+    def start_phase(self, phase, fit_model):
+        """Resume the optimizer and trackers if phase was interrupted"""
+        if self.state['phase'] != phase or self.state['epoch'] == 0:
+            self.state['phase'], self.state['epoch'] = phase, 0
+            return 0
+        with np.load(self.checkpoint_dir / self.state['files'] /
+                     'optimizer.npz') as saved:
+            values = [saved[f'arr_{i}'] for i in range(len(saved.files))]
+        fit_model.optimizer.build(fit_model.trainable_variables)
+        variables = optimizer_variables(fit_model.optimizer)
+        if [tuple(v.shape) for v in variables] == [v.shape for v in values]:
+            for variable, value in zip(variables, values):
+                variable.assign(value)
+        else:
+            log_message("Saved optimizer state does not match the model; "
+                        "resuming with a fresh optimizer",
+                        level='warning')
+        self._restore_trackers = True
+        return self.state['epoch']
+
+    def on_train_begin(self, logs=None):
+        # EarlyStopping resets itself when fit() starts
+        saved = self.state.get('early_stopping')
+        if self._restore_trackers and saved:
+            self.early_stopping.wait = saved['wait']
+            self.early_stopping.best = saved['best']
+        self._restore_trackers = False
+
+    def on_epoch_end(self, epoch, logs=None):
+        history = self.state['histories'].setdefault(
+            str(self.state['phase']), {})
+        for key, value in (logs or {}).items():
+            history.setdefault(key, []).append(float(value))
+        self.state['epoch'] = epoch + 1
+        best = self.early_stopping.best
+        self.state['early_stopping'] = {
+            'wait': int(self.early_stopping.wait),
+            'best': float(best) if best is not None else None
+        }
+        self.save(self.model)
+
+    def end_phase(self, next_phase):
+        self.state['phase'], self.state['epoch'] = next_phase, 0
+        self.state['early_stopping'] = None
+        self.save()
+
+    def save(self, fit_model=None):
+        self.state['step'] = self.state.get('step', 0) + 1
+        name = f"step-{self.state['step']:06d}"
+        step_dir = self.checkpoint_dir / name
+        step_dir.mkdir(exist_ok=True)
+        self.full_model.save(str(step_dir / 'model.keras'))
+        if fit_model is not None:
+            with open(step_dir / 'optimizer.npz', 'wb') as f:
+                np.savez(f, *[
+                    np.asarray(v) for v in optimizer_variables(
+                        fit_model.optimizer)
+                ])
+        best = getattr(self.best_checkpoint, 'best', None)
+        self.state['checkpoint_best'] = (float(best)
+                                         if best is not None else None)
+        self.state['rng'] = rng_state()
+        self.state['files'] = name
+
+        tmp_path = self.checkpoint_dir / 'state.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.checkpoint_dir / 'state.json')
+        for path in self.checkpoint_dir.glob('step-*'):
+            if path.name != name:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+
+def save_split(checkpoint_dir, hashes, y, train_idx, val_idx):
+    """Record the split and labels by image hash, for resuming"""
+    tmp_path = Path(checkpoint_dir) / 'split.npz.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f,
+                 hashes=np.asarray(hashes, dtype='<U32'),
+                 y=y,
+                 train_idx=train_idx,
+                 val_idx=val_idx)
+    os.replace(tmp_path, Path(checkpoint_dir) / 'split.npz')
+
+
+def load_split(checkpoint_dir, hashes):
+    """(y, train_idx, val_idx) of the saved split in the current rows
+
+    Rows are matched by image hash and keep the label they were split with.
+    Images deleted since are dropped; images added since are left out, and
+    their y is 0.
+    """
+    row_by_hash = {h: i for i, h in enumerate(hashes)}
+    y = np.zeros(len(hashes), dtype=np.int64)
+    split_idx = []
+    with np.load(Path(checkpoint_dir) / 'split.npz') as split:
+        saved_hashes, saved_y = split['hashes'], split['y']
+        for name in ('train_idx', 'val_idx'):
+            rows = []
+            for i in split[name]:
+                row = row_by_hash.get(saved_hashes[i])
+                if row is not None:
+                    y[row] = saved_y[i]
+                    rows.append(row)
+            split_idx.append(np.array(rows, dtype=np.int64))
+        dropped = (len(split['train_idx']) + len(split['val_idx']) -
+                   sum(len(idx) for idx in split_idx))
+    if dropped:
+        log_message(f"{dropped} images of the saved split no longer exist",
+                    level='warning')
+    return y, split_idx[0], split_idx[1]
+
+
+def phase_history(state, phase):
+    """History-like record of a phase's epochs, across resumes"""
+    return type('obj', (object, ),
+                {'history': state['histories'].get(str(phase), {})})()
+
+
+# Every (hash, label) a model was trained or validated on, so a later
+# warm start can tell which samples are new
+TRAINING_SET_FILE = 'training_set.json'
+
+# Fewest old samples per class replayed during a warm start
+MIN_REPLAY_PER_CLASS = 8
+
+
+def load_warm_start(model_id):
+    """Model, class order, seen samples and metadata of a previous run"""
+    model_dir = Path(f"./data/models/{model_id}")
+    model = keras.models.load_model(str(model_dir / 'model.keras'),
+                                    compile=False)
+    with open(model_dir / 'labels.json', 'r') as f:
+        labels = json.load(f)
+    metadata = {}
+    if (model_dir / 'metadata.json').exists():
+        with open(model_dir / 'metadata.json', 'r') as f:
+            metadata = json.load(f)
+    seen = None
+    if (model_dir / TRAINING_SET_FILE).exists():
+        with open(model_dir / TRAINING_SET_FILE, 'r') as f:
+            seen = {tuple(sample) for sample in json.load(f)['samples']}
+    return {
+        'model_id': model_id,
+        'model': model,
+        'classes': [labels[str(i)] for i in range(len(labels))],
+        'seen': seen,
+        'metadata': metadata
+    }
+
+
+def resize_output_layer(model, old_classes, classes):
+    """Give a trained model one output unit per entry of classes
+
+    Units of classes the model already had keep their weights; units of new
+    classes start from the layer's initializers, and units of classes no
+    longer present are dropped.
+    """
+    if list(old_classes) == list(classes):
+        return model
+    old_output = model.layers[-1]
+    new_output = layers.Dense.from_config({
+        **old_output.get_config(), 'units': len(classes)
+    })
+    resized = keras.Model(model.inputs, new_output(old_output.input))
+
+    kernel, bias = new_output.get_weights()
+    old_kernel, old_bias = old_output.get_weights()
+    for i, cls in enumerate(classes):
+        if cls in old_classes:
+            j = old_classes.index(cls)
+            kernel[:, i] = old_kernel[:, j]
+            bias[i] = old_bias[j]
+    new_output.set_weights([kernel, bias])
+    return resized
+
+
+def find_base_model(model):
+    """The pretrained backbone nested inside a train.py model"""
+    return next(layer for layer in model.layers
+                if isinstance(layer, keras.Model))
+
+
+def select_warm_start_samples(indices, y, is_new, replay_ratio, rng):
+    """New samples among indices plus a class-stratified replay of old ones
+
+    replay_ratio old samples are replayed per new one, spread evenly over
+    the classes, so fine-tuning on the delta does not forget old classes.
+    Returns (selected indices, number replayed).
+    """
+    new = indices[is_new[indices]]
+    old = indices[~is_new[indices]]
+    old_classes = np.unique(y[old])
+    if len(old_classes) == 0:
+        return new, 0
+    per_class = max(MIN_REPLAY_PER_CLASS,
+                    int(np.ceil(replay_ratio * len(new) / len(old_classes))))
+    replay = []
+    for cls in old_classes:
+        candidates = old[y[old] == cls]
+        replay.append(
+            rng.choice(candidates, min(per_class, len(candidates)),
+                       replace=False))
+    replay = np.concatenate(replay)
+    return np.sort(np.concatenate([new, replay])), len(replay)
+
+
+def export_tflite(model, model_dir, calibration_images,
+                  variants=('float16', 'int8')):
+    """Export float16 and int8 TFLite versions of a trained model
+
+    The int8 model uses post-training quantization calibrated on a sample of
+    training images, which are only needed when it is among variants. Both
+    keep float32 inputs and outputs, so they accept the same preprocessed
+    arrays as the Keras model. Returns a dict of variant -> artifact info;
+    variants that fail to convert are logged and skipped.
+    """
+    artifacts = {}
+
+    def representative_dataset():
+        for image in calibration_images:
+            yield [np.expand_dims(image, axis=0).astype(np.float32)]
+
+    for variant in variants:
+        try:
+            converter = tf.lite.TFLiteConverter.from_keras_model(model)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            if variant == 'float16':
+                converter.target_spec.supported_types = [tf.float16]
+            else:
+                converter.representative_dataset = representative_dataset
+                converter.target_spec.supported_ops = [
+                    tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+                    tf.lite.OpsSet.TFLITE_BUILTINS
+                ]
+            tflite_model = converter.convert()
+
+            tflite_path = Path(model_dir) / f'model_{variant}.tflite'
+            with open(tflite_path, 'wb') as f:
+                f.write(tflite_model)
+            artifacts[variant] = {
+                'path': tflite_path.name,
+                'size_bytes': len(tflite_model)
+            }
+            log_message(
+                f"Exported {variant} TFLite model ({len(tflite_model) / 1e6:.1f} MB) to {tflite_path}"
+            )
+        except Exception as e:
+            log_message(f"TFLite {variant} export failed: {e}",
+                        level='warning')
+
+    return artifacts
+
+
 def train_model(args):
     if not TF_AVAILABLE:
         log_message("TensorFlow not available. Cannot train.", level='error')
         sys.exit(1)
 
+    start_time = time.time()
+    model_dir = Path(f"./data/models/{args.model_id}")
+    checkpoint_dir = model_dir / CHECKPOINT_DIR
+    state = None
+    if args.resume:
+        state = TrainingCheckpoint.load(checkpoint_dir)
+        if state is None:
+            log_message(f"No checkpoint to resume in {checkpoint_dir}",
+                        level='error')
+            sys.exit(1)
+        # Continue with the interrupted run's settings. The MongoDB URI is
+        # not saved, since it may hold credentials
+        args = argparse.Namespace(
+            **{
+                **vars(args),
+                **state['args'], 'mongo_uri': args.mongo_uri,
+                'model_id': args.model_id,
+                'resume': args.resume,
+                # A resumed run has a budget of its own
+                'time_budget': args.time_budget
+            })
+        log_message(f"Resuming model {args.model_id} in phase "
+                    f"{state['phase']} after epoch {state['epoch']}")
+        # TensorFlow's random streams cannot be saved, so they are reseeded
+        # from the position; Python's and NumPy's continue where they were
+        set_seeds(args.seed + 1000 * state['phase'] + state['epoch'])
+        if state.get('rng'):
+            set_rng_state(state['rng'])
+        # The checkpointed model and optimizer were built with this policy;
+        # runs from before policies were selected used mixed_float16
+        saved_policy = state.get('precision_policy', {}).get(
+            'policy', 'mixed_float16')
+        precision_policy = dict(select_precision_policy(saved_policy),
+                                source='checkpoint')
+    else:
+        set_seeds(args.seed)
+        precision_policy = select_precision_policy(
+            args.precision, args.precision_benchmark.lower() == 'true')
+
     log_message("Initializing improved training pipeline...")
     log_message(
         f"Configuration: epochs={args.epochs}, batch_size={args.batch_size}, lr={args.learning_rate}"
     )
 
-    X, y_labels, filenames = load_data_from_mongo(args.mongo_uri)
+    peak_rss = {}
+
+    if args.dataset_cache == 'off':
+        X, y_labels, filenames, hashes = load_data_from_mongo(
+            args.mongo_uri,
+            decoder=args.decoder,
+            batch_size=args.mongo_batch_size)
+    else:
+        X, y_labels, filenames, hashes = load_data_from_cache(
+            args.mongo_uri,
+            args.dataset_cache_dir,
+            mode=args.dataset_cache,
+            decoder=args.decoder,
+            batch_size=args.mongo_batch_size)
+    log_peak_rss('data_loaded', peak_rss)
 
     if len(X) < 10:
         log_message("Not enough samples for training (minimum 10 required)",
@@ -512,17 +1723,90 @@ def train_model(args):
 
     log_message(f"Training with {num_classes} classes: {list(unique_classes)}")
 
-    le = LabelEncoder()
-    y = le.fit_transform(y_labels)
-
-    labels_map = {i: cls for i, cls in enumerate(le.classes_)}
+    warm_start = None
+    if args.warm_start and state is None:
+        warm_start = load_warm_start(args.warm_start)
+        log_message(f"Warm-starting from model {args.warm_start}")
+
+    if state is not None:
+        classes = state['classes']
+    elif warm_start is None:
+        le = LabelEncoder()
+        y = le.fit_transform(y_labels)
+        classes = list(le.classes_)
+    else:
+        # Keep the previous model's output order, so its units line up;
+        # new classes are appended
+        present = set(unique_classes)
+        classes = ([c for c in warm_start['classes'] if c in present] +
+                   sorted(present - set(warm_start['classes'])))
+        class_index = {cls: i for i, cls in enumerate(classes)}
+        y = np.array([class_index[label] for label in y_labels])
+
+    num_classes = len(classes)
+    labels_map = {i: cls for i, cls in enumerate(classes)}
     log_message(f"Label mapping: {labels_map}")
 
-    X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=args.validation_split, stratify=y, random_state=42)
+    if state is not None:
+        y, train_idx, val_idx = load_split(checkpoint_dir, hashes)
+    else:
+        # Split indices rather than images, so the validation set is read
+        # from X in place instead of being copied
+        train_idx, val_idx = train_test_split(np.arange(len(y)),
+                                              test_size=args.validation_split,
+                                              stratify=y,
+                                              random_state=args.seed)
+
+    warm_start_info = state['warm_start'] if state is not None else None
+    if warm_start is not None:
+        if warm_start['seen'] is not None:
+            is_new = np.array([(h, label) not in warm_start['seen']
+                               for h, label in zip(hashes, y_labels)])
+        else:
+            log_message(
+                f"Model {args.warm_start} has no {TRAINING_SET_FILE}; "
+                "treating only images of new classes as new",
+                level='warning')
+            is_new = np.array([label not in warm_start['classes']
+                               for label in y_labels])
+        if not is_new.any():
+            log_message(
+                f"No new or relabelled images since model {args.warm_start}; "
+                "nothing to fine-tune",
+                level='error')
+            sys.exit(1)
+
+        # Train and validate on the delta plus replayed old samples, so the
+        # run's cost follows the number of new images
+        rng = np.random.default_rng(args.seed)
+        train_idx, train_replayed = select_warm_start_samples(
+            train_idx, y, is_new, args.replay_ratio, rng)
+        val_idx, val_replayed = select_warm_start_samples(
+            val_idx, y, is_new, args.replay_ratio, rng)
+        warm_start_info = {
+            'from_model': args.warm_start,
+            'new_samples': int(is_new.sum()),
+            'replayed_samples': train_replayed + val_replayed,
+            'classes_added': [c for c in classes
+                              if c not in warm_start['classes']],
+            'classes_removed': [c for c in warm_start['classes']
+                                if c not in classes]
+        }
+        log_message(
+            f"Warm start: {warm_start_info['new_samples']} new samples, "
+            f"{warm_start_info['replayed_samples']} replayed, classes added: "
+            f"{warm_start_info['classes_added']}, removed: "
+            f"{warm_start_info['classes_removed']}")
+
+    if state is None:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        checkpoint_dir.mkdir(parents=True)
+        save_split(checkpoint_dir, hashes, y, train_idx, val_idx)
+
+    y_train, y_val = y[train_idx], y[val_idx]
 
     log_message(
-        f"Initial train set: {len(X_train)} samples, Validation set: {len(X_val)} samples"
+        f"Initial train set: {len(train_idx)} samples, Validation set: {len(val_idx)} samples"
     )
 
     train_unique, train_counts = np.unique(y_train, return_counts=True)
@@ -531,33 +1815,47 @@ def train_model(args):
     median_samples = int(np.median(train_counts))
     target_samples = min(max_samples * 2, max(median_samples, max_samples))
 
-    y_train_labels = le.inverse_transform(y_train)
-    X_train_balanced, y_train_balanced_labels = balance_dataset(
-        X_train, y_train_labels, target_samples)
-    y_train_balanced = le.transform(y_train_balanced_labels)
-
-    log_message(f"Balanced training set: {len(X_train_balanced)} samples")
+    # Classes are rebalanced by sampling indices in create_tf_dataset rather
+    # than by materializing oversampled copies
+    log_message(f"Balancing dataset to {target_samples} samples per class")
+    training_samples = target_samples * len(train_unique)
+    log_message(f"Balanced training set: {training_samples} samples")
 
-    y_train_cat = tf.keras.utils.to_categorical(y_train_balanced, num_classes)
-    y_val_cat = tf.keras.utils.to_categorical(y_val, num_classes)
+    y_cat = tf.keras.utils.to_categorical(y, num_classes)
 
-    cw = class_weight.compute_class_weight("balanced",
-                                           classes=np.unique(y_train_balanced),
-                                           y=y_train_balanced)
-    class_weights = {i: float(w) for i, w in enumerate(cw)}
+    # The sampler draws every class equally often
+    class_weights = {i: 1.0 for i in range(num_classes)}
     log_message(f"Class weights: {class_weights}")
 
     enable_seg = args.enable_segmentation.lower() == 'true'
-    model_size = 'large' if len(X) > 200 and num_classes > 5 else 'small'
-    log_message(
-        f"Creating improved model (Segmentation: {enable_seg}, Size: {model_size})..."
-    )
-
-    if enable_seg:
-        model, base_model = create_segmentation_model(num_classes)
+    if state is not None:
+        enable_seg = state['segmentation_enabled']
+        model_architecture = state['model_architecture']
+        model = TrainingCheckpoint.load_model(checkpoint_dir, state)
+        base_model = find_base_model(model)
+        if state['phase'] == 1:
+            base_model.trainable = False
+    elif warm_start is not None:
+        enable_seg = warm_start['metadata'].get('segmentation_enabled', False)
+        model_architecture = warm_start['metadata'].get(
+            'model_architecture', 'EfficientNetB0')
+        model = resize_output_layer(warm_start['model'],
+                                    warm_start['classes'], classes)
+        base_model = find_base_model(model)
+        base_model.trainable = False
     else:
-        model, base_model = create_improved_model(num_classes,
-                                                  model_size=model_size)
+        model_architecture = ('EfficientNetB0' if not enable_seg else
+                              'MobileNetV2-Segmentation')
+        model_size = 'large' if len(X) > 200 and num_classes > 5 else 'small'
+        log_message(
+            f"Creating improved model (Segmentation: {enable_seg}, Size: {model_size})..."
+        )
+
+        if enable_seg:
+            model, base_model = create_segmentation_model(num_classes)
+        else:
+            model, base_model = create_improved_model(num_classes,
+                                                      model_size=model_size)
 
     label_smoothing = 0.15
 
@@ -571,63 +1869,222 @@ def train_model(args):
 
     log_message(f"Model compiled with {model.count_params():,} parameters")
 
-    model_dir = Path(f"./data/models/{args.model_id}")
-    model_dir.mkdir(parents=True, exist_ok=True)
-
     # Optimized epoch distribution for faster training
     phase1_epochs = args.epochs
     phase2_epochs = max(5, args.epochs // 3)  # Reduced from //2
     phase3_epochs = max(3, args.epochs // 5)  # Reduced from //4
+    if warm_start is not None:
+        # The head only needs its own phase when output units were added
+        # or removed; the rest of the budget fine-tunes the top of the base
+        warm_epochs = max(1, args.warm_start_epochs)
+        phase1_epochs = (min(warm_epochs - 1, max(1, warm_epochs // 3))
+                         if list(warm_start['classes']) != classes else 0)
+        phase2_epochs = warm_epochs - phase1_epochs
+        phase3_epochs = 0
+    if state is not None:
+        phase1_epochs, phase2_epochs, phase3_epochs = state['phase_epochs']
     total_epochs = phase1_epochs + phase2_epochs + phase3_epochs
+    time_budget = None
+    if args.time_budget:
+        # The planned epochs become upper bounds
+        time_budget = TimeBudget(args.time_budget * 60, start_time,
+                                 [phase1_epochs, phase2_epochs, phase3_epochs])
 
     training_progress_callback = TrainingCallback(
         total_epochs,
         phase_name="Feature Extraction",
         phase_number=1,
-        total_phases=3)
+        total_phases=3,
+        event_interval=args.event_interval)
 
     warmup_lr_callback = WarmupCosineDecay(initial_lr=args.learning_rate,
                                            total_epochs=phase1_epochs,
                                            warmup_epochs=3,
                                            min_lr=1e-7)
 
-    base_callbacks = [
-        training_progress_callback,
-        callbacks.EarlyStopping(
-            monitor='val_accuracy',
-            patience=6,  # Reduced from 12 for faster training
-            restore_best_weights=True,
-            verbose=1,
-            min_delta=0.005,  # Slightly higher threshold to stop earlier
-            mode='max'),
-        callbacks.ModelCheckpoint(str(model_dir / 'best_model.keras'),
-                                  monitor='val_accuracy',
-                                  save_best_only=True,
-                                  verbose=1,
-                                  mode='max')
-    ]
+    early_stopping = callbacks.EarlyStopping(
+        monitor='val_accuracy',
+        patience=6,  # Reduced from 12 for faster training
+        restore_best_weights=True,
+        verbose=1,
+        min_delta=0.005,  # Slightly higher threshold to stop earlier
+        mode='max')
+    checkpoint_callback = callbacks.ModelCheckpoint(
+        str(model_dir / 'best_model.keras'),
+        monitor='val_accuracy',
+        save_best_only=True,
+        verbose=1,
+        mode='max')
+
+    if state is None:
+        state = {
+            'phase': 1,
+            'epoch': 0,
+            'seed': args.seed,
+            'resumes': 0,
+            'precision_policy': precision_policy,
+            'classes': classes,
+            'segmentation_enabled': enable_seg,
+            'model_architecture': model_architecture,
+            'phase_epochs': [phase1_epochs, phase2_epochs, phase3_epochs],
+            'warm_start': warm_start_info,
+            'histories': {},
+            'args': {k: v
+                     for k, v in vars(args).items() if k != 'mongo_uri'}
+        }
+    else:
+        state['resumes'] += 1
+        training_progress_callback.global_epoch = sum(
+            len(history.get('loss', []))
+            for history in state['histories'].values())
+    training_checkpoint = TrainingCheckpoint(checkpoint_dir, model, state,
+                                             early_stopping,
+                                             checkpoint_callback)
+    if 'files' not in state:
+        # A run interrupted in its first epoch resumes from the start
+        training_checkpoint.save()
+    step_telemetry = (StepTelemetry()
+                      if args.step_telemetry.lower() == 'true' else None)
+    telemetry_callbacks = [step_telemetry] if step_telemetry is not None else []
+    budget_callbacks = [time_budget] if time_budget is not None else []
+    base_callbacks = telemetry_callbacks + [
+        training_progress_callback, early_stopping, checkpoint_callback,
+        training_checkpoint
+    ] + budget_callbacks
 
     log_message("=" * 50)
     log_message("PHASE 1: Training classification head with frozen base")
     log_message("=" * 50)
 
-    train_dataset = create_tf_dataset(X_train_balanced,
-                                      y_train_cat,
+    train_dataset = create_tf_dataset(X,
+                                      y_cat,
                                       args.batch_size,
-                                      augment=True)
-    val_dataset = create_tf_dataset(X_val,
-                                    y_val_cat,
+                                      augment=True,
+                                      indices=train_idx,
+                                      samples_per_class=target_samples,
+                                      augmentation=args.augmentation)
+    if step_telemetry is not None:
+        train_dataset = step_telemetry.wrap(train_dataset)
+    val_dataset = create_tf_dataset(X,
+                                    y_cat,
                                     args.batch_size,
                                     augment=False,
-                                    shuffle=False)
-
-    history1 = model.fit(train_dataset,
-                         epochs=phase1_epochs,
-                         validation_data=val_dataset,
-                         class_weight=class_weights,
-                         callbacks=base_callbacks + [warmup_lr_callback],
-                         verbose=1)
+                                    shuffle=False,
+                                    indices=val_idx)
+    log_peak_rss('datasets_ready', peak_rss)
 
+    use_feature_cache = args.phase1_features.lower() == 'true'
+    if use_feature_cache and enable_seg:
+        log_message(
+            "Cached Phase 1 features are not supported for the segmentation "
+            "model; training Phase 1 end to end",
+            level='warning')
+        use_feature_cache = False
+
+    if state['phase'] > 1:
+        log_message("Phase 1 already complete")
+    elif phase1_epochs == 0:
+        log_message("Output layer unchanged, skipping Phase 1")
+    elif use_feature_cache:
+        # The base is frozen in Phase 1, so its pooled output for an image
+        # never changes: compute it once and train only the head
+        feature_extractor, head = split_feature_head(model)
+        views = max(1, args.feature_views)
+        start = time.time()
+        if time_budget is not None:
+            time_budget.start_feature_extraction(views)
+
+        store = None
+        # A warm-started backbone is no longer the plain ImageNet one
+        if (args.embedding_store.lower() == 'true'
+                and warm_start_info is None):
+            # A fresh model's backbone is the plain ImageNet one, so its
+            # embeddings carry over between runs for unchanged images
+            store = EmbeddingStore(
+                Path(args.embedding_store_dir) / base_model.name,
+                backbone_version(base_model.name,
+                                 f'imagenet/keras-{keras.__version__}',
+                                 TRAINING_PREPROCESSING, args.decoder,
+                                 precision_policy['policy']))
+            row_by_hash = {h: i for i, h in enumerate(hashes)}
+            stats = store.update(
+                hashes,
+                lambda batch: X[[row_by_hash[h] for h in batch]],
+                lambda images: feature_extractor.predict_on_batch(
+                    normalize(images, TRAINING_PREPROCESSING)),
+                args.batch_size,
+                log=log_message)
+            log_message(
+                f"Embedding store: {stats['embedded']} embedded, "
+                f"{stats['reused']} reused, {stats['removed']} removed")
+
+        with tempfile.TemporaryDirectory(prefix='features-') as feature_dir:
+            train_features = extract_features(
+                feature_extractor, X, y_cat, train_idx, args.batch_size,
+                os.path.join(feature_dir, 'train.npy'), views,
+                args.augmentation, store, hashes)
+            val_features = extract_features(
+                feature_extractor, X, y_cat, val_idx, args.batch_size,
+                os.path.join(feature_dir, 'val.npy'), store=store,
+                hashes=hashes)
+            log_message(
+                f"Cached backbone features for {len(train_idx)} training images "
+                f"x {views} view(s) and {len(val_idx)} validation images in "
+                f"{time.time() - start:.1f}s")
+            if time_budget is not None:
+                time_budget.end_feature_extraction()
+
+            head.compile(optimizer=optimizers.AdamW(
+                learning_rate=args.learning_rate, weight_decay=1e-5),
+                         loss=tf.keras.losses.CategoricalCrossentropy(
+                             label_smoothing=label_smoothing),
+                         metrics=['accuracy'])
+            initial_epoch = training_checkpoint.start_phase(1, head)
+            start = time.time()
+            feature_dataset = create_feature_dataset(
+                train_features,
+                np.tile(y_cat[train_idx], (views, 1)),
+                args.batch_size,
+                samples_per_class=target_samples)
+            if step_telemetry is not None:
+                feature_dataset = step_telemetry.wrap(feature_dataset)
+            if phase_fits(time_budget, 1, warmup_lr_callback, initial_epoch):
+                head.fit(
+                    feature_dataset,
+                    epochs=phase1_epochs,
+                    initial_epoch=initial_epoch,
+                    validation_data=create_feature_dataset(val_features,
+                                                           y_cat[val_idx],
+                                                           args.batch_size,
+                                                           shuffle=False),
+                    class_weight=class_weights,
+                    callbacks=telemetry_callbacks + [
+                        training_progress_callback, early_stopping,
+                        FullModelCheckpoint(model, checkpoint_callback.filepath,
+                                            checkpoint_callback),
+                        training_checkpoint, warmup_lr_callback
+                    ] + budget_callbacks,
+                    verbose=1)
+            log_message(
+                f"Trained head on cached features in {time.time() - start:.1f}s")
+            # Release the memmaps before their directory is removed
+            del train_features, val_features, feature_dataset
+    else:
+        initial_epoch = training_checkpoint.start_phase(1, model)
+        if phase_fits(time_budget, 1, warmup_lr_callback, initial_epoch):
+            model.fit(train_dataset,
+                      epochs=phase1_epochs,
+                      initial_epoch=initial_epoch,
+                      validation_data=val_dataset,
+                      class_weight=class_weights,
+                      callbacks=base_callbacks + [warmup_lr_callback],
+                      verbose=1)
+    if state['phase'] == 1:
+        training_checkpoint.end_phase(2)
+
+    # Histories come from the checkpoint, so they cover every epoch of a
+    # resumed phase
+    history1 = phase_history(state, 1)
     best_val_acc_phase1 = max(history1.history.get('val_accuracy', [0]))
     log_message(
         f"Phase 1 complete. Best val accuracy: {best_val_acc_phase1:.4f}")
@@ -638,114 +2095,121 @@ def train_model(args):
             "Accuracy already excellent (>=90%), skipping fine-tuning phases")
         best_val_acc_phase2 = best_val_acc_phase1
     else:
-        log_message("=" * 50)
-        log_message("PHASE 2: Fine-tuning top layers of base model")
-        log_message("=" * 50)
-
-        training_progress_callback.set_phase("Fine-tuning", 2)
-
-        base_model.trainable = True
-
-        if hasattr(base_model, 'layers'):
-            num_layers = len(base_model.layers)
-            # Unfreeze last 40 layers explicitly for better fine-tuning
-            layers_to_unfreeze = min(40, num_layers)
-            freeze_until = num_layers - layers_to_unfreeze
-            for layer in base_model.layers[:freeze_until]:
-                layer.trainable = False
-            for layer in base_model.layers[freeze_until:]:
-                layer.trainable = True
-            log_message(
-                f"Unfroze last {layers_to_unfreeze} of {num_layers} layers")
-
-        fine_tune_lr = args.learning_rate * 0.1
-        model.compile(optimizer=optimizers.AdamW(learning_rate=fine_tune_lr,
-                                                 weight_decay=1e-5),
-                      loss=tf.keras.losses.CategoricalCrossentropy(
-                          label_smoothing=label_smoothing),
-                      metrics=['accuracy'])
-
-        phase2_warmup = WarmupCosineDecay(initial_lr=fine_tune_lr,
-                                          total_epochs=phase2_epochs,
-                                          warmup_epochs=2,
-                                          min_lr=1e-8)
-
-        history2 = model.fit(train_dataset,
-                             epochs=phase2_epochs,
-                             validation_data=val_dataset,
-                             class_weight=class_weights,
-                             callbacks=base_callbacks + [phase2_warmup],
-                             verbose=1)
-
+        if state['phase'] > 2:
+            log_message("Phase 2 already complete")
+        else:
+            log_message("=" * 50)
+            log_message("PHASE 2: Fine-tuning top layers of base model")
+            log_message("=" * 50)
+
+            training_progress_callback.set_phase("Fine-tuning", 2)
+            if step_telemetry is not None:
+                step_telemetry.set_phase(2)
+
+            base_model.trainable = True
+
+            if hasattr(base_model, 'layers'):
+                num_layers = len(base_model.layers)
+                # Unfreeze last 40 layers explicitly for better fine-tuning
+                layers_to_unfreeze = min(40, num_layers)
+                freeze_until = num_layers - layers_to_unfreeze
+                for layer in base_model.layers[:freeze_until]:
+                    layer.trainable = False
+                for layer in base_model.layers[freeze_until:]:
+                    layer.trainable = True
+                log_message(
+                    f"Unfroze last {layers_to_unfreeze} of {num_layers} layers")
+
+            fine_tune_lr = args.learning_rate * 0.1
+            model.compile(optimizer=optimizers.AdamW(learning_rate=fine_tune_lr,
+                                                     weight_decay=1e-5),
+                          loss=tf.keras.losses.CategoricalCrossentropy(
+                              label_smoothing=label_smoothing),
+                          metrics=['accuracy'])
+
+            phase2_warmup = WarmupCosineDecay(initial_lr=fine_tune_lr,
+                                              total_epochs=phase2_epochs,
+                                              warmup_epochs=2,
+                                              min_lr=1e-8)
+
+            initial_epoch = training_checkpoint.start_phase(2, model)
+            if phase_fits(time_budget, 2, phase2_warmup, initial_epoch):
+                model.fit(train_dataset,
+                          epochs=phase2_epochs,
+                          initial_epoch=initial_epoch,
+                          validation_data=val_dataset,
+                          class_weight=class_weights,
+                          callbacks=base_callbacks + [phase2_warmup],
+                          verbose=1)
+
+        history2 = phase_history(state, 2)
         best_val_acc_phase2 = max(history2.history.get('val_accuracy', [0]))
         log_message(
             f"Phase 2 complete. Best val accuracy: {best_val_acc_phase2:.4f}")
+    if state['phase'] == 2:
+        training_checkpoint.end_phase(3)
 
     # Phase 3: Deep fine-tuning (only if accuracy is moderate and could benefit)
-    if best_val_acc_phase1 < 0.90 and best_val_acc_phase2 > 0.5 and best_val_acc_phase2 < 0.85:
-        log_message("=" * 50)
-        log_message("PHASE 3: Deep fine-tuning with very low learning rate")
-        log_message("=" * 50)
-
-        training_progress_callback.set_phase("Deep Fine-tuning", 3)
-
-        if hasattr(base_model, 'layers'):
-            freeze_until = int(num_layers * 0.5)
-            for layer in base_model.layers[:freeze_until]:
-                layer.trainable = False
-            for layer in base_model.layers[freeze_until:]:
-                layer.trainable = True
-            log_message(
-                f"Unfroze more layers: {num_layers - freeze_until} of {num_layers}"
-            )
-
-        deep_fine_tune_lr = args.learning_rate * 0.01
-        model.compile(optimizer=optimizers.AdamW(
-            learning_rate=deep_fine_tune_lr, weight_decay=1e-6),
-                      loss=tf.keras.losses.CategoricalCrossentropy(
-                          label_smoothing=label_smoothing * 0.5),
-                      metrics=['accuracy'])
-
-        phase3_warmup = WarmupCosineDecay(initial_lr=deep_fine_tune_lr,
-                                          total_epochs=phase3_epochs,
-                                          warmup_epochs=1,
-                                          min_lr=1e-9)
-
-        history3 = model.fit(train_dataset,
-                             epochs=phase3_epochs,
-                             validation_data=val_dataset,
-                             class_weight=class_weights,
-                             callbacks=base_callbacks + [phase3_warmup],
-                             verbose=1)
+    if (phase3_epochs > 0 and best_val_acc_phase1 < 0.90
+            and best_val_acc_phase2 > 0.5 and best_val_acc_phase2 < 0.85):
+        if state['phase'] > 3:
+            log_message("Phase 3 already complete")
+        else:
+            log_message("=" * 50)
+            log_message("PHASE 3: Deep fine-tuning with very low learning rate")
+            log_message("=" * 50)
+
+            training_progress_callback.set_phase("Deep Fine-tuning", 3)
+            if step_telemetry is not None:
+                step_telemetry.set_phase(3)
+
+            base_model.trainable = True
+            if hasattr(base_model, 'layers'):
+                num_layers = len(base_model.layers)
+                freeze_until = int(num_layers * 0.5)
+                for layer in base_model.layers[:freeze_until]:
+                    layer.trainable = False
+                for layer in base_model.layers[freeze_until:]:
+                    layer.trainable = True
+                log_message(
+                    f"Unfroze more layers: {num_layers - freeze_until} of {num_layers}"
+                )
+
+            deep_fine_tune_lr = args.learning_rate * 0.01
+            model.compile(optimizer=optimizers.AdamW(
+                learning_rate=deep_fine_tune_lr, weight_decay=1e-6),
+                          loss=tf.keras.losses.CategoricalCrossentropy(
+                              label_smoothing=label_smoothing * 0.5),
+                          metrics=['accuracy'])
+
+            phase3_warmup = WarmupCosineDecay(initial_lr=deep_fine_tune_lr,
+                                              total_epochs=phase3_epochs,
+                                              warmup_epochs=1,
+                                              min_lr=1e-9)
+
+            initial_epoch = training_checkpoint.start_phase(3, model)
+            if phase_fits(time_budget, 3, phase3_warmup, initial_epoch):
+                model.fit(train_dataset,
+                          epochs=phase3_epochs,
+                          initial_epoch=initial_epoch,
+                          validation_data=val_dataset,
+                          class_weight=class_weights,
+                          callbacks=base_callbacks + [phase3_warmup],
+                          verbose=1)
     else:
         log_message(
             "Skipping phase 3 - accuracy already good or would not benefit",
             level='info')
-        history3 = type(
-            'obj', (object, ), {
-                'history': {
-                    'accuracy': [],
-                    'val_accuracy': [],
-                    'loss': [],
-                    'val_loss': []
-                }
-            })()
-
-    # Ensure history2 exists for final metrics
-    if 'history2' not in dir():
-        history2 = type(
-            'obj', (object, ), {
-                'history': {
-                    'accuracy': [],
-                    'val_accuracy': [],
-                    'loss': [],
-                    'val_loss': []
-                }
-            })()
+    if state['phase'] == 3:
+        training_checkpoint.end_phase(4)
+    history2 = phase_history(state, 2)
+    history3 = phase_history(state, 3)
 
     best_model = keras.models.load_model(str(model_dir / 'best_model.keras'))
     final_model_path = model_dir / 'model.keras'
+    save_start = time.time()
     best_model.save(str(final_model_path))
+    save_seconds = time.time() - save_start
     log_message(f"Model saved to {final_model_path}")
 
     labels_path = model_dir / 'labels.json'
@@ -753,11 +2217,16 @@ def train_model(args):
         json.dump(labels_map, f, indent=2)
     log_message(f"Labels saved to {labels_path}")
 
+    # Samples not trained on in a warm start were seen by an earlier run
+    with open(model_dir / TRAINING_SET_FILE, 'w') as f:
+        json.dump({'samples': [[h, label]
+                               for h, label in zip(hashes, y_labels)]}, f)
+
     log_message("Evaluating model on validation set...")
-    val_loss, val_accuracy = best_model.evaluate(X_val, y_val_cat, verbose=0)
+    val_loss, val_accuracy = best_model.evaluate(val_dataset, verbose=0)
     log_message(f"Final validation accuracy: {val_accuracy:.4f}")
 
-    val_predictions = best_model.predict(X_val, verbose=0)
+    val_predictions = best_model.predict(val_dataset, verbose=0)
     val_pred_classes = np.argmax(val_predictions, axis=1)
 
     from sklearn.metrics import confusion_matrix, classification_report, precision_score, recall_score, f1_score
@@ -782,6 +2251,58 @@ def train_model(args):
                           zero_division=0)
     f1 = f1_score(y_val, val_pred_classes, average='weighted', zero_division=0)
 
+    # Exports come after evaluation, so a time budget only ever cuts them;
+    # each starts only if its estimated cost fits in the time left
+    def export_fits(name, estimate):
+        return time_budget is None or time_budget.export_fits(name, estimate)
+
+    def record_export(name, start):
+        if time_budget is not None:
+            time_budget.record_export(name, time.time() - start)
+
+    tflite_artifacts = {}
+    if args.export_tflite.lower() == 'true':
+        log_message("Exporting TFLite models...")
+        calibration_size = min(len(train_idx), args.calibration_samples)
+        float16_seconds = None
+        for variant in ('float16', 'int8'):
+            estimate = float16_seconds or EXPORT_SAVE_MULTIPLE * save_seconds
+            calibration_images = None
+            if variant == 'int8':
+                # Calibration runs the float model once per sample
+                if time_budget is not None and time_budget.val_seconds:
+                    estimate += (calibration_size * time_budget.val_seconds /
+                                 max(1, len(val_idx)))
+                if not export_fits('TFLite int8', estimate):
+                    continue
+                calibration_idx = np.random.choice(train_idx,
+                                                   calibration_size,
+                                                   replace=False)
+                calibration_images = normalize(X[np.sort(calibration_idx)],
+                                               TRAINING_PREPROCESSING)
+            elif not export_fits('TFLite float16', estimate):
+                continue
+            start = time.time()
+            tflite_artifacts.update(
+                export_tflite(best_model, model_dir, calibration_images,
+                              variants=(variant, )))
+            if variant == 'float16':
+                float16_seconds = time.time() - start
+            record_export(f'tflite-{variant}', start)
+
+    serving_dir = None
+    if (args.export_serving.lower() == 'true' and
+            export_fits('serving', EXPORT_SAVE_MULTIPLE * save_seconds)):
+        start = time.time()
+        try:
+            serving_dir = export_serving_model(best_model,
+                                               model_dir / 'serving',
+                                               TRAINING_PREPROCESSING)
+            log_message(f"Serving model (takes encoded image bytes) saved to {serving_dir}")
+        except Exception as e:
+            log_message(f"Serving model export failed: {e}", level='warning')
+        record_export('serving', start)
+
     all_val_accuracies = (history1.history.get('val_accuracy', []) +
                           history2.history.get('val_accuracy', []) +
                           history3.history.get('val_accuracy', []))
@@ -801,6 +2322,7 @@ def train_model(args):
     log_message(f"Recall: {recall:.4f}")
     log_message(f"F1 Score: {f1:.4f}")
     log_message(f"=" * 50)
+    log_peak_rss('training_complete', peak_rss)
 
     total_epochs_trained = (len(history1.history.get('accuracy', [])) +
                             len(history2.history.get('accuracy', [])) +
@@ -812,9 +2334,9 @@ def train_model(args):
         'num_classes': num_classes,
         'class_indices': labels_map,
         'input_shape': [224, 224, 3],
-        'training_samples': len(X_train_balanced),
+        'training_samples': training_samples,
         'original_samples': len(X),
-        'validation_samples': len(X_val),
+        'validation_samples': len(val_idx),
         'final_accuracy': float(final_accuracy),
         'final_val_accuracy': float(best_val_accuracy),
         'precision': float(precision),
@@ -822,20 +2344,40 @@ def train_model(args):
         'f1_score': float(f1),
         'epochs_trained': total_epochs_trained,
         'segmentation_enabled': enable_seg,
-        'model_architecture':
-        'EfficientNetB0' if not enable_seg else 'MobileNetV2-Segmentation',
+        'model_architecture': model_architecture,
+        'tflite': tflite_artifacts,
+        'serving_model': serving_dir.name if serving_dir else None,
+        'preprocessing': TRAINING_PREPROCESSING,
+        'precision_policy': precision_policy,
+        'peak_rss_mb': peak_rss,
+        'warm_start': warm_start_info,
         'training_config': {
             'batch_size': args.batch_size,
             'initial_learning_rate': args.learning_rate,
             'validation_split': args.validation_split,
             'label_smoothing': label_smoothing,
             'optimizer': 'AdamW',
-            'data_augmentation': 'tf.keras.layers + PIL advanced'
+            'data_augmentation': args.augmentation,
+            'class_balancing': 'tf.data per-class sampling',
+            'decoder': args.decoder,
+            'phase1_features': use_feature_cache,
+            'feature_views': args.feature_views if use_feature_cache else None,
+            'warm_start_epochs': (args.warm_start_epochs
+                                  if warm_start_info is not None else None),
+            'replay_ratio': (args.replay_ratio
+                             if warm_start_info is not None else None),
+            'seed': state['seed'],
+            'resumes': state['resumes'],
+            'time_budget': (time_budget.summary()
+                            if time_budget is not None else None),
+            'step_telemetry': (step_telemetry.summary()
+                               if step_telemetry is not None else None)
         }
     }
 
     with open(model_dir / 'metadata.json', 'w') as f:
         json.dump(metadata, f, indent=2)
+    training_checkpoint.clear()
 
     log_message("All training artifacts saved successfully!")
 
@@ -858,7 +2400,6 @@ if __name__ == '__main__':
                         required=True,
                         help='MongoDB connection URI')
     parser.add_argument('--model-id',
-                        required=True,
                         help='Unique model identifier')
     parser.add_argument('--epochs',
                         type=int,
@@ -879,6 +2420,109 @@ if __name__ == '__main__':
     parser.add_argument('--enable-segmentation',
                         default='false',
                         help='Enable segmentation model')
+    parser.add_argument('--decoder',
+                        choices=DECODERS,
+                        default='pil',
+                        help='Image decode path; pil-draft and cv2 decode JPEGs at reduced resolution first')
+    parser.add_argument('--export-tflite',
+                        default='true',
+                        help='Export float16 and int8 TFLite models after training')
+    parser.add_argument('--export-serving',
+                        default='true',
+                        help='Export a SavedModel that decodes and preprocesses image bytes in-graph')
+    parser.add_argument('--calibration-samples',
+                        type=int,
+                        default=200,
+                        help='Training images used to calibrate int8 quantization')
+    parser.add_argument('--mongo-batch-size',
+                        type=int,
+                        default=256,
+                        help='Documents fetched per MongoDB cursor batch while loading images')
+    parser.add_argument('--augmentation',
+                        choices=AUGMENTATIONS,
+                        default='keras',
+                        help='Training augmentation: Keras preprocessing layers, the advanced '
+                             'augmentations as batched TF ops, the same on a PIL thread pool, '
+                             'or none')
+    parser.add_argument('--phase1-features',
+                        default='false',
+                        help='Train the Phase 1 head on backbone features computed once per image '
+                             'instead of running the frozen base every epoch')
+    parser.add_argument('--feature-views',
+                        type=int,
+                        default=1,
+                        help='Feature views per training image with --phase1-features; views '
+                             'after the first are augmented (default: 1)')
+    parser.add_argument('--embedding-store',
+                        default='true',
+                        help='With --phase1-features, reuse ImageNet backbone embeddings of '
+                             'unchanged images from the persistent embedding store')
+    parser.add_argument('--embedding-store-dir',
+                        default=str(DEFAULT_STORE_ROOT),
+                        help='Root directory of the persistent embedding stores')
+    parser.add_argument('--dataset-cache',
+                        choices=['sync', 'offline', 'off'],
+                        default='sync',
+                        help='Decoded image cache: sync it with MongoDB, train from it without '
+                             'MongoDB (offline), or load straight from MongoDB (off)')
+    parser.add_argument('--dataset-cache-dir',
+                        default=str(DEFAULT_CACHE_ROOT),
+                        help='Directory for the decoded image cache')
+    parser.add_argument('--warm-start',
+                        metavar='MODEL_ID',
+                        help='Fine-tune ./data/models/MODEL_ID/model.keras on the images added or '
+                             'relabelled since it was trained, instead of training from ImageNet')
+    parser.add_argument('--warm-start-epochs',
+                        type=int,
+                        default=6,
+                        help='Epoch budget of a --warm-start run (default: 6)')
+    parser.add_argument('--replay-ratio',
+                        type=float,
+                        default=1.0,
+                        help='Old samples replayed per new sample in a --warm-start run, '
+                             'spread evenly over the classes (default: 1.0)')
+    parser.add_argument('--resume',
+                        metavar='MODEL_ID',
+                        help='Continue the interrupted run of MODEL_ID from its last epoch '
+                             'checkpoint, with the settings it was started with. Python and '
+                             'NumPy random states are restored, but TensorFlow shuffling and '
+                             'augmentation are reseeded, so later epochs see a different '
+                             'order than an uninterrupted run would')
+    parser.add_argument('--precision',
+                        choices=PRECISION_POLICIES,
+                        default='auto',
+                        help='Keras dtype policy; auto uses mixed_float16 on a GPU, '
+                             'mixed_bfloat16 on CPUs with bfloat16 instructions and float32 '
+                             'otherwise (default: auto)')
+    parser.add_argument('--precision-benchmark',
+                        default='true',
+                        help='With --precision auto, time a few training steps under each '
+                             'candidate policy at startup and keep the fastest')
+    parser.add_argument('--time-budget',
+                        type=float,
+                        metavar='MINUTES',
+                        help='Wall-clock budget for the whole run; phase epochs are fitted to '
+                             'it from measured epoch times, up to the planned counts')
+    parser.add_argument('--event-interval',
+                        type=float,
+                        default=EVENT_INTERVAL,
+                        help='Minimum seconds between batch progress events; 0 reports every '
+                             f'batch (default: {EVENT_INTERVAL})')
+    parser.add_argument('--step-telemetry',
+                        default='true',
+                        help='Time the data wait and compute of every training step and report '
+                             'per-epoch summaries, flagging epochs bound by the input pipeline')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=42,
+                        help='Seed for the data split and all random number generators '
+                             '(default: 42)')
 
     args = parser.parse_args()
+    if args.resume:
+        if args.model_id and args.model_id != args.resume:
+            parser.error('--model-id must match --resume')
+        args.model_id = args.resume
+    elif not args.model_id:
+        parser.error('--model-id is required')
     train_model(args)
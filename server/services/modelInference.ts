@@ -1,6 +1,7 @@
-import { spawn, spawnSync } from 'child_process';
+import { spawn, spawnSync, type ChildProcessWithoutNullStreams } from 'child_process';
 import path from 'path';
 import fs from 'fs';
+import os from 'os';
 import { fileURLToPath } from 'url';
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -87,25 +88,126 @@ function resolvePythonForInference(): string {
   return venvPython;
 }
 
-export async function predictWithModel(
-  imagePath: string, 
-  modelInfo: ModelInfo
-): Promise<PredictionResult> {
-  return new Promise((resolve, reject) => {
-    const pythonScript = path.join(__dirname, '..', '..', 'MLStudio-main', 'worker', 'predict.py');
-    
-    if (!fs.existsSync(pythonScript)) {
-      console.error('Python inference script not found at:', pythonScript);
-      reject(new Error('AI model inference script not available. Please ensure MLStudio is properly set up.'));
-      return;
+function toPredictionResult(result: any): PredictionResult {
+  if (result.error) {
+    console.error('Inference error:', result.error);
+    throw new Error(`AI model inference failed: ${result.error}`);
+  }
+
+  if (!Array.isArray(result.predictions) || result.predictions.length === 0) {
+    console.error('No predictions returned from model');
+    throw new Error('AI model returned no predictions. The model may need retraining.');
+  }
+
+  const predictions = result.predictions.map((p: any) => ({
+    class: p.class,
+    className: MATERIAL_NAMES[p.class] || p.class,
+    confidence: p.confidence
+  }));
+
+  predictions.sort((a: any, b: any) => b.confidence - a.confidence);
+
+  return {
+    predictions: predictions.slice(0, 5),
+    topPrediction: predictions[0],
+    modelUsed: result.model || 'MLStudio Model',
+    isSimulation: false
+  };
+}
+
+// Results for re-uploaded images are served from this cache without inference
+const PREDICTION_CACHE_DB = process.env.PREDICTION_CACHE_DB ||
+  path.join(os.tmpdir(), 'ecobuild-prediction-cache.sqlite');
+
+const PREDICT_TIMEOUT_MS = 60000; // Increased timeout to 60 seconds for larger models
+
+// Long-lived `predict.py --serve` process that keeps the model loaded between
+// scans. Requests and responses are JSON lines matched by id.
+class InferenceWorker {
+  private process: ChildProcessWithoutNullStreams;
+  private pending = new Map<number, { resolve: (r: any) => void; reject: (e: Error) => void; timer: NodeJS.Timeout }>();
+  private nextId = 1;
+  private buffer = '';
+  alive = true;
+
+  constructor(pythonScript: string, readonly modelPath: string, readonly labelsPath: string) {
+    this.process = spawn(resolvePythonForInference(), [
+      pythonScript,
+      '--serve',
+      '--model', modelPath,
+      '--labels', labelsPath,
+      '--cache-db', PREDICTION_CACHE_DB
+    ]);
+
+    this.process.stdout.on('data', (data) => this.onData(data.toString()));
+    this.process.stderr.on('data', (data) => {
+      console.error('Inference worker stderr:', data.toString());
+    });
+    this.process.on('error', (err) => this.shutdown(err));
+    this.process.on('close', (code) => {
+      this.shutdown(new Error(`Inference worker exited with code ${code}`));
+    });
+  }
+
+  private onData(chunk: string) {
+    this.buffer += chunk;
+    let newline: number;
+    while ((newline = this.buffer.indexOf('\n')) >= 0) {
+      const line = this.buffer.slice(0, newline).trim();
+      this.buffer = this.buffer.slice(newline + 1);
+      if (!line.startsWith('{')) continue;
+      try {
+        const message = JSON.parse(line);
+        const entry = this.pending.get(message.id);
+        if (!entry) continue;
+        this.pending.delete(message.id);
+        clearTimeout(entry.timer);
+        entry.resolve(message);
+      } catch (e) {
+        console.error('Error parsing inference worker output:', e);
+      }
     }
+  }
 
-    if (!fs.existsSync(modelInfo.modelPath)) {
-      console.error('Model file not found at:', modelInfo.modelPath);
-      reject(new Error('No trained AI model found. Please train a model in MLStudio first.'));
-      return;
+  request(payload: Record<string, unknown>): Promise<any> {
+    return new Promise((resolve, reject) => {
+      const id = this.nextId++;
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error('AI model prediction timed out. Please try again.'));
+      }, PREDICT_TIMEOUT_MS);
+      this.pending.set(id, { resolve, reject, timer });
+      this.process.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+    });
+  }
+
+  shutdown(reason?: Error) {
+    if (!this.alive) return;
+    this.alive = false;
+    this.process.kill();
+    for (const { reject, timer } of Array.from(this.pending.values())) {
+      clearTimeout(timer);
+      reject(reason || new Error('Inference worker stopped'));
     }
+    this.pending.clear();
+  }
+}
+
+let inferenceWorker: InferenceWorker | null = null;
 
+// One worker serves every model: requests name their model and labels, and the
+// worker keeps recently used models in its cache, so switching between the
+// ML Studio and EcoBuild models does not restart Python.
+function getInferenceWorker(pythonScript: string, modelInfo: ModelInfo): InferenceWorker {
+  if (inferenceWorker && inferenceWorker.alive) {
+    return inferenceWorker;
+  }
+  inferenceWorker = new InferenceWorker(pythonScript, modelInfo.modelPath, modelInfo.labelsPath);
+  return inferenceWorker;
+}
+
+function predictOnce(pythonScript: string, imagePath: string, modelInfo: ModelInfo): Promise<PredictionResult> {
+  return new Promise((resolve, reject) => {
     const pythonExecutable = resolvePythonForInference();
 
     const pythonProcess = spawn(pythonExecutable, [
@@ -128,37 +230,18 @@ export async function predictWithModel(
 
     pythonProcess.on('close', (code) => {
       if (code === 0) {
+        let result;
         try {
-          const result = JSON.parse(stdout);
-          if (result.error) {
-            console.error('Inference error:', result.error);
-            reject(new Error(`AI model inference failed: ${result.error}`));
-            return;
-          }
-          
-          if (!Array.isArray(result.predictions) || result.predictions.length === 0) {
-            console.error('No predictions returned from model');
-            reject(new Error('AI model returned no predictions. The model may need retraining.'));
-            return;
-          }
-
-          const predictions = result.predictions.map((p: any) => ({
-            class: p.class,
-            className: MATERIAL_NAMES[p.class] || p.class,
-            confidence: p.confidence
-          }));
-
-          predictions.sort((a: any, b: any) => b.confidence - a.confidence);
-
-          resolve({
-            predictions: predictions.slice(0, 5),
-            topPrediction: predictions[0],
-            modelUsed: result.model || 'MLStudio Model',
-            isSimulation: false
-          });
+          result = JSON.parse(stdout);
         } catch (e) {
           console.error('Error parsing prediction result:', e);
           reject(new Error('Failed to parse AI model prediction results.'));
+          return;
+        }
+        try {
+          resolve(toPredictionResult(result));
+        } catch (e) {
+          reject(e);
         }
       } else {
         console.error('Python inference failed with code:', code, 'stderr:', stderr);
@@ -174,10 +257,47 @@ export async function predictWithModel(
     setTimeout(() => {
       pythonProcess.kill();
       reject(new Error('AI model prediction timed out. Please try again.'));
-    }, 60000); // Increased timeout to 60 seconds for larger models
+    }, PREDICT_TIMEOUT_MS);
   });
 }
 
+export async function predictWithModel(
+  imagePath: string, 
+  modelInfo: ModelInfo
+): Promise<PredictionResult> {
+  const pythonScript = path.join(__dirname, '..', '..', 'MLStudio-main', 'worker', 'predict.py');
+
+  if (!fs.existsSync(pythonScript)) {
+    console.error('Python inference script not found at:', pythonScript);
+    throw new Error('AI model inference script not available. Please ensure MLStudio is properly set up.');
+  }
+
+  if (!fs.existsSync(modelInfo.modelPath)) {
+    console.error('Model file not found at:', modelInfo.modelPath);
+    throw new Error('No trained AI model found. Please train a model in MLStudio first.');
+  }
+
+  // Set ECOBUILD_INFERENCE_SERVER=false to spawn one process per scan instead
+  if (process.env.ECOBUILD_INFERENCE_SERVER === 'false') {
+    return predictOnce(pythonScript, imagePath, modelInfo);
+  }
+
+  const worker = getInferenceWorker(pythonScript, modelInfo);
+  let result;
+  try {
+    result = await worker.request({
+      image: imagePath,
+      model: modelInfo.modelPath,
+      labels: modelInfo.labelsPath
+    });
+  } catch (err) {
+    if (worker.alive) throw err;
+    console.error('Inference worker stopped, falling back to one-off process:', err);
+    return predictOnce(pythonScript, imagePath, modelInfo);
+  }
+  return toPredictionResult(result);
+}
+
 function simulatePrediction(): PredictionResult {
   const materialKeys = Object.keys(MATERIAL_NAMES);
   const randomIndex = Math.floor(Math.random() * materialKeys.length);